@@ -9,10 +9,177 @@
 # See the LICENSE file for more details.
 #
 
+import os
+import json
+import queue
+import atexit
 import logging
+import contextvars
+from datetime import datetime
 import logging.handlers
 import configuration
 
+# Records are formatted and written by a listener thread so a request thread
+# never waits on the console or the log file. When the queue is full, records
+# below WARNING are dropped. WARNING and above wait up to QueueBlockSeconds
+# for room before they are dropped too. The listener reports the count of
+# dropped records.
+QueueBlockSeconds = 0.5
+
+# The running listener and the handler feeding it
+_listener = None
+_queue_handler = None
+
+# Correlation id of the Flask request being handled by the current thread.
+# It is copied onto every log record as request_id.
+_request_id = contextvars.ContextVar("request_id", default="-")
+
+# LogRecord attributes that are not extra fields
+_RECORD_ATTRIBUTES = set(logging.makeLogRecord({}).__dict__) | {"message", "asctime", "request_id"}
+
+
+########################################################################
+# Correlation id of the current request
+def GetRequestId():
+  return _request_id.get()
+
+# Set the correlation id, returns a token for ResetRequestId
+def SetRequestId(request_id):
+  return _request_id.set(request_id)
+
+def ResetRequestId(token):
+  try:
+    _request_id.reset(token)
+  except ValueError:
+    # The token was created in another context
+    _request_id.set("-")
+
+
+########################################################################
+# Stamps each record with the correlation id. Runs on the thread that
+# logged the record, before it is queued.
+class RequestIdFilter(logging.Filter):
+  def filter(self, record):
+    record.request_id = _request_id.get()
+    return True
+
+
+########################################################################
+# One JSON object per line. Fields passed through extra= (e.g. duration_ms)
+# are included as they are.
+class JSONLineFormatter(logging.Formatter):
+  def format(self, record):
+    entry = {
+      "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+      "level": record.levelname,
+      "logger": record.name,
+      "module": record.module,
+      "request_id": getattr(record, "request_id", "-"),
+      "msg": record.getMessage(),
+    }
+    for key, value in record.__dict__.items():
+      if key not in _RECORD_ATTRIBUTES:
+        entry[key] = value
+    if record.exc_info:
+      entry["exc"] = self.formatException(record.exc_info)
+    return json.dumps(entry, default=str)
+
+
+########################################################################
+# Handler that puts records on a bounded queue
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+  def __init__(self, log_queue):
+    super().__init__(log_queue)
+    # Updated under the handler lock (held by Handler.handle)
+    self.dropped = 0
+
+  def enqueue(self, record):
+    try:
+      if record.levelno >= logging.WARNING:
+        self.queue.put(record, timeout=QueueBlockSeconds)
+      else:
+        self.queue.put_nowait(record)
+    except queue.Full:
+      self.dropped += 1
+
+
+########################################################################
+# Listener that writes records in batches and flushes once per batch
+class BatchingQueueListener(logging.handlers.QueueListener):
+  def __init__(self, log_queue, queue_handler, handlers, batch_size):
+    super().__init__(log_queue, *handlers, respect_handler_level=True)
+    self.queue_handler = queue_handler
+    self.batch_size = batch_size
+    self._reported_drops = 0
+
+  def _monitor(self):
+    q = self.queue
+    while True:
+      batch = [q.get()]
+      while len(batch) < self.batch_size:
+        try:
+          batch.append(q.get_nowait())
+        except queue.Empty:
+          break
+
+      stop = False
+      for record in batch:
+        if record is self._sentinel:
+          stop = True
+        else:
+          self.handle(record)
+      self._report_drops()
+      for handler in self.handlers:
+        handler.flush_batch()
+      for _ in batch:
+        q.task_done()
+      if stop:
+        break
+
+  def _report_drops(self):
+    dropped = self.queue_handler.dropped
+    if dropped != self._reported_drops:
+      record = logging.makeLogRecord({
+        "name": "app", "module": "Logging", "levelno": logging.WARNING, "levelname": "WARNING",
+        "msg": "%d log records dropped, the log queue was full" % (dropped - self._reported_drops)})
+      self._reported_drops = dropped
+      self.handle(record)
+
+  def enqueue_sentinel(self):
+    # Wait for room, the queue may be full
+    self.queue.put(self._sentinel)
+
+
+########################################################################
+# Handlers that defer flushing to the end of a batch
+class BatchedStreamHandler(logging.StreamHandler):
+  def flush(self):
+    pass
+
+  def flush_batch(self):
+    super().flush()
+
+
+class BatchedTimedRotatingFileHandler(logging.handlers.TimedRotatingFileHandler):
+  def flush(self):
+    pass
+
+  def flush_batch(self):
+    super().flush()
+
+
+########################################################################
+# Lazy JSON rendering of a log argument. The dump only happens when the
+# record is actually emitted, e.g.
+#   logger.debug("Program: %s", LazyJSON(program))
+class LazyJSON:
+  def __init__(self, value, indent=4):
+    self.value = value
+    self.indent = indent
+
+  def __str__(self):
+    return json.dumps(self.value, indent=self.indent)
+
 ########################################################################
 # Enable logging for the AtHomePowerlineServer application
 # TODO In order to get dual logging to work, we'll need to create
@@ -24,47 +191,111 @@ def EnableServerLogging():
   logdateformat = '%Y-%m-%d %H:%M:%S'
 
   # Logging level override
-  log_level_override = configuration.Configuration.LogLevel().lower()
-  if log_level_override == "debug":
-    loglevel = logging.DEBUG
-  elif log_level_override == "info":
-    loglevel = logging.INFO
-  elif log_level_override == "warn":
-    loglevel = logging.WARNING
-  elif log_level_override == "error":
-    loglevel = logging.ERROR
-  else:
-    loglevel = logging.DEBUG
+  loglevel = ParseLogLevel(configuration.Configuration.LogLevel())
 
   logger = logging.getLogger("app")
   logger.setLevel(loglevel)
 
-  formatter = logging.Formatter(logformat, datefmt=logdateformat)
+  if configuration.Configuration.LogFormat() == "json":
+    formatter = JSONLineFormatter()
+  else:
+    formatter = logging.Formatter(logformat, datefmt=logdateformat)
+  handlers = []
 
   # Do we log to console?
   if configuration.Configuration.Logconsole():
-    ch = logging.StreamHandler()
+    ch = BatchedStreamHandler()
     ch.setLevel(loglevel)
     ch.setFormatter(formatter)
-    # logger.addHandler(ch)
-    root_logger = logging.getLogger()
-    root_logger.addHandler(ch)
+    handlers.append(ch)
 
   # Do we log to a file?
   logfile = configuration.Configuration.Logfile()
   if logfile != "":
     # To file
-    fh = logging.handlers.TimedRotatingFileHandler(logfile, when='midnight', backupCount=3)
+    fh = BatchedTimedRotatingFileHandler(logfile, when='midnight', backupCount=3)
     fh.setLevel(loglevel)
     fh.setFormatter(formatter)
-    # logger.addHandler(fh)
-    root_logger = logging.getLogger()
-    root_logger.addHandler(fh)
+    handlers.append(fh)
+
+  if handlers:
+    StartQueuedLogging(handlers, loglevel)
+  if logfile != "":
     logger.debug("Logging to file: %s", logfile)
 
   logger.debug("Logging to console")
 
+# Logging level for a LogLevel configuration value
+def ParseLogLevel(log_level_override):
+  log_level_override = log_level_override.lower()
+  if log_level_override == "debug":
+    loglevel = logging.DEBUG
+  elif log_level_override == "info":
+    loglevel = logging.INFO
+  elif log_level_override == "warn":
+    loglevel = logging.WARNING
+  elif log_level_override == "error":
+    loglevel = logging.ERROR
+  else:
+    loglevel = logging.DEBUG
+  return loglevel
+
+# Apply a new logging level without restarting
+def SetLogLevel(loglevel):
+  logging.getLogger("app").setLevel(loglevel)
+  if _queue_handler is not None:
+    _queue_handler.setLevel(loglevel)
+  if _listener is not None:
+    for handler in _listener.handlers:
+      handler.setLevel(loglevel)
+
+# Configuration reload subscriber
+def ConfigurationChanged(old, new):
+  if old.LogLevel != new.LogLevel:
+    SetLogLevel(ParseLogLevel(new.LogLevel))
+    logging.getLogger("app").info("Logging level changed to %s", new.LogLevel)
+
+# Route root logger output through a bounded queue to a listener thread
+def StartQueuedLogging(handlers, loglevel):
+  global _listener, _queue_handler
+
+  log_queue = queue.Queue(maxsize=configuration.Configuration.LogQueueSize())
+  _queue_handler = BoundedQueueHandler(log_queue)
+  _queue_handler.setLevel(loglevel)
+  _queue_handler.addFilter(RequestIdFilter())
+  _listener = BatchingQueueListener(log_queue, _queue_handler, handlers,
+                                    configuration.Configuration.LogBatchSize())
+  _listener.start()
+
+  root_logger = logging.getLogger()
+  root_logger.addHandler(_queue_handler)
+
+# Write out queued records and stop the listener thread
+def StopQueuedLogging():
+  global _listener
+  if _listener is not None:
+    _listener.stop()
+    _listener = None
+
+# A forked worker process does not inherit the listener thread. Give it
+# its own queue and listener writing to the same handlers.
+def RestartQueuedLoggingAfterFork():
+  global _listener
+  if _listener is None:
+    return
+  log_queue = queue.Queue(maxsize=_queue_handler.queue.maxsize)
+  _queue_handler.queue = log_queue
+  _queue_handler.dropped = 0
+  _listener = BatchingQueueListener(log_queue, _queue_handler, _listener.handlers, _listener.batch_size)
+  _listener.start()
+
+configuration.Configuration.subscribe(ConfigurationChanged)
+atexit.register(StopQueuedLogging)
+if hasattr(os, "register_at_fork"):
+  os.register_at_fork(after_in_child=RestartQueuedLoggingAfterFork)
+
 # Controlled logging shutdown
 def Shutdown():
+  StopQueuedLogging()
   logging.shutdown()
   print("Logging shutdown")
@@ -11,8 +11,15 @@
 #
 #######################################################################
 
+#
+# The app object is created when the package is imported, because the
+# view modules register their routes on it. Everything else (loading the
+# configuration and secret key, starting logging and importing the views)
+# happens in create_app(), which the entry points call once.
+#
+
 import os
-import Logging
+import threading
 import logging
 
 try:
@@ -36,32 +43,70 @@ app.config.update(dict(
 
 ))
 
-# This is the app-specific configuration
-cfg = configuration.Configuration.load_configuration(app.root_path)
+logger = logging.getLogger("app")
+
+_initialized = False
+_init_lock = threading.Lock()
 
-# Load randomly generated secret key from file
-# Reference: http://flask.pocoo.org/snippets/104/
-# Run make_secret_key to create a new key and save it in secret_key
-key_file = configuration.Configuration.SecretKey()
-app.config['SECRET_KEY'] = open(key_file, 'r').read()
 
-# From Flask tutorial
-# ensure the instance folder exists
-try:
-    os.makedirs(app.instance_path)
-except OSError:
-    pass
+def create_app():
+    """
+    Initialize the app. Only the first call does the work.
+    :return: The Flask app
+    """
+    global _initialized
+    with _init_lock:
+        if not _initialized:
+            _initialize()
+            _initialized = True
+    return app
 
-# Start logging
-Logging.EnableServerLogging()
 
-# All views must be imported after the app is defined
-from app.views import page_views
-from app.views import json_views
+def _initialize():
+    import Logging
 
-logger = logging.getLogger("app")
+    # This is the app-specific configuration
+    configuration.Configuration.load_configuration(app.root_path)
+
+    # Load randomly generated secret key from file
+    # Reference: http://flask.pocoo.org/snippets/104/
+    # Run make_secret_key to create a new key and save it in secret_key
+    key_file = configuration.Configuration.SecretKey()
+    with open(key_file, 'r') as f:
+        app.config['SECRET_KEY'] = f.read()
+
+    # From Flask tutorial
+    # ensure the instance folder exists
+    try:
+        os.makedirs(app.instance_path)
+    except OSError:
+        pass
+
+    # Start logging
+    Logging.EnableServerLogging()
+
+    # Reload the configuration when the file changes
+    configuration.Configuration.start_watcher()
+
+    # Serialize JSON responses through the project codec
+    from app import json_codec
+    if json_codec.CodecJSONProvider is not None:
+        app.json = json_codec.CodecJSONProvider(app)
+
+    # Request correlation ids and the request log
+    from app import request_log
+
+    # Response compression and precompressed static files
+    from app import compression
+    from app import static_assets
+
+    # All views must be imported after the app is configured
+    from app.views import page_views
+    from app.views import json_views
+    from app.views import metrics_views
+    from app.views import profile_views
 
-from Version import GetVersion
-logger.info("################################################################################")
-logger.info("Starting AtHomeFRB version %s", GetVersion())
-logger.info("Using configuration file %s", configuration.Configuration.get_configuration_file_path())
+    from Version import GetVersion
+    logger.info("################################################################################")
+    logger.info("Starting AtHomeFRB version %s", GetVersion())
+    logger.info("Using configuration file %s", configuration.Configuration.get_configuration_file_path())
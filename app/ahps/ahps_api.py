@@ -19,24 +19,91 @@
 import socket
 import json
 import logging
+import time
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from configuration import Configuration
+from app import json_codec
+from app import metrics
+from app.ahps.json_reader import JSONFrameReader, JSONArrayStream, DEFAULT_CHUNK_SIZE
+from app.ahps.connection_pool import get_connection_pool
+from app.ahps.response_cache import get_response_cache, frame_digest
+from app.ahps.single_flight import get_single_flight
+from app.ahps.snapshot_store import get_snapshot_store
+from app.ahps.command_listeners import notify_command_listeners
+from app.ahps.ahps_commands import AHPSCommands
 
 logger = logging.getLogger("app")
 
-
-class AHPSRequest:
-    def __init__(self, host=Configuration.Server(), port=Configuration.Port()):
-        """
-        Request instance constructor
-        :param host:
-        :param port:
-        """
-        self._host = host
-        self._port = port
+# Maximum number of pipelined requests waiting for a response
+PIPELINE_WINDOW = 16
+# Number of connections used for a batch when the server
+# only handles one request per connection
+BATCH_FANOUT = 4
+# Commands other than queries that can be sent again when it is
+# not known whether the server received them
+IDEMPOTENT_COMMANDS = {"On", "Off", "AllDevicesOn", "AllDevicesOff", "GroupOn", "GroupOff", "StatusRequest"}
+
+
+def is_idempotent(data):
+    """
+    True if sending a request twice has the same effect as sending it once
+    :param data: A request built with create_request
+    :return:
+    """
+    return data["request"].startswith("Query") or data["request"] in IDEMPOTENT_COMMANDS
+
+
+class AHPSBatch:
+    """
+    Collects the requests made inside of an AHPSRequest.batch() block.
+    After the block ends, responses and errors hold the per-request
+    results in the order the requests were made.
+    """
+    def __init__(self):
+        self.requests = []
+        self.responses = []
+        self.errors = []
+
+
+class AHPSRequest(AHPSCommands):
+    def __init__(self, host=None, port=None, pool=None, read_snapshot=True):
+        """
+        Request instance constructor.
+        The command methods come from AHPSCommands.
+        :param host: Defaults to the configured Server
+        :param port: Defaults to the configured Port
+        :param pool: Connection pool to use. By default the shared pool
+        for host:port is used when ConnectionPoolSize is configured.
+        :param read_snapshot: False to send queries to the server even
+        when the snapshot store could answer them. The responses still
+        update the store.
+        """
+        # Resolved per request so a reloaded configuration takes effect
+        self._host = host if host is not None else Configuration.Server()
+        self._port = port if port is not None else Configuration.Port()
+        host, port = self._host, self._port
+        self._pool = pool if pool is not None else get_connection_pool(host, port)
+        # Shared cache of query responses (None when not configured)
+        self._cache = get_response_cache()
+        # Shared layer that collapses concurrent identical queries (None when turned off)
+        self._flights = get_single_flight()
+        # Local mirror of the configured server (None when not configured)
+        self._snapshot = None
+        if self._host == Configuration.Server() and self._port == Configuration.Port():
+            self._snapshot = get_snapshot_store()
+        self._read_snapshot = read_snapshot
         # The error response from the last request
         self._last_error_msg = None
         # The successful response from the last request
         self._last_response = None
+        # The raw frame of the last response and its digest
+        self._last_frame = None
+        self._last_frame_digest = None
+        # Per request errors from the last send_many
+        self._batch_errors = []
+        # The active batch() block, if any
+        self._batch = None
 
 
     @property
@@ -49,21 +116,24 @@ class AHPSRequest:
         return self._last_response
 
 
-    @staticmethod
-    def create_request(command):
+    @property
+    def last_frame_digest(self):
         """
-        Create an empty server request
-        This is the safe way to create an empty request.
-        The json module seems to be a bit finicky about the
-        format of strings that it converts.
-        :param command:
+        A digest of the raw frame of the last response (None if the last
+        request failed or the response was streamed off the socket). It
+        changes whenever the server's answer changes. Frames from the
+        response cache and the snapshot store come with their digest, any other
+        frame costs one hash of its bytes, so it makes a cheap validator.
         :return:
         """
-        request = {}
-        request["request"] = command
-        # The args parameter is an dictionary.
-        request["args"] = {}
-        return request
+        if self._last_frame_digest is None and self._last_frame is not None:
+            self._last_frame_digest = frame_digest(self._last_frame)
+        return self._last_frame_digest
+
+
+    @property
+    def batch_errors(self):
+        return self._batch_errors
 
 
     def connect_to_server(self):
@@ -93,22 +163,12 @@ class AHPSRequest:
     def read_json(sock):
         """
         Read a JSON payload from a socket
+        Any data received past the end of the payload is discarded.
+        Use a JSONFrameReader directly to keep it.
         :param sock:
         :return:
         """
-        depth = 0
-        json_data = ""
-
-        while (True):
-            c = sock.recv(1).decode()
-            json_data += c
-
-            if (c == "{"):
-                depth += 1
-            if (c == "}"):
-                depth -= 1
-                if (depth == 0):
-                    return json_data
+        return JSONFrameReader().read_frame(sock).decode()
 
 
     @staticmethod
@@ -135,482 +195,351 @@ class AHPSRequest:
         :param data:
         :return:
         """
+        if self._batch is not None:
+            # Sent when the batch block ends
+            self._batch.requests.append(data)
+            return None
+
         self._last_error_msg = None
+        self._last_frame = None
+        self._last_frame_digest = None
 
         # Convert the payload structure into json text.
         # Effectively this serializes the payload.
         # print "raw json:", data
-        json_data = json.JSONEncoder().encode(data)
+        json_data = json_codec.wire_dumps(data)
+
+        command = data["request"]
+        start = time.perf_counter()
+        timings = {}
+        cached = False
+        from_snapshot = False
 
         # send status request to server
-        sock = None
         try:
-            # Create a socket connection to the server
-            sock = self.connect_to_server()
-
-            logger.debug("Sending request: %s", json_data)
-            sock.sendall(json_data.encode())
-
-            # Receive data from the server and shut down
-            json_data = AHPSRequest.read_json(sock)
-            self._last_response = json.loads(json_data)
+            key, frame, generation, digest = None, None, None, None
+            snapshot_generation = None
+            if self._snapshot is not None:
+                frame, digest, snapshot_generation = self._snapshot.lookup(data, self._read_snapshot)
+                from_snapshot = frame is not None
+            if frame is None and self._cache is not None:
+                key, frame, generation, digest = self._cache.lookup(data)
+                cached = frame is not None
+            if frame is not None:
+                logger.debug("%s response for request: %s", "Cached" if cached else "Snapshot", json_data)
+            else:
+                logger.debug("Sending request: %s", json_data)
+                if self._flights is not None:
+                    frame = self._flights.do((self._host, self._port), data,
+                                             lambda: self._transact(json_data.encode(), timings,
+                                                                    is_idempotent(data)))
+                else:
+                    frame = self._transact(json_data.encode(), timings, is_idempotent(data))
+            decode_start = time.perf_counter()
+            self._last_response = json_codec.loads(frame)
+            timings["decode"] = time.perf_counter() - decode_start
+            if key is not None and generation is not None and self._last_response.get("result-code") == 0:
+                self._cache.store(key, frame, generation)
+            if self._snapshot is not None and frame is not None and not (from_snapshot or cached) and \
+                    self._last_response.get("result-code") == 0:
+                self._snapshot.store(data, self._last_response, snapshot_generation)
+            self._last_frame = frame
+            self._last_frame_digest = digest
+            if self._last_response.get("result-code"):
+                metrics.ahps_failures.inc((command, str(self._last_response["result-code"])))
         except Exception as ex:
             logger.error(str(ex))
             self._last_error_msg = {"message": str(ex)}
             self._last_response = None
+            metrics.ahps_errors.inc((command, type(ex).__name__))
         finally:
-            if sock:
-                sock.close()
-
+            duration = time.perf_counter() - start
+            metrics.ahps_command_seconds.observe((command,), duration)
+            metrics.observe_phases(command, timings)
+            if self._cache is not None:
+                self._cache.command_completed(data)
+            if self._flights is not None:
+                self._flights.command_completed(data)
+            if self._snapshot is not None:
+                self._snapshot.command_completed(data, self._last_response)
+
+        if logger.isEnabledFor(logging.DEBUG):
+            duration_ms = round(duration * 1000, 2)
+            result_code = self._last_response.get("result-code") if self._last_response else None
+            logger.debug("AHPS command %s %.1fms", command, duration_ms,
+                         extra={"command": command, "duration_ms": duration_ms, "result_code": result_code,
+                                "cached": cached, "snapshot": from_snapshot, "error": self._last_error_msg is not None})
+        notify_command_listeners(data, self._last_response)
         return self.last_response
 
 
-    def device_on(self, device_id, color=None, brightness=None):
+    def _transact(self, payload, timings=None, retry=True):
         """
-        Send device on command
-        :param address:
-        :param color:
-        :param brightness:
+        Send an encoded request and receive the response frame
+        :param payload:
+        :param timings: Optional dict that receives the phase timings
+        :param retry: False if the request must not be sent twice
         :return:
         """
-        data = AHPSRequest.create_request("On")
-        data["args"]["device-id"] = device_id
-
-        # Optional color and brightness overrides
-        if color is not None:
-            data["args"]["device-color"] = color
-        if brightness is not None:
-            data["args"]["device-brightness"] = brightness
-
-        return self.send_command(data)
-
-
-    def device_off(self, device_id):
-        """
-        Send device off command
-        :param address:
-        :param dim_amount:
-        :return:
-        """
-        data = AHPSRequest.create_request("Off")
-        data["args"]["device-id"] = device_id
-
-        return self.send_command(data)
-
-
-    def new_device_on(self, device_mfg, device_address, device_channel,
-                      device_name, device_color, device_brightness):
-        """
-        Turn a new device on ( a new device is not in the AHPS database)
-        :param device_mfg:
-        :param device_address:
-        :param device_channel:
-        :param device_name:
-        :param device_color:
-        :param device_brightness:
-        :return:
-        """
-        data = AHPSRequest.create_request("On")
-        data["args"]["device-mfg"] = device_mfg
-        data["args"]["device-address"] = device_address
-        data["args"]["device-channel"] = device_channel
-        data["args"]["device-name"] = device_name
-        data["args"]["device-color"] = device_color
-        data["args"]["device-brightness"] = device_brightness
-
-        return self.send_command(data)
-
-
-    def new_device_off(self, device_mfg, device_address, device_channel, device_name):
-        data = AHPSRequest.create_request("Off")
-        data["args"]["device-mfg"] = device_mfg
-        data["args"]["device-address"] = device_address
-        data["args"]["device-channel"] = device_channel
-        data["args"]["device-name"] = device_name
-
-        return self.send_command(data)
-
-
-    def device_dim(self, device_id, dim_amount):
-        """
-        Send dim device command
-        :param device_id:
-        :param dim_amount:
-        :return:
-        """
-        data = AHPSRequest.create_request("Dim")
-        data["args"]["device-id"] = device_id
-        data["args"]["dim-amount"] = dim_amount
-
-        return self.send_command(data)
-
+        if self._pool is not None:
+            return self._pool.transact(payload, timings, retry)
 
-    def device_bright(self, device_id, bright_amount):
-        """
-        Send brighten device command
-        :param device_id:
-        :param bright_amount:
-        :return:
-        """
-        data = AHPSRequest.create_request("Bright")
-        data["args"]["device-id"] = device_id
-        data["args"]["bright-amount"] = bright_amount
-
-        return self.send_command(data)
-
-
-    def all_devices_off(self):
-        """
-        Send all units off command
-        :param house_code:
-        :return:
-        """
-        data = AHPSRequest.create_request("AllDevicesOff")
-
-        return self.send_command(data)
-
-
-    def all_devices_on(self):
-        """
-        Send all lights on command
-        :return:
-        """
-        data = AHPSRequest.create_request("AllDevicesOn")
-
-        return self.send_command(data)
-
-
-    def status_request(self):
-        """
-        Send status request command
-        :return:
-        """
-        data = AHPSRequest.create_request("StatusRequest")
-
-        return self.send_command(data)
-
-
-    def get_all_devices(self):
-        """
-        Query for all devices
-        :return:
-        """
-        req = AHPSRequest.create_request("QueryDevices")
-        response = self.send_command(req)
-        return response
-
-
-    def discover_devices(self):
-        """
-        Discover all devices in local network
-        :return:
-        """
-        req = AHPSRequest.create_request("DiscoverDevices")
-        response = self.send_command(req)
-        return response
-
-
-    def get_all_available_devices(self, manufacturer):
-        """
-        Query for all available devices of a given type
-        :return:
-        """
-        req = AHPSRequest.create_request("QueryAvailableDevices")
-        req["args"]["type"] = manufacturer
-        response = self.send_command(req)
-        return response
-
-
-    def get_device(self, device_id):
-        """
-        Query a device by its device id
-        :param device_id:
-        :return:
-        """
-        req = AHPSRequest.create_request("QueryDevices")
-        req["args"]["device-id"] = device_id
-        response = self.send_command(req)
-        return response
-
-
-    def define_device(self, device_name, device_location, device_mfg,
-                      device_address, device_channel, device_color, device_brightness):
-        """
-        Define (create) a new device
-        :param device_name:
-        :param device_location:
-        :param device_mfg:
-        :param device_address:
-        :param device_channel
-        :param device_color:
-        :param device_brightness
-        :return:
-        """
-        req = AHPSRequest.create_request("DefineDevice")
-        req["args"]["device-name"] = device_name
-        req["args"]["device-location"] = device_location
-        req["args"]["device-mfg"] = device_mfg
-        req["args"]["device-address"] = device_address
-        req["args"]["device-channel"] = device_channel
-        req["args"]["device-color"] = device_color
-        req["args"]["device-brightness"] = device_brightness
-        response = self.send_command(req)
-        return response
-
-
-    def update_device(self, device_id, device_name, device_location, device_mfg, device_address,
-                      device_channel, device_color, device_brightness):
-        """
-        Update an existing device
-        :param device_id:
-        :param device_name:
-        :param device_location:
-        :param device_mfg:
-        :param device_address:
-        :param device_channel:
-        :param device_color:
-        :param device_brightness:
-        :return:
-        """
-        req = AHPSRequest.create_request("UpdateDevice")
-        req["args"]["device-id"] = device_id
-        req["args"]["device-name"] = device_name
-        req["args"]["device-location"] = device_location
-        req["args"]["device-mfg"] = device_mfg
-        req["args"]["device-address"] = device_address
-        req["args"]["device-channel"] = device_channel
-        req["args"]["device-color"] = device_color
-        req["args"]["device-brightness"] = device_brightness
-
-        response = self.send_command(req)
-        return response
-
-
-    def delete_device(self, device_id):
-        """
-        Delete a device by its device id
-        :param device_id:
-        :return:
-        """
-        req = AHPSRequest.create_request("DeleteDevice")
-        req["args"]["device-id"] = device_id
-        response = self.send_command(req)
-        return response
-
-
-    def get_all_programs(self):
-        """
-        Query for all programs
-        :return:
-        """
-        req = AHPSRequest.create_request("QueryPrograms")
-        response = self.send_command(req)
-        return response
-
-
-    def delete_program(self, program_id):
-        """
-        Delete a program by its ID
-        :param program_id:
-        :return:
-        """
-        req = AHPSRequest.create_request("DeleteProgram")
-        req["args"]["program-id"] = program_id
-        response = self.send_command(req)
-        return response
-
-
-    def get_programs_for_device_id(self, device_id):
-        """
-        Query for all programs for a given device id
-        :param device_id:
-        :return:
-        """
-        req = AHPSRequest.create_request("QueryDevicePrograms")
-        req["args"]["device-id"] = device_id
-        response = self.send_command(req)
-        return response
-
-
-    def get_available_programs_for_device_id(self, device_id):
-        """
-        Query for all programs available for assignment to a given device id
-        :param device_id:
-        :return:
-        """
-        req = AHPSRequest.create_request("QueryAvailablePrograms")
-        req["args"]["device-id"] = device_id
-        response = self.send_command(req)
-        return response
-
-    def assign_program_to_device(self, device_id, program_id):
-        req = AHPSRequest.create_request("AssignProgram")
-        req["args"]["device-id"] = device_id
-        req["args"]["program-id"] = program_id
-        response = self.send_command(req)
-        return response
-
-    def assign_program_to_group_devices(self, group_id, program_id):
-        req = AHPSRequest.create_request("AssignProgramToGroup")
-        req["args"]["group-id"] = group_id
-        req["args"]["program-id"] = program_id
-        response = self.send_command(req)
-        return response
-
-
-    def get_program_by_id(self, program_id):
-        """
-        Query for a program by its id
-        :param program_id:
-        :return:
-        """
-        req = AHPSRequest.create_request("QueryDeviceProgram")
-        req["args"]["program-id"] = program_id
-        response = self.send_command(req)
-        return response
-
-    def define_device_program(self, program):
-        req = AHPSRequest.create_request("DefineProgram")
-        req["args"] = program
-        response = self.send_command(req)
-        return response
-
-    def update_device_program(self, program):
-        req = AHPSRequest.create_request("UpdateProgram")
-        req["args"] = program
-        response = self.send_command(req)
-        return response
-
-
-    def delete_device_program(self, device_id, program_id):
-        """
-        Delete a device program from its device
-        :param program_id:
-        :return:
-        """
-        req = AHPSRequest.create_request("DeleteDeviceProgram")
-        req["args"]["device-id"] = device_id
-        req["args"]["program-id"] = program_id
-        response = self.send_command(req)
-        return response
+        # Create a socket connection to the server
+        start = time.perf_counter()
+        sock = self.connect_to_server()
+        try:
+            connected = time.perf_counter()
+            sock.sendall(payload)
+            sent = time.perf_counter()
+            # Receive data from the server and shut down
+            reader = JSONFrameReader()
+            frame = reader.read_frame(sock)
+            if timings is not None:
+                metrics.transfer_phases(timings, start, connected, sent, reader.first_byte_time,
+                                        time.perf_counter())
+            return frame
+        finally:
+            sock.close()
 
 
-    def get_all_action_groups(self):
+    def iter_items(self, data, key):
         """
-        Query for all action groups
+        Send a query and yield the elements of one array member of its
+        response (e.g. devices) as they arrive off the socket.
+        Once the generator is exhausted, last_response holds the rest of
+        the response. If the response has no such member, or the request
+        fails before any element was yielded, nothing is yielded and
+        last_error is set. A failure after that raises, because the
+        elements already yielded are not the complete list.
+        A response from the response cache or snapshot store is used when
+        there is one, but a streamed response is not stored in either.
+        Storing it would mean keeping the whole response in memory.
+        :param data: A request built with create_request
+        :param key: Name of the array member
         :return:
         """
-        req = AHPSRequest.create_request("QueryActionGroups")
-        response = self.send_command(req)
-        return response
+        self._last_error_msg = None
+        self._last_response = None
+        self._last_frame = None
+        self._last_frame_digest = None
+
+        frame, digest = None, None
+        if self._snapshot is not None:
+            frame, digest, _ = self._snapshot.lookup(data, self._read_snapshot)
+        if frame is None and self._cache is not None:
+            _, frame, _, digest = self._cache.lookup(data)
+        if frame is not None:
+            response = json_codec.loads(frame)
+            items = response.pop(key, None)
+            self._last_response = response
+            if items is None:
+                self._last_error_msg = {"message": response.get("message", "Response has no {0}".format(key))}
+                return
+            # Makes last_frame_digest available
+            self._last_frame = frame
+            self._last_frame_digest = digest
+            yield from items
+            return
+
+        json_data = json_codec.wire_dumps(data)
+        logger.debug("Streaming request: %s", json_data)
+        stream = JSONArrayStream(key)
+        conn = None
+        sock = None
+        yielded = False
+        completed = False
+        try:
+            if self._pool is not None:
+                conn, _ = self._pool.acquire()
+                sock = conn.sock
+            else:
+                sock = self.connect_to_server()
+            sock.sendall(json_data.encode())
 
+            while not stream.done:
+                chunk = sock.recv(DEFAULT_CHUNK_SIZE)
+                if not chunk:
+                    raise ConnectionError("Server closed the connection before sending a complete response")
+                for item in stream.feed(chunk):
+                    yielded = True
+                    yield item
+            completed = True
+        except Exception as ex:
+            logger.error(str(ex))
+            self._last_error_msg = {"message": str(ex)}
+            if yielded:
+                raise
+            return
+        finally:
+            # A connection abandoned part way through a response can't be reused
+            if conn is not None:
+                if completed:
+                    conn.reader.feed(stream.remainder())
+                    self._pool.release(conn)
+                else:
+                    self._pool.discard(conn)
+            elif sock is not None:
+                sock.close()
 
-    def get_action_group(self, group_id):
-        """
-        Query for an action group
-        :return:
-        """
-        req = AHPSRequest.create_request("QueryActionGroup")
-        req["args"]["group-id"] = group_id
-        response = self.send_command(req)
-        return response
+        self._last_response = stream.envelope
+        if not stream.found:
+            self._last_error_msg = {"message": stream.envelope.get("message", "Response has no {0}".format(key))}
 
 
-    def define_action_group(self, group_name):
+    def iter_devices(self):
         """
-        Define (create) a new device
-        :param group_name:
-        :return:
+        Stream all devices
+        :return: A generator of device dicts
         """
-        req = AHPSRequest.create_request("DefineActionGroup")
-        req["args"]["group-name"] = group_name
-        response = self.send_command(req)
-        return response
+        return self.iter_items(self.create_request("QueryDevices"), "devices")
 
 
-    def delete_action_group(self, group_id):
+    def iter_programs(self):
         """
-        Delete a device group
-        :param group_id:
-        :return:
+        Stream all programs
+        :return: A generator of program dicts
         """
-        req = AHPSRequest.create_request("DeleteActionGroup")
-        req["args"]["group-id"] = group_id
-        response = self.send_command(req)
-        return response
-
+        return self.iter_items(self.create_request("QueryPrograms"), "programs")
 
-    def update_action_group(self, group):
-        req = AHPSRequest.create_request("UpdateActionGroup")
-        req["args"] = group
-        response = self.send_command(req)
-        return response
 
-
-    def get_action_group_devices(self, group_id):
+    def iter_action_groups(self):
         """
-        Query for all devices in an action group
-        :return:
+        Stream all action groups
+        :return: A generator of group dicts
         """
-        req = AHPSRequest.create_request("QueryActionGroupDevices")
-        req["args"]["group-id"] = group_id
-        response = self.send_command(req)
-        return response
+        return self.iter_items(self.create_request("QueryActionGroups"), "groups")
 
 
-    def get_available_devices_for_group_id(self, group_id):
-        """
-        Query for all devices available for assignment to a given group id
-        :param device_id:
-        :return:
+    @contextmanager
+    def batch(self):
         """
-        req = AHPSRequest.create_request("QueryAvailableGroupDevices")
-        req["args"]["group-id"] = group_id
-        response = self.send_command(req)
-        return response
-
-    def assign_device_to_group(self, group_id, device_id):
-        req = AHPSRequest.create_request("AssignDevice")
-        req["args"]["group-id"] = group_id
-        req["args"]["device-id"] = device_id
-        response = self.send_command(req)
-        return response
+        Collect the commands issued inside of a with block and send
+        them together through send_many when the block ends.
+        Command methods return None inside of the block.
 
+            with api_req.batch() as batch:
+                for device in devices:
+                    api_req.update_device(...)
+            batch.responses, batch.errors
 
-    def group_on(self, group_id):
+        :return: An AHPSBatch
         """
-        Send group on command
-        :param group_id:
-        :return:
+        batch = AHPSBatch()
+        self._batch = batch
+        try:
+            yield batch
+        finally:
+            self._batch = None
+        batch.responses = self.send_many(batch.requests)
+        batch.errors = self.batch_errors
+
+
+    def send_many(self, requests):
+        """
+        Send a list of requests to the server.
+        When the connection pool has seen the server keep a connection open,
+        the requests are pipelined over one connection. Otherwise, and for
+        the requests that did not get a response there, every request gets
+        its own connection, several at a time. A request that was sent but
+        got no response is only sent again if it is idempotent.
+        :param requests: List of requests built with create_request
+        :return: List of responses in request order. A failed request has
+        a None response and its error in batch_errors.
+        """
+        payloads = [json_codec.wire_dumps_bytes(data) for data in requests]
+        responses = [None] * len(payloads)
+        self._batch_errors = [None] * len(payloads)
+        self._last_error_msg = None
+        logger.debug("Sending batch of %d requests", len(payloads))
+
+        if payloads and self._pool is not None and self._pool.keeps_alive:
+            self._pipeline(requests, payloads, responses)
+
+        remaining = [i for i, frame in enumerate(responses) if frame is None]
+        if remaining:
+            with ThreadPoolExecutor(max_workers=min(BATCH_FANOUT, len(remaining))) as executor:
+                frames = executor.map(self._transact_item, [payloads[i] for i in remaining],
+                                      [is_idempotent(requests[i]) for i in remaining])
+                for i, frame in zip(remaining, frames):
+                    responses[i] = frame
+
+        for i, frame in enumerate(responses):
+            if isinstance(frame, Exception):
+                self._batch_errors[i] = {"message": str(frame)}
+                responses[i] = None
+            elif frame is not None:
+                try:
+                    responses[i] = json_codec.loads(frame)
+                except Exception as ex:
+                    self._batch_errors[i] = {"message": str(ex)}
+                    responses[i] = None
+
+        for data, response in zip(requests, responses):
+            if self._cache is not None:
+                self._cache.command_completed(data)
+            if self._flights is not None:
+                self._flights.command_completed(data)
+            if self._snapshot is not None:
+                self._snapshot.command_completed(data, response)
+            notify_command_listeners(data, response)
+
+        errors = [e for e in self._batch_errors if e is not None]
+        if errors:
+            logger.error("%d of %d batched requests failed", len(errors), len(payloads))
+            self._last_error_msg = errors[0]
+        self._last_response = responses[-1] if responses else None
+        return responses
+
+
+    def _pipeline(self, requests, payloads, responses):
+        """
+        Send requests over a single pooled connection, reading responses as
+        they arrive, with at most PIPELINE_WINDOW requests outstanding.
+        :param requests: The requests
+        :param payloads: Encoded requests
+        :param responses: Receives the response frames. A request that was
+        sent but got no response and must not be sent again gets the error.
+        Requests left at None still have to be sent.
+        :return: The number of responses received
         """
-        data = AHPSRequest.create_request("GroupOn")
-        data["args"]["group-id"] = group_id
-
-        return self.send_command(data)
-
+        try:
+            conn, _ = self._pool.acquire()
+        except Exception:
+            return 0
+        sock, reader = conn.sock, conn.reader
 
-    def group_off(self, group_id):
-        """
-        Send group off command
-        :param address:
-        :param dim_amount:
-        :return:
-        """
-        data = AHPSRequest.create_request("GroupOff")
-        data["args"]["group-id"] = group_id
+        sent = 0
+        received = 0
+        try:
+            while received < len(payloads):
+                while sent < len(payloads) and sent - received < PIPELINE_WINDOW:
+                    sock.sendall(payloads[sent])
+                    sent += 1
+                responses[received] = reader.read_frame(sock)
+                received += 1
+        except Exception as ex:
+            # Requests not sent yet and idempotent ones that got no
+            # response are sent again on other connections
+            logger.debug("Pipeline ended after %d of %d responses: %s", received, len(payloads), str(ex))
+            self._pool.discard(conn)
+            for i in range(received, sent):
+                if not is_idempotent(requests[i]):
+                    responses[i] = ConnectionError("No response from the server to {0}, not sent again".format(
+                        requests[i]["request"]))
+            return received
 
-        return self.send_command(data)
+        self._pool.release(conn, received)
+        return received
 
 
-    def delete_action_group_device(self, group_id, device_id):
+    def _transact_item(self, payload, retry):
         """
-        Send delete device from action group
-        :param group_id:
-        :param device_id
-        :return:
+        _transact for a single batch item. Errors are returned, not raised.
+        :param payload:
+        :param retry: False if the request must not be sent twice
+        :return: The response frame or the exception
         """
-        data = AHPSRequest.create_request("DeleteActionGroupDevice")
-        data["args"]["group-id"] = group_id
-        data["args"]["device-id"] = device_id
-
-        return self.send_command(data)
+        try:
+            return self._transact(payload, retry=retry)
+        except Exception as ex:
+            return ex
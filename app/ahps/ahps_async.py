@@ -0,0 +1,178 @@
+# coding: utf-8
+#
+# AHPS Web - web server for managing an AtHomePowerlineServer instance
+# Copyright © 2014, 2020  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import asyncio
+import logging
+from configuration import Configuration
+from app import json_codec
+from app.ahps.json_reader import JSONFrameReader, DEFAULT_CHUNK_SIZE
+from app.ahps.ahps_commands import AHPSCommands
+from app.ahps.response_cache import get_response_cache
+from app.ahps.snapshot_store import get_snapshot_store
+from app.ahps.command_listeners import notify_command_listeners
+
+logger = logging.getLogger("app")
+
+# Default number of seconds allowed for a single request
+DEFAULT_TIMEOUT = 30.0
+# Default number of requests allowed in flight at once
+DEFAULT_MAX_CONCURRENCY = 100
+
+
+class AsyncAHPSRequest(AHPSCommands):
+    """
+    asyncio version of AHPSRequest. The command methods are the same but
+    each one returns a coroutine that must be awaited.
+
+        api_req = AsyncAHPSRequest()
+        res = await api_req.device_on(device_id)
+
+    A call can be cancelled or wrapped in asyncio.wait_for for a shorter
+    timeout than the instance default. last_error and last_response
+    reflect the most recently completed call, so use an instance per task
+    when many calls are in flight. Instances can share one limiter to cap
+    the total number of open connections.
+    """
+    def __init__(self, host=None, port=None, timeout=DEFAULT_TIMEOUT, limiter=None):
+        """
+        Request instance constructor
+        :param host: Defaults to the configured server
+        :param port: Defaults to the configured port
+        :param timeout: Seconds allowed for each request (None for no limit)
+        :param limiter: asyncio.Semaphore bounding the number of requests in flight
+        """
+        self._host = host if host is not None else Configuration.Server()
+        self._port = port if port is not None else Configuration.Port()
+        self._timeout = timeout
+        self._limiter = limiter
+        # Shared cache of query responses (None when not configured)
+        self._cache = get_response_cache()
+        # Local mirror of the configured server. Only kept up to date here,
+        # queries are not answered from it and its writes run on an executor
+        # thread so the event loop never waits on SQLite.
+        self._snapshot = None
+        if self._host == Configuration.Server() and self._port == Configuration.Port():
+            self._snapshot = get_snapshot_store()
+        # The error response from the last request
+        self._last_error_msg = None
+        # The successful response from the last request
+        self._last_response = None
+
+
+    @property
+    def last_error(self):
+        return self._last_error_msg
+
+
+    @property
+    def last_response(self):
+        return self._last_response
+
+
+    @staticmethod
+    def create_limiter(max_concurrency=DEFAULT_MAX_CONCURRENCY):
+        """
+        Create a limiter that can be shared by several instances.
+        Must be called from within the event loop that uses it.
+        :param max_concurrency:
+        :return:
+        """
+        return asyncio.Semaphore(max_concurrency)
+
+
+    async def send_command(self, data):
+        """
+        Send a command to the server
+        :param data:
+        :return: The response or None if the request failed.
+        """
+        json_data = json_codec.wire_dumps(data)
+
+        key, frame, generation = None, None, None
+        if self._cache is not None:
+            key, frame, generation, _ = self._cache.lookup(data)
+
+        response = None
+        try:
+            if frame is None:
+                logger.debug("Sending request: %s", json_data)
+                if self._limiter is not None:
+                    async with self._limiter:
+                        frame = await asyncio.wait_for(self._transact(json_data.encode()), self._timeout)
+                else:
+                    frame = await asyncio.wait_for(self._transact(json_data.encode()), self._timeout)
+                response = json_codec.loads(frame)
+                if key is not None and response.get("result-code") == 0:
+                    self._cache.store(key, frame, generation)
+            else:
+                response = json_codec.loads(frame)
+        except asyncio.TimeoutError:
+            logger.error("Request %s timed out", data["request"])
+            self._last_error_msg = {"message": "Request {0} timed out".format(data["request"])}
+            self._last_response = None
+            return None
+        except Exception as ex:
+            logger.error(str(ex))
+            self._last_error_msg = {"message": str(ex)}
+            self._last_response = None
+            return None
+        finally:
+            if self._cache is not None:
+                self._cache.command_completed(data)
+            if self._snapshot is not None and self._snapshot.affected_by(data):
+                await asyncio.get_running_loop().run_in_executor(None, self._snapshot.command_completed,
+                                                                 data, response)
+
+        self._last_error_msg = None
+        self._last_response = response
+        notify_command_listeners(data, response)
+        return response
+
+
+    async def send_many(self, requests):
+        """
+        Send a list of requests concurrently
+        :param requests: List of requests built with create_request
+        :return: List of responses in request order. A failed request
+        has a None response.
+        """
+        return await asyncio.gather(*[self.send_command(data) for data in requests])
+
+
+    async def _transact(self, payload):
+        """
+        Send an encoded request and receive the response frame
+        :param payload:
+        :return:
+        """
+        stream_reader, stream_writer = await asyncio.open_connection(self._host, self._port)
+        try:
+            stream_writer.write(payload)
+            await stream_writer.drain()
+
+            reader = JSONFrameReader(chunk_size=0)
+            frame = reader.next_frame()
+            while frame is None:
+                data = await stream_reader.read(DEFAULT_CHUNK_SIZE)
+                if not data:
+                    raise ConnectionError("Server closed the connection before sending a complete response")
+                reader.feed(data)
+                frame = reader.next_frame()
+            return frame
+        finally:
+            stream_writer.close()
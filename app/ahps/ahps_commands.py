@@ -0,0 +1,492 @@
+# coding: utf-8
+#
+# AHPS Web - web server for managing an AtHomePowerlineServer instance
+# Copyright © 2014, 2020  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+
+class AHPSCommands:
+    """
+    The AtHomePowerlineServer command set.
+    Each command method builds a request and hands it to send_command,
+    which is provided by the transport class (AHPSRequest, AsyncAHPSRequest).
+    The command method returns whatever send_command returns.
+    """
+    @staticmethod
+    def create_request(command):
+        """
+        Create an empty server request
+        This is the safe way to create an empty request.
+        The json module seems to be a bit finicky about the
+        format of strings that it converts.
+        :param command:
+        :return:
+        """
+        request = {}
+        request["request"] = command
+        # The args parameter is an dictionary.
+        request["args"] = {}
+        return request
+
+
+    def device_on(self, device_id, color=None, brightness=None):
+        """
+        Send device on command
+        :param address:
+        :param color:
+        :param brightness:
+        :return:
+        """
+        data = self.create_request("On")
+        data["args"]["device-id"] = device_id
+
+        # Optional color and brightness overrides
+        if color is not None:
+            data["args"]["device-color"] = color
+        if brightness is not None:
+            data["args"]["device-brightness"] = brightness
+
+        return self.send_command(data)
+
+
+    def device_off(self, device_id):
+        """
+        Send device off command
+        :param address:
+        :param dim_amount:
+        :return:
+        """
+        data = self.create_request("Off")
+        data["args"]["device-id"] = device_id
+
+        return self.send_command(data)
+
+
+    def new_device_on(self, device_mfg, device_address, device_channel,
+                      device_name, device_color, device_brightness):
+        """
+        Turn a new device on ( a new device is not in the AHPS database)
+        :param device_mfg:
+        :param device_address:
+        :param device_channel:
+        :param device_name:
+        :param device_color:
+        :param device_brightness:
+        :return:
+        """
+        data = self.create_request("On")
+        data["args"]["device-mfg"] = device_mfg
+        data["args"]["device-address"] = device_address
+        data["args"]["device-channel"] = device_channel
+        data["args"]["device-name"] = device_name
+        data["args"]["device-color"] = device_color
+        data["args"]["device-brightness"] = device_brightness
+
+        return self.send_command(data)
+
+
+    def new_device_off(self, device_mfg, device_address, device_channel, device_name):
+        data = self.create_request("Off")
+        data["args"]["device-mfg"] = device_mfg
+        data["args"]["device-address"] = device_address
+        data["args"]["device-channel"] = device_channel
+        data["args"]["device-name"] = device_name
+
+        return self.send_command(data)
+
+
+    def device_dim(self, device_id, dim_amount):
+        """
+        Send dim device command
+        :param device_id:
+        :param dim_amount:
+        :return:
+        """
+        data = self.create_request("Dim")
+        data["args"]["device-id"] = device_id
+        data["args"]["dim-amount"] = dim_amount
+
+        return self.send_command(data)
+
+
+    def device_bright(self, device_id, bright_amount):
+        """
+        Send brighten device command
+        :param device_id:
+        :param bright_amount:
+        :return:
+        """
+        data = self.create_request("Bright")
+        data["args"]["device-id"] = device_id
+        data["args"]["bright-amount"] = bright_amount
+
+        return self.send_command(data)
+
+
+    def all_devices_off(self):
+        """
+        Send all units off command
+        :param house_code:
+        :return:
+        """
+        data = self.create_request("AllDevicesOff")
+
+        return self.send_command(data)
+
+
+    def all_devices_on(self):
+        """
+        Send all lights on command
+        :return:
+        """
+        data = self.create_request("AllDevicesOn")
+
+        return self.send_command(data)
+
+
+    def status_request(self):
+        """
+        Send status request command
+        :return:
+        """
+        data = self.create_request("StatusRequest")
+
+        return self.send_command(data)
+
+
+    def get_all_devices(self):
+        """
+        Query for all devices
+        :return:
+        """
+        req = self.create_request("QueryDevices")
+        response = self.send_command(req)
+        return response
+
+
+    def discover_devices(self):
+        """
+        Discover all devices in local network
+        :return:
+        """
+        req = self.create_request("DiscoverDevices")
+        response = self.send_command(req)
+        return response
+
+
+    def get_all_available_devices(self, manufacturer):
+        """
+        Query for all available devices of a given type
+        :return:
+        """
+        req = self.create_request("QueryAvailableDevices")
+        req["args"]["type"] = manufacturer
+        response = self.send_command(req)
+        return response
+
+
+    def get_device(self, device_id):
+        """
+        Query a device by its device id
+        :param device_id:
+        :return:
+        """
+        req = self.create_request("QueryDevices")
+        req["args"]["device-id"] = device_id
+        response = self.send_command(req)
+        return response
+
+
+    def define_device(self, device_name, device_location, device_mfg,
+                      device_address, device_channel, device_color, device_brightness):
+        """
+        Define (create) a new device
+        :param device_name:
+        :param device_location:
+        :param device_mfg:
+        :param device_address:
+        :param device_channel
+        :param device_color:
+        :param device_brightness
+        :return:
+        """
+        req = self.create_request("DefineDevice")
+        req["args"]["device-name"] = device_name
+        req["args"]["device-location"] = device_location
+        req["args"]["device-mfg"] = device_mfg
+        req["args"]["device-address"] = device_address
+        req["args"]["device-channel"] = device_channel
+        req["args"]["device-color"] = device_color
+        req["args"]["device-brightness"] = device_brightness
+        response = self.send_command(req)
+        return response
+
+
+    def update_device(self, device_id, device_name, device_location, device_mfg, device_address,
+                      device_channel, device_color, device_brightness):
+        """
+        Update an existing device
+        :param device_id:
+        :param device_name:
+        :param device_location:
+        :param device_mfg:
+        :param device_address:
+        :param device_channel:
+        :param device_color:
+        :param device_brightness:
+        :return:
+        """
+        req = self.create_request("UpdateDevice")
+        req["args"]["device-id"] = device_id
+        req["args"]["device-name"] = device_name
+        req["args"]["device-location"] = device_location
+        req["args"]["device-mfg"] = device_mfg
+        req["args"]["device-address"] = device_address
+        req["args"]["device-channel"] = device_channel
+        req["args"]["device-color"] = device_color
+        req["args"]["device-brightness"] = device_brightness
+
+        response = self.send_command(req)
+        return response
+
+
+    def delete_device(self, device_id):
+        """
+        Delete a device by its device id
+        :param device_id:
+        :return:
+        """
+        req = self.create_request("DeleteDevice")
+        req["args"]["device-id"] = device_id
+        response = self.send_command(req)
+        return response
+
+
+    def get_all_programs(self):
+        """
+        Query for all programs
+        :return:
+        """
+        req = self.create_request("QueryPrograms")
+        response = self.send_command(req)
+        return response
+
+
+    def delete_program(self, program_id):
+        """
+        Delete a program by its ID
+        :param program_id:
+        :return:
+        """
+        req = self.create_request("DeleteProgram")
+        req["args"]["program-id"] = program_id
+        response = self.send_command(req)
+        return response
+
+
+    def get_programs_for_device_id(self, device_id):
+        """
+        Query for all programs for a given device id
+        :param device_id:
+        :return:
+        """
+        req = self.create_request("QueryDevicePrograms")
+        req["args"]["device-id"] = device_id
+        response = self.send_command(req)
+        return response
+
+
+    def get_available_programs_for_device_id(self, device_id):
+        """
+        Query for all programs available for assignment to a given device id
+        :param device_id:
+        :return:
+        """
+        req = self.create_request("QueryAvailablePrograms")
+        req["args"]["device-id"] = device_id
+        response = self.send_command(req)
+        return response
+
+    def assign_program_to_device(self, device_id, program_id):
+        req = self.create_request("AssignProgram")
+        req["args"]["device-id"] = device_id
+        req["args"]["program-id"] = program_id
+        response = self.send_command(req)
+        return response
+
+    def assign_program_to_group_devices(self, group_id, program_id):
+        req = self.create_request("AssignProgramToGroup")
+        req["args"]["group-id"] = group_id
+        req["args"]["program-id"] = program_id
+        response = self.send_command(req)
+        return response
+
+
+    def get_program_by_id(self, program_id):
+        """
+        Query for a program by its id
+        :param program_id:
+        :return:
+        """
+        req = self.create_request("QueryDeviceProgram")
+        req["args"]["program-id"] = program_id
+        response = self.send_command(req)
+        return response
+
+    def define_device_program(self, program):
+        req = self.create_request("DefineProgram")
+        req["args"] = program
+        response = self.send_command(req)
+        return response
+
+    def update_device_program(self, program):
+        req = self.create_request("UpdateProgram")
+        req["args"] = program
+        response = self.send_command(req)
+        return response
+
+
+    def delete_device_program(self, device_id, program_id):
+        """
+        Delete a device program from its device
+        :param program_id:
+        :return:
+        """
+        req = self.create_request("DeleteDeviceProgram")
+        req["args"]["device-id"] = device_id
+        req["args"]["program-id"] = program_id
+        response = self.send_command(req)
+        return response
+
+
+    def get_all_action_groups(self):
+        """
+        Query for all action groups
+        :return:
+        """
+        req = self.create_request("QueryActionGroups")
+        response = self.send_command(req)
+        return response
+
+
+    def get_action_group(self, group_id):
+        """
+        Query for an action group
+        :return:
+        """
+        req = self.create_request("QueryActionGroup")
+        req["args"]["group-id"] = group_id
+        response = self.send_command(req)
+        return response
+
+
+    def define_action_group(self, group_name):
+        """
+        Define (create) a new device
+        :param group_name:
+        :return:
+        """
+        req = self.create_request("DefineActionGroup")
+        req["args"]["group-name"] = group_name
+        response = self.send_command(req)
+        return response
+
+
+    def delete_action_group(self, group_id):
+        """
+        Delete a device group
+        :param group_id:
+        :return:
+        """
+        req = self.create_request("DeleteActionGroup")
+        req["args"]["group-id"] = group_id
+        response = self.send_command(req)
+        return response
+
+
+    def update_action_group(self, group):
+        req = self.create_request("UpdateActionGroup")
+        req["args"] = group
+        response = self.send_command(req)
+        return response
+
+
+    def get_action_group_devices(self, group_id):
+        """
+        Query for all devices in an action group
+        :return:
+        """
+        req = self.create_request("QueryActionGroupDevices")
+        req["args"]["group-id"] = group_id
+        response = self.send_command(req)
+        return response
+
+
+    def get_available_devices_for_group_id(self, group_id):
+        """
+        Query for all devices available for assignment to a given group id
+        :param device_id:
+        :return:
+        """
+        req = self.create_request("QueryAvailableGroupDevices")
+        req["args"]["group-id"] = group_id
+        response = self.send_command(req)
+        return response
+
+    def assign_device_to_group(self, group_id, device_id):
+        req = self.create_request("AssignDevice")
+        req["args"]["group-id"] = group_id
+        req["args"]["device-id"] = device_id
+        response = self.send_command(req)
+        return response
+
+
+    def group_on(self, group_id):
+        """
+        Send group on command
+        :param group_id:
+        :return:
+        """
+        data = self.create_request("GroupOn")
+        data["args"]["group-id"] = group_id
+
+        return self.send_command(data)
+
+
+    def group_off(self, group_id):
+        """
+        Send group off command
+        :param address:
+        :param dim_amount:
+        :return:
+        """
+        data = self.create_request("GroupOff")
+        data["args"]["group-id"] = group_id
+
+        return self.send_command(data)
+
+
+    def delete_action_group_device(self, group_id, device_id):
+        """
+        Send delete device from action group
+        :param group_id:
+        :param device_id
+        :return:
+        """
+        data = self.create_request("DeleteActionGroupDevice")
+        data["args"]["group-id"] = group_id
+        data["args"]["device-id"] = device_id
+
+        return self.send_command(data)
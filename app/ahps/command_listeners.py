@@ -0,0 +1,69 @@
+# coding: utf-8
+#
+# AHPS Web - web server for managing an AtHomePowerlineServer instance
+# Copyright © 2014, 2020  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Hook for code that wants to know when a command succeeds.
+# A listener is called as listener(request, response) after the server
+# reports success for any request that is not a query. Listeners run
+# on the thread that sent the command, so they must be quick.
+#
+
+import logging
+from app.ahps.response_cache import QUERY_FAMILIES
+
+logger = logging.getLogger("app")
+
+_listeners = []
+
+
+def add_command_listener(listener):
+    """
+    Register a listener
+    :param listener: Called as listener(request, response)
+    :return:
+    """
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+def remove_command_listener(listener):
+    """
+    Unregister a listener
+    :param listener:
+    :return:
+    """
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def notify_command_listeners(request, response):
+    """
+    Call the listeners if the request was a successful command
+    :param request: The request sent to the server
+    :param response: The decoded response or None if the request failed
+    :return:
+    """
+    if not _listeners or response is None or response.get("result-code") != 0 or \
+            request["request"] in QUERY_FAMILIES:
+        return
+    for listener in list(_listeners):
+        try:
+            listener(request, response)
+        except Exception as ex:
+            # A broken listener must not fail the command
+            logger.error("Command listener failed: %s", str(ex))
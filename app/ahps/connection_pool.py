@@ -0,0 +1,384 @@
+# coding: utf-8
+#
+# AHPS Web - web server for managing an AtHomePowerlineServer instance
+# Copyright © 2014, 2020  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import socket
+import select
+import threading
+import time
+import logging
+from configuration import Configuration
+from app.ahps.json_reader import JSONFrameReader
+from app.metrics import transfer_phases
+
+logger = logging.getLogger("app")
+
+# Number of times the server must close a used connection (without ever
+# serving a second request on one) before the pool switches to one-shot mode.
+ONE_SHOT_THRESHOLD = 3
+
+
+class PooledConnection:
+    """
+    A socket to the server along with the reader that holds
+    any data received past the last response.
+    """
+    def __init__(self, sock):
+        self.sock = sock
+        self.reader = JSONFrameReader()
+        # Number of requests completed on this connection
+        self.requests = 0
+        # True when the connection counts against the pool size
+        self.pooled = True
+        self.last_used = time.monotonic()
+
+    def is_alive(self):
+        """
+        Health check for an idle connection.
+        An idle connection should have nothing to read. If it is readable
+        the server has either closed it or sent something unexpected.
+        Either way it can't be used for another request.
+        :return:
+        """
+        if self.reader.pending:
+            return False
+        try:
+            readable, _, _ = select.select([self.sock], [], [], 0)
+        except (OSError, ValueError):
+            return False
+        return not readable
+
+    def close(self):
+        try:
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class ConnectionPool:
+    """
+    Thread safe pool of long lived connections to one AtHomePowerlineServer.
+
+    At most max_size connections are open at once. A caller that finds every
+    connection in use waits for one to be released. If the server turns out
+    to close the connection after every response, the pool falls back to
+    one-shot mode where every request gets its own connection.
+    """
+    def __init__(self, host, port, max_size, idle_timeout=30.0):
+        """
+        Pool instance constructor
+        :param host:
+        :param port:
+        :param max_size: Maximum number of open connections
+        :param idle_timeout: Seconds an idle connection is kept
+        """
+        self._host = host
+        self._port = port
+        self._max_size = max_size
+        self._idle_timeout = idle_timeout
+        self._cond = threading.Condition()
+        # Idle connections, most recently used last
+        self._idle = []
+        self._open = 0
+        self._one_shot = False
+        self._keeps_alive = False
+        self._server_closes = 0
+        # Stats
+        self._hits = 0
+        self._misses = 0
+        self._reconnects = 0
+        self._evictions = 0
+        self._waits = 0
+        self._wait_time = 0.0
+
+    @property
+    def one_shot(self):
+        return self._one_shot
+
+    @property
+    def keeps_alive(self):
+        """
+        True once the server has served more than one request on a connection
+        """
+        return self._keeps_alive and not self._one_shot
+
+    def stats(self):
+        """
+        Returns a snapshot of the pool statistics
+        :return:
+        """
+        with self._cond:
+            return {
+                "host": self._host,
+                "port": self._port,
+                "max-size": self._max_size,
+                "open": self._open,
+                "idle": len(self._idle),
+                "one-shot": self._one_shot,
+                "hits": self._hits,
+                "misses": self._misses,
+                "reconnects": self._reconnects,
+                "evictions": self._evictions,
+                "waits": self._waits,
+                "wait-time": self._wait_time
+            }
+
+    def _connect(self):
+        sock = socket.create_connection((self._host, self._port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return PooledConnection(sock)
+
+    def _note_server_close(self, conn):
+        """
+        Called with the pool lock held when the server has closed a connection
+        that completed at least one request.
+        """
+        if conn.requests == 0 or self._keeps_alive or self._one_shot:
+            return
+        self._server_closes += 1
+        if self._server_closes >= ONE_SHOT_THRESHOLD:
+            self._one_shot = True
+            self._cond.notify_all()
+            logger.info("Server %s:%d closes connections after each request, pooling disabled",
+                        self._host, self._port)
+
+    def acquire(self):
+        """
+        Check out a connection
+        :return: A tuple (connection, reused)
+        """
+        with self._cond:
+            waited = None
+            while not self._one_shot:
+                now = time.monotonic()
+                while self._idle:
+                    conn = self._idle.pop()
+                    if now - conn.last_used < self._idle_timeout and conn.is_alive():
+                        self._hits += 1
+                        if waited is not None:
+                            self._wait_time += now - waited
+                        return conn, True
+                    # Stale or closed by the server
+                    self._evictions += 1
+                    self._open -= 1
+                    if now - conn.last_used < self._idle_timeout:
+                        self._note_server_close(conn)
+                    conn.close()
+                if self._open < self._max_size:
+                    self._open += 1
+                    break
+                if waited is None:
+                    waited = now
+                    self._waits += 1
+                self._cond.wait()
+            if waited is not None:
+                self._wait_time += time.monotonic() - waited
+            self._misses += 1
+            one_shot = self._one_shot
+
+        try:
+            conn = self._connect()
+        except Exception:
+            if not one_shot:
+                self._release_slot()
+            raise
+        conn.pooled = not one_shot
+        return conn, False
+
+    def _release_slot(self):
+        with self._cond:
+            self._open -= 1
+            self._cond.notify()
+
+    def release(self, conn, completed=1):
+        """
+        Return a healthy connection to the pool
+        :param conn:
+        :param completed: Number of requests completed since it was acquired
+        :return:
+        """
+        conn.requests += completed
+        conn.last_used = time.monotonic()
+        with self._cond:
+            if conn.requests > 1 and not self._keeps_alive:
+                self._keeps_alive = True
+                self._server_closes = 0
+            if not conn.pooled:
+                conn.close()
+                return
+            if self._one_shot:
+                self._open -= 1
+                conn.close()
+            elif conn.is_alive():
+                self._idle.append(conn)
+            else:
+                self._open -= 1
+                self._evictions += 1
+                self._note_server_close(conn)
+                conn.close()
+            self._cond.notify()
+
+    def discard(self, conn):
+        """
+        Close a connection that failed
+        :param conn:
+        :return:
+        """
+        conn.close()
+        if conn.pooled:
+            self._release_slot()
+
+    def transact(self, payload, timings=None, retry=True):
+        """
+        Send one request and read its response frame.
+        A reused connection that turns out to have been closed by the server
+        is replaced and the request is retried once, but only when none of
+        the response had been received.
+        :param payload: The encoded request
+        :param timings: Optional dict that receives the phase timings
+        :param retry: False if the request must not be sent twice
+        :return: The response frame as bytes
+        """
+        start = time.perf_counter()
+        conn, reused = self.acquire()
+        try:
+            connected = time.perf_counter()
+            conn.sock.sendall(payload)
+            sent = time.perf_counter()
+            frame = conn.reader.read_frame(conn.sock)
+        except OSError:
+            pending = conn.reader.pending
+            self.discard(conn)
+            if not reused or pending or not retry:
+                raise
+            with self._cond:
+                self._reconnects += 1
+                self._note_server_close(conn)
+            conn, _ = self.acquire()
+            try:
+                connected = time.perf_counter()
+                conn.sock.sendall(payload)
+                sent = time.perf_counter()
+                frame = conn.reader.read_frame(conn.sock)
+            except Exception:
+                self.discard(conn)
+                raise
+        except Exception:
+            self.discard(conn)
+            raise
+
+        if timings is not None:
+            transfer_phases(timings, start, connected, sent, conn.reader.first_byte_time, time.perf_counter())
+        self.release(conn)
+        return frame
+
+    def close_all(self):
+        """
+        Close all idle connections
+        :return:
+        """
+        with self._cond:
+            for conn in self._idle:
+                conn.close()
+            self._open -= len(self._idle)
+            self._idle = []
+
+    def retire(self):
+        """
+        Close the idle connections and the rest as they are released.
+        Used when the pool is replaced.
+        :return:
+        """
+        with self._cond:
+            self._one_shot = True
+            for conn in self._idle:
+                conn.close()
+            self._open -= len(self._idle)
+            self._idle = []
+            self._cond.notify_all()
+
+
+# All pools keyed by (host, port)
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_connection_pool(host, port):
+    """
+    Returns the shared pool for a server or None if pooling is not configured
+    :param host:
+    :param port:
+    :return:
+    """
+    size = Configuration.ConnectionPoolSize()
+    if size <= 0:
+        return None
+    with _pools_lock:
+        pool = _pools.get((host, port))
+        if pool is None:
+            pool = ConnectionPool(host, port, size)
+            _pools[(host, port)] = pool
+        return pool
+
+
+def _configuration_changed(old, new):
+    """
+    Retire the pools when the server or the pool size changes. New pools
+    are created on demand.
+    """
+    global _pools
+    if not Configuration.changed(old, new, "Server", "Port", "ConnectionPoolSize"):
+        return
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools = {}
+    for pool in pools:
+        pool.retire()
+
+
+Configuration.subscribe(_configuration_changed)
+
+
+def reset_after_fork():
+    """
+    Called in a forked worker process. The inherited pools share their
+    sockets with the parent and their locks may have been held at the
+    time of the fork, so the worker starts over with no pools.
+    :return:
+    """
+    global _pools, _pools_lock
+    for pool in _pools.values():
+        # Only closes this process's copy of each socket
+        for conn in pool._idle:
+            conn.close()
+    _pools = {}
+    _pools_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_after_fork)
+
+
+def connection_pool_stats():
+    """
+    Returns the stats for every pool keyed by host:port
+    :return:
+    """
+    with _pools_lock:
+        pools = dict(_pools)
+    return {"{0}:{1}".format(host, port): p.stats() for (host, port), p in pools.items()}
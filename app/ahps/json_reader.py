@@ -0,0 +1,294 @@
+# coding: utf-8
+#
+# AHPS Web - web server for managing an AtHomePowerlineServer instance
+# Copyright © 2014, 2020  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import re
+import time
+from app import json_codec
+
+# Default size of a single recv
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# Skips everything up to the next brace/bracket, treating complete string
+# values as opaque. When it stops on a quote, that string has not been
+# completely received yet.
+_SKIP = re.compile(rb'(?:[^{}\[\]"]+|"(?:[^"\\]|\\.)*")*', re.DOTALL)
+
+_QUOTE = ord('"')
+_OPENERS = (ord('{'), ord('['))
+
+
+class JSONFrameReader:
+    """
+    Incremental reader for the JSON frames sent by the AtHomePowerlineServer.
+
+    The server sends one JSON object per response with no length prefix,
+    so the end of a frame is found by counting braces/brackets. The scanner
+    knows about string values (including escaped quotes) so braces inside
+    of a string do not upset the depth count. Scanning resumes where it
+    left off each time more data arrives, which keeps a frame linear in
+    its size no matter how it was chunked.
+
+    Bytes received past the end of a frame are kept for the next frame.
+    """
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Reader instance constructor
+        :param chunk_size: Maximum number of bytes taken per recv
+        """
+        self._buffer = bytearray()
+        # Reusable receive area
+        self._chunk = bytearray(chunk_size)
+        self._chunk_view = memoryview(self._chunk)
+        # time.perf_counter() when read_frame first received data (None
+        # if the frame was already buffered)
+        self.first_byte_time = None
+        self._reset_scan()
+
+    def _reset_scan(self):
+        self._scan_pos = 0
+        self._depth = 0
+
+    @property
+    def pending(self):
+        """
+        Number of buffered bytes not yet returned as part of a frame
+        """
+        return len(self._buffer)
+
+    def feed(self, data):
+        """
+        Add received bytes to the reader
+        :param data: bytes, bytearray or memoryview
+        :return:
+        """
+        self._buffer += data
+
+    def next_frame(self):
+        """
+        Return the next complete frame from the buffered data
+        :return: The frame as bytes or None if a complete frame
+        has not been received yet.
+        """
+        buf = self._buffer
+        pos = self._scan_pos
+        end = len(buf)
+
+        while pos < end:
+            pos = _SKIP.match(buf, pos).end()
+            if pos >= end:
+                break
+            c = buf[pos]
+            if c == _QUOTE:
+                # Incomplete string, rescan it when more data arrives
+                break
+            pos += 1
+            if c in _OPENERS:
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if self._depth < 0:
+                    raise ValueError("Unbalanced JSON frame received from server")
+                if self._depth == 0:
+                    frame = bytes(buf[:pos])
+                    del buf[:pos]
+                    self._reset_scan()
+                    return frame
+
+        self._scan_pos = pos
+        return None
+
+    def read_frame(self, sock):
+        """
+        Read the next complete frame from a socket
+        :param sock: A connected socket
+        :return: The frame as bytes
+        """
+        self.first_byte_time = None
+        frame = self.next_frame()
+        while frame is None:
+            n = sock.recv_into(self._chunk_view)
+            if n == 0:
+                raise ConnectionError("Server closed the connection before sending a complete response")
+            if self.first_byte_time is None:
+                self.first_byte_time = time.perf_counter()
+            self._buffer += self._chunk_view[:n]
+            frame = self.next_frame()
+        return frame
+
+
+_WHITESPACE = re.compile(rb'[ \t\n\r]*')
+_STRING = re.compile(rb'"(?:[^"\\]|\\.)*"', re.DOTALL)
+_SCALAR = re.compile(rb'[^,}\] \t\n\r]+')
+
+# Parser states
+_START = 0
+_MEMBER = 1
+_ARRAY = 2
+_DONE = 3
+
+
+class JSONArrayStream:
+    """
+    Incremental decoder for a response object holding one large array,
+    like the devices list of a QueryDevices response.
+
+    Each element of the named array is decoded as soon as all of its
+    bytes have arrived. The other members of the response object
+    (request, result-code, message, ...) are collected in envelope.
+    Only the bytes of the element being decoded are kept in memory.
+    """
+    def __init__(self, key):
+        """
+        Stream instance constructor
+        :param key: Name of the array member to stream
+        """
+        self._key = key
+        self._buffer = bytearray()
+        self._pos = 0
+        self._state = _START
+        self._member = None
+        self.envelope = {}
+        # True once the array member has been seen
+        self.found = False
+
+    @property
+    def done(self):
+        return self._state == _DONE
+
+    def remainder(self):
+        """
+        Bytes received after the end of the response object
+        :return:
+        """
+        return bytes(self._buffer[self._pos:])
+
+    def feed(self, data):
+        """
+        Add received bytes and decode whatever is complete
+        :param data:
+        :return: List of array elements completed by this data
+        """
+        if self._pos:
+            del self._buffer[:self._pos]
+            self._pos = 0
+        self._buffer += data
+
+        items = []
+        while self._state != _DONE and self._step(items):
+            pass
+        return items
+
+    def _skip_ws(self):
+        self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+        return self._pos < len(self._buffer)
+
+    def _value_end(self, pos):
+        """
+        Find the end of the JSON value starting at pos
+        :return: The end index or None if the value is not complete
+        """
+        buf = self._buffer
+        c = buf[pos]
+        if c == 0x22:
+            m = _STRING.match(buf, pos)
+            return m.end() if m else None
+        if c == 0x7B or c == 0x5B:
+            depth = 0
+            end = len(buf)
+            while pos < end:
+                pos = _SKIP.match(buf, pos).end()
+                if pos >= end or buf[pos] == _QUOTE:
+                    return None
+                depth += 1 if buf[pos] in _OPENERS else -1
+                pos += 1
+                if depth == 0:
+                    return pos
+            return None
+        m = _SCALAR.match(buf, pos)
+        if m is None:
+            raise ValueError("Unexpected byte in JSON response")
+        # A number is only complete once something follows it
+        return m.end() if m.end() < len(buf) else None
+
+    def _step(self, items):
+        """
+        Advance the parser by one token
+        :return: False if more data is needed
+        """
+        if not self._skip_ws():
+            return False
+        buf = self._buffer
+        c = buf[self._pos]
+
+        if self._state == _START:
+            if c != 0x7B:
+                raise ValueError("JSON response is not an object")
+            self._pos += 1
+            self._state = _MEMBER
+            return True
+
+        if self._state == _ARRAY:
+            if c == 0x5D:
+                self._pos += 1
+                self._state = _MEMBER
+                return True
+            if c == 0x2C:
+                self._pos += 1
+                return True
+            end = self._value_end(self._pos)
+            if end is None:
+                return False
+            items.append(json_codec.loads(bytes(buf[self._pos:end])))
+            self._pos = end
+            return True
+
+        # Members of the response object
+        if c == 0x7D:
+            self._pos += 1
+            self._state = _DONE
+            return False
+        if c == 0x2C:
+            self._pos += 1
+            return True
+
+        if self._member is None:
+            m = _STRING.match(buf, self._pos)
+            if m is None:
+                return False
+            colon = _WHITESPACE.match(buf, m.end()).end()
+            if colon >= len(buf):
+                return False
+            if buf[colon] != 0x3A:
+                raise ValueError("Malformed JSON response")
+            self._member = json_codec.loads(bytes(buf[self._pos:m.end()]))
+            self._pos = colon + 1
+            return True
+
+        if self._member == self._key and c == 0x5B:
+            self._pos += 1
+            self._member = None
+            self.found = True
+            self._state = _ARRAY
+            return True
+        end = self._value_end(self._pos)
+        if end is None:
+            return False
+        self.envelope[self._member] = json_codec.loads(bytes(buf[self._pos:end]))
+        self._member = None
+        self._pos = end
+        return True
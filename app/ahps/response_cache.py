@@ -0,0 +1,273 @@
+# coding: utf-8
+#
+# AHPS Web - web server for managing an AtHomePowerlineServer instance
+# Copyright © 2014, 2020  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import json
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from configuration import Configuration
+
+# Entity families. A query depends on one or more families and a
+# mutating command changes one or more families.
+DEVICES = "devices"
+PROGRAMS = "programs"
+DEVICE_PROGRAMS = "device-programs"
+GROUPS = "groups"
+GROUP_DEVICES = "group-devices"
+ALL_FAMILIES = (DEVICES, PROGRAMS, DEVICE_PROGRAMS, GROUPS, GROUP_DEVICES)
+
+# Read only requests and the families their responses depend on
+QUERY_FAMILIES = {
+    "QueryDevices": (DEVICES,),
+    "QueryAvailableDevices": (DEVICES,),
+    "QueryPrograms": (PROGRAMS,),
+    "QueryDeviceProgram": (PROGRAMS,),
+    "QueryDevicePrograms": (PROGRAMS, DEVICE_PROGRAMS),
+    "QueryAvailablePrograms": (PROGRAMS, DEVICE_PROGRAMS),
+    "QueryActionGroups": (GROUPS,),
+    "QueryActionGroup": (GROUPS,),
+    "QueryActionGroupDevices": (DEVICES, GROUP_DEVICES),
+    "QueryAvailableGroupDevices": (DEVICES, GROUP_DEVICES),
+}
+
+# Commands that change what the server returns for a query
+MUTATION_FAMILIES = {
+    "DefineDevice": (DEVICES,),
+    "UpdateDevice": (DEVICES,),
+    "DeleteDevice": (DEVICES, DEVICE_PROGRAMS, GROUP_DEVICES),
+    "DiscoverDevices": (DEVICES,),
+    "DefineProgram": (PROGRAMS,),
+    "UpdateProgram": (PROGRAMS,),
+    "DeleteProgram": (PROGRAMS, DEVICE_PROGRAMS),
+    "AssignProgram": (DEVICE_PROGRAMS,),
+    "AssignProgramToGroup": (DEVICE_PROGRAMS,),
+    "DeleteDeviceProgram": (DEVICE_PROGRAMS,),
+    "DefineActionGroup": (GROUPS,),
+    "UpdateActionGroup": (GROUPS,),
+    "DeleteActionGroup": (GROUPS, GROUP_DEVICES),
+    "AssignDevice": (GROUP_DEVICES,),
+    "DeleteActionGroupDevice": (GROUP_DEVICES,),
+}
+
+# Commands that act on devices without changing any query results
+NEUTRAL_COMMANDS = {"On", "Off", "Dim", "Bright", "AllDevicesOn", "AllDevicesOff",
+                    "GroupOn", "GroupOff", "StatusRequest"}
+
+
+def frame_digest(frame):
+    """
+    Returns the digest of a response frame, used as its ETag
+    :param frame:
+    :return:
+    """
+    return hashlib.blake2b(frame, digest_size=12).hexdigest()
+
+
+class ResponseCache:
+    """
+    Thread safe read-through cache of raw AHPS query responses.
+
+    Entries expire after ttl seconds and the least recently used entry is
+    evicted when the cache is full. The raw response frame is stored, so
+    every hit decodes into fresh objects that the caller is free to change.
+    A mutating command invalidates only the entity families it touches.
+    Commands the cache does not know about invalidate everything.
+    """
+    def __init__(self, ttl, max_entries):
+        """
+        Cache instance constructor
+        :param ttl: Seconds an entry stays valid
+        :param max_entries: Maximum number of entries
+        """
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        # key -> (expires, frame, families, digest)
+        self._entries = OrderedDict()
+        # Bumped every time a family is invalidated
+        self._generations = {family: 0 for family in ALL_FAMILIES}
+        # Stats
+        self._hits = 0
+        self._misses = 0
+        self._stores = 0
+        self._evictions = 0
+        self._expirations = 0
+        self._invalidations = 0
+
+    @staticmethod
+    def key_for(request):
+        """
+        Returns the cache key for a request or None if it is not cacheable
+        :param request: A request built with create_request
+        :return:
+        """
+        if request["request"] not in QUERY_FAMILIES:
+            return None
+        return request["request"], json.dumps(request["args"], sort_keys=True)
+
+    def lookup(self, request):
+        """
+        Look up the response for a request
+        :param request:
+        :return: A tuple (key, frame, generation, digest). key is None when
+        the request is not cacheable. frame is None on a miss, in which case
+        key and generation are passed to store once the response arrives.
+        digest is the frame_digest of a cached frame, computed once when it
+        was stored.
+        """
+        key = self.key_for(request)
+        if key is None:
+            return None, None, None, None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self._hits += 1
+                    return key, entry[1], None, entry[3]
+                del self._entries[key]
+                self._expirations += 1
+            self._misses += 1
+            return key, None, self._generation(QUERY_FAMILIES[request["request"]]), None
+
+    def _generation(self, families):
+        return tuple(self._generations[f] for f in families)
+
+    def store(self, key, frame, generation):
+        """
+        Store a response frame. Nothing is stored if one of the families
+        the query depends on was invalidated while the query was in flight.
+        :param key: From lookup
+        :param frame: The raw response
+        :param generation: From lookup
+        :return:
+        """
+        families = QUERY_FAMILIES[key[0]]
+        digest = frame_digest(frame)
+        with self._lock:
+            if self._generation(families) != generation:
+                return
+            self._entries[key] = (time.monotonic() + self._ttl, frame, families, digest)
+            self._entries.move_to_end(key)
+            self._stores += 1
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def command_completed(self, request):
+        """
+        Invalidate whatever a completed command may have changed
+        :param request:
+        :return:
+        """
+        command = request["request"]
+        if command in QUERY_FAMILIES or command in NEUTRAL_COMMANDS:
+            return
+        self.invalidate(MUTATION_FAMILIES.get(command, ALL_FAMILIES))
+
+    def invalidate(self, families=ALL_FAMILIES):
+        """
+        Drop all entries that depend on any of the given families
+        :param families:
+        :return:
+        """
+        families = set(families)
+        with self._lock:
+            for family in families:
+                self._generations[family] += 1
+            stale = [k for k, entry in self._entries.items() if families.intersection(entry[2])]
+            for k in stale:
+                del self._entries[k]
+            self._invalidations += len(stale)
+
+    def stats(self):
+        """
+        Returns a snapshot of the cache statistics
+        :return:
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max-entries": self._max_entries,
+                "ttl": self._ttl,
+                "hits": self._hits,
+                "misses": self._misses,
+                "stores": self._stores,
+                "evictions": self._evictions,
+                "expirations": self._expirations,
+                "invalidations": self._invalidations
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache():
+    """
+    Returns the shared response cache or None if caching is not configured
+    :return:
+    """
+    global _cache
+    ttl = Configuration.ResponseCacheTTL()
+    if ttl <= 0:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResponseCache(ttl, Configuration.ResponseCacheSize())
+        return _cache
+
+
+def _configuration_changed(old, new):
+    """
+    Drop the cache when the server or the cache settings change. The
+    cached responses came from the old server.
+    """
+    global _cache
+    if Configuration.changed(old, new, "Server", "Port", "ResponseCacheTTL", "ResponseCacheSize"):
+        with _cache_lock:
+            _cache = None
+
+
+Configuration.subscribe(_configuration_changed)
+
+
+def reset_after_fork():
+    """
+    Called in a forked worker process. Each worker keeps its own cache
+    and the inherited lock may have been held at the time of the fork.
+    :return:
+    """
+    global _cache, _cache_lock
+    _cache = None
+    _cache_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_after_fork)
+
+
+def response_cache_stats():
+    """
+    Returns the shared cache stats or None if caching is not configured
+    :return:
+    """
+    cache = _cache
+    return cache.stats() if cache is not None else None
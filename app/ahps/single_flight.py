@@ -0,0 +1,160 @@
+# coding: utf-8
+#
+# AHPS Web - web server for managing an AtHomePowerlineServer instance
+# Copyright © 2014, 2020  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import os
+import threading
+from configuration import Configuration
+from app.ahps.response_cache import ResponseCache, QUERY_FAMILIES, MUTATION_FAMILIES, \
+    NEUTRAL_COMMANDS, ALL_FAMILIES
+
+
+class _Flight:
+    """
+    One upstream call that other callers can wait on
+    """
+    def __init__(self, families):
+        self.families = families
+        self.done = threading.Event()
+        self.frame = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Collapses concurrent identical query requests into one upstream call.
+
+    The first caller (the leader) sends the request. Callers that arrive
+    with the same request while it is in flight wait for the leader and
+    get the same raw response frame, which each of them decodes into its
+    own objects. Only queries are collapsed. A completed mutating command
+    detaches the in flight queries it may have changed so later callers
+    start a fresh call instead of joining one that may be stale.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        # key -> _Flight
+        self._flights = {}
+        # Stats
+        self._leaders = 0
+        self._collapsed = 0
+        self._errors = 0
+
+    def do(self, server, request, fetch):
+        """
+        Run fetch once for all concurrent identical requests
+        :param server: (host, port) the request is sent to
+        :param request: A request built with create_request
+        :param fetch: Function that sends the request and returns the response frame
+        :return: The response frame
+        """
+        key = ResponseCache.key_for(request)
+        if key is None:
+            return fetch()
+        key = server + key
+
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = _Flight(QUERY_FAMILIES[request["request"]])
+                self._flights[key] = flight
+                self._leaders += 1
+                leader = True
+            else:
+                self._collapsed += 1
+                leader = False
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.frame
+
+        try:
+            flight.frame = fetch()
+            return flight.frame
+        except Exception as ex:
+            flight.error = ex
+            with self._lock:
+                self._errors += 1
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.done.set()
+
+    def command_completed(self, request):
+        """
+        Detach the in flight queries a completed command may have changed
+        :param request:
+        :return:
+        """
+        command = request["request"]
+        if command in QUERY_FAMILIES or command in NEUTRAL_COMMANDS:
+            return
+        families = set(MUTATION_FAMILIES.get(command, ALL_FAMILIES))
+        with self._lock:
+            stale = [k for k, flight in self._flights.items() if families.intersection(flight.families)]
+            for k in stale:
+                del self._flights[k]
+
+    def stats(self):
+        """
+        Returns a snapshot of the single flight statistics
+        :return:
+        """
+        with self._lock:
+            return {
+                "in-flight": len(self._flights),
+                "leaders": self._leaders,
+                "collapsed": self._collapsed,
+                "errors": self._errors
+            }
+
+
+_single_flight = SingleFlight()
+
+
+def get_single_flight():
+    """
+    Returns the shared single flight layer or None if it is turned off
+    :return:
+    """
+    return _single_flight if Configuration.SingleFlight() else None
+
+
+def single_flight_stats():
+    """
+    Returns the single flight stats
+    :return:
+    """
+    return _single_flight.stats()
+
+
+def reset_after_fork():
+    """
+    Called in a forked worker process. Calls in flight in the parent
+    never complete in the child.
+    :return:
+    """
+    global _single_flight
+    _single_flight = SingleFlight()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_after_fork)
@@ -0,0 +1,692 @@
+# coding: utf-8
+#
+# AHPS Web - web server for managing an AtHomePowerlineServer instance
+# Copyright © 2014, 2020  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Local SQLite mirror of the devices, programs, action groups, group
+# members and device programs of the AtHomePowerlineServer.
+#
+# Query responses from the server are written to the mirror. Once a list
+# has been loaded, the queries that depend on it are answered from indexed
+# local queries, so a page load no longer waits on the server. Successful
+# deletes are applied to the mirror directly. Other changes mark the lists
+# they affect as not loaded, and the next read goes to the server. A
+# background thread queries the server again for every list in the mirror
+# right away after a change, and every SnapshotRefresh seconds to pick up
+# changes made by other clients of the server. The mirror is kept on disk
+# (DatabasePath/SnapshotFile, WAL mode), so after a restart the UI is
+# answered from it at once while the first refresh reconciles it with the
+# server.
+#
+# The file is shared by every worker process. A generation number kept
+# in the meta table is bumped in the same transaction as every change, and
+# a query response is only written if the generation is still the one
+# read before the query was sent. So a list read from the server before
+# another worker's change is never written back over that change.
+#
+# Each row keeps the JSON of the entity exactly as the server sent it.
+# Every loaded list has a version that changes with each write to the
+# mirror. An answer's digest (its ETag) is derived from the versions it
+# was built from instead of hashing the answer.
+#
+
+import os
+import json
+import uuid
+import hashlib
+import sqlite3
+import threading
+import time
+import logging
+from app import json_codec
+from configuration import Configuration
+from app.ahps.response_cache import NEUTRAL_COMMANDS
+
+logger = logging.getLogger("app")
+
+# Stored as PRAGMA user_version. A file with another version is rebuilt.
+SCHEMA_VERSION = 2
+TABLES = ["meta", "loaded", "devices", "programs", "action_groups", "group_devices", "device_programs"]
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS loaded (key TEXT PRIMARY KEY, refreshed REAL NOT NULL, version TEXT NOT NULL,
+    envelope TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS devices (id INTEGER PRIMARY KEY, position INTEGER NOT NULL, data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS devices_position ON devices (position);
+CREATE TABLE IF NOT EXISTS programs (id INTEGER PRIMARY KEY, position INTEGER NOT NULL, data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS programs_position ON programs (position);
+CREATE TABLE IF NOT EXISTS action_groups (id INTEGER PRIMARY KEY, position INTEGER NOT NULL, data TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS action_groups_position ON action_groups (position);
+CREATE TABLE IF NOT EXISTS group_devices (group_id INTEGER NOT NULL, device_id INTEGER NOT NULL,
+    position INTEGER NOT NULL, data TEXT NOT NULL, PRIMARY KEY (group_id, device_id)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS group_devices_device ON group_devices (device_id);
+CREATE TABLE IF NOT EXISTS device_programs (device_id INTEGER NOT NULL, program_id INTEGER NOT NULL,
+    position INTEGER NOT NULL, data TEXT NOT NULL, PRIMARY KEY (device_id, program_id)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS device_programs_program ON device_programs (program_id);
+"""
+
+# Top level lists: query -> (loaded key, table, response member)
+LISTS = {
+    "QueryDevices": ("devices", "devices", "devices"),
+    "QueryPrograms": ("programs", "programs", "programs"),
+    "QueryActionGroups": ("groups", "action_groups", "groups"),
+}
+# Single entity queries: query -> (id argument, loaded key of its list, table, response member)
+ITEMS = {
+    "QueryDevices": ("device-id", "devices", "devices", "device"),
+    "QueryDeviceProgram": ("program-id", "programs", "programs", "program"),
+    "QueryActionGroup": ("group-id", "groups", "action_groups", "group"),
+}
+# Member lists: query -> (owner id argument, loaded key prefix, table, owner column, member column, member)
+MEMBERS = {
+    "QueryActionGroupDevices": ("group-id", "group-devices:", "group_devices", "group_id", "device_id", "devices"),
+    "QueryDevicePrograms": ("device-id", "device-programs:", "device_programs", "device_id", "program_id",
+                            "programs"),
+}
+# Lists of the entities that are not members:
+# query -> (member query, list query)
+NON_MEMBERS = {
+    "QueryAvailableGroupDevices": ("QueryActionGroupDevices", "QueryDevices"),
+    "QueryAvailablePrograms": ("QueryDevicePrograms", "QueryPrograms"),
+}
+
+# Queries the mirror can answer
+ANSWERED = set(LISTS) | set(ITEMS) | set(MEMBERS) | set(NON_MEMBERS)
+
+# Loaded keys affected by commands that are not applied directly
+STALE_KEYS = {
+    "DefineDevice": ("devices",),
+    "DiscoverDevices": ("devices",),
+    # Group member lists hold copies of the devices
+    "UpdateDevice": ("devices", "group-devices:"),
+    "DefineProgram": ("programs",),
+    # Device program lists hold copies of the programs
+    "UpdateProgram": ("programs", "device-programs:"),
+    "DefineActionGroup": ("groups",),
+    "UpdateActionGroup": ("groups",),
+    "AssignProgramToGroup": ("device-programs:",),
+}
+
+
+def _int_arg(args, name):
+    try:
+        return int(args[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class SnapshotStore:
+    """
+    Thread safe SQLite mirror of the server's entity lists
+    """
+    def __init__(self, path, server, refresh_interval):
+        """
+        Store instance constructor
+        :param path: SQLite database file
+        :param server: host:port of the server being mirrored. A mirror of
+        another server is discarded.
+        :param refresh_interval: Seconds between background refreshes
+        """
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        # Idle connections, each used by one thread at a time
+        self._connections = []
+        self._refresh_wanted = threading.Event()
+        self._refresher = None
+        self._stopped = False
+        # Stats
+        self._hits = 0
+        self._misses = 0
+        self._stores = 0
+        self._refreshes = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = self._connect()
+        try:
+            if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                for table in TABLES:
+                    conn.execute("DROP TABLE IF EXISTS " + table)
+                conn.execute("PRAGMA user_version = {0}".format(SCHEMA_VERSION))
+            conn.executescript(SCHEMA)
+            row = conn.execute("SELECT value FROM meta WHERE key = 'server'").fetchone()
+            if row is None or row[0] != server:
+                self._clear(conn)
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('server', ?)", (server,))
+            conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('generation', '0')")
+        finally:
+            self._release(conn)
+
+    def _connect(self):
+        with self._lock:
+            if self._connections:
+                return self._connections.pop()
+        conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # Durable enough for a mirror that can be rebuilt from the server
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _release(self, conn):
+        with self._lock:
+            self._connections.append(conn)
+
+    def _write(self, func, *args):
+        """
+        Run func(conn, *args) in a write transaction
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = func(conn, *args)
+                conn.execute("COMMIT")
+                return result
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        finally:
+            self._release(conn)
+
+    @staticmethod
+    def _clear(conn):
+        for table in ["loaded", "devices", "programs", "action_groups", "group_devices", "device_programs"]:
+            conn.execute("DELETE FROM " + table)
+
+    @staticmethod
+    def _generation(conn):
+        """
+        The generation shared by all processes using the file
+        """
+        return int(conn.execute("SELECT value FROM meta WHERE key = 'generation'").fetchone()[0])
+
+    @staticmethod
+    def _changed(conn):
+        """
+        Called in every write transaction that changes the mirror, so a
+        query response read before the change is not stored after it
+        """
+        conn.execute("UPDATE meta SET value = CAST(value AS INTEGER) + 1 WHERE key = 'generation'")
+
+    def clear(self):
+        """
+        Forget everything
+        :return:
+        """
+        self._write(self._reset)
+
+    def _reset(self, conn):
+        self._changed(conn)
+        self._clear(conn)
+
+    def lookup(self, request, answer=True):
+        """
+        Answer a query from the mirror
+        :param request: A request built with create_request
+        :param answer: False to only get the generation
+        :return: A tuple (frame, digest, generation). frame is the response
+        as the server would send it, or None when the mirror cannot answer.
+        digest changes whenever the data the answer was built from changes.
+        Pass generation to store once the server's response arrives.
+        """
+        answer = answer and request["request"] in ANSWERED
+        generation, answered = None, None
+        conn = self._connect()
+        try:
+            # One read transaction, so the answer matches the generation
+            conn.execute("BEGIN")
+            try:
+                generation = self._generation(conn)
+                if answer:
+                    answered = self._answer(conn, request["request"], request.get("args", {}))
+            finally:
+                conn.execute("COMMIT")
+        except sqlite3.Error as ex:
+            logger.error("Snapshot lookup failed: %s", str(ex))
+        finally:
+            self._release(conn)
+        if answer:
+            with self._lock:
+                if answered is None:
+                    self._misses += 1
+                else:
+                    self._hits += 1
+        frame, digest = answered or (None, None)
+        return frame, digest, generation
+
+    def _answer(self, conn, command, args):
+        if command in ITEMS and ITEMS[command][0] in args:
+            id_arg, key, table, member = ITEMS[command]
+            item_id = _int_arg(args, id_arg)
+            loaded = self._loaded(conn, key)
+            if item_id is None or loaded is None:
+                return None
+            row = conn.execute("SELECT data FROM {0} WHERE id = ?".format(table), (item_id,)).fetchone()
+            if row is None:
+                # Let the server report the error
+                return None
+            return self._frame({"request": command, "result-code": 0}, member, row[0],
+                               (command, item_id, loaded[1]))
+
+        if command in LISTS:
+            key, table, member = LISTS[command]
+            loaded = self._loaded(conn, key)
+            if loaded is None:
+                return None
+            rows = conn.execute("SELECT data FROM {0} ORDER BY position".format(table)).fetchall()
+            return self._frame(loaded[0], member, "[" + ",".join(r[0] for r in rows) + "]",
+                               (command, loaded[1]))
+
+        if command in MEMBERS:
+            owner_arg, prefix, table, owner_column, _, member = MEMBERS[command]
+            owner = _int_arg(args, owner_arg)
+            if owner is None:
+                return None
+            loaded = self._loaded(conn, prefix + str(owner))
+            if loaded is None:
+                return None
+            rows = conn.execute("SELECT data FROM {0} WHERE {1} = ? ORDER BY position".format(
+                table, owner_column), (owner,)).fetchall()
+            return self._frame(loaded[0], member, "[" + ",".join(r[0] for r in rows) + "]",
+                               (command, owner, loaded[1]))
+
+        if command in NON_MEMBERS:
+            member_query, list_query = NON_MEMBERS[command]
+            owner_arg, prefix, member_table, owner_column, member_column, member = MEMBERS[member_query]
+            list_key, list_table, _ = LISTS[list_query]
+            owner = _int_arg(args, owner_arg)
+            if owner is None:
+                return None
+            members_loaded = self._loaded(conn, prefix + str(owner))
+            list_loaded = self._loaded(conn, list_key)
+            if members_loaded is None or list_loaded is None:
+                return None
+            rows = conn.execute(
+                "SELECT data FROM {0} WHERE id NOT IN (SELECT {1} FROM {2} WHERE {3} = ?) "
+                "ORDER BY position".format(list_table, member_column, member_table, owner_column),
+                (owner,)).fetchall()
+            return self._frame({"request": command, "result-code": 0}, member,
+                               "[" + ",".join(r[0] for r in rows) + "]",
+                               (command, owner, members_loaded[1], list_loaded[1]))
+        return None
+
+    @staticmethod
+    def _loaded(conn, key):
+        """
+        A tuple (response envelope, version) of a loaded list, or None if
+        the list is not loaded
+        """
+        row = conn.execute("SELECT envelope, version FROM loaded WHERE key = ?", (key,)).fetchone()
+        return (json.loads(row[0]), row[1]) if row is not None else None
+
+    @staticmethod
+    def _frame(envelope, member, value, validator):
+        """
+        Build the response frame around an already encoded member
+        :param validator: What the answer was built from, including the
+        versions of the lists it read. Its hash is the frame's digest.
+        :return: A tuple (frame, digest)
+        """
+        envelope = dict(envelope)
+        envelope.pop(member, None)
+        head = json.dumps(envelope)
+        frame = "{0}, {1}: {2}}}".format(head[:-1], json.dumps(member), value).encode()
+        return frame, hashlib.blake2b(repr(validator).encode(), digest_size=12).hexdigest()
+
+    def store(self, request, response, generation):
+        """
+        Write a successful query response to the mirror. Nothing is written
+        if the mirror changed, in this or any other process, while the
+        query was in flight.
+        :param request:
+        :param response: The decoded response
+        :param generation: From lookup
+        :return:
+        """
+        command = request["request"]
+        args = request.get("args", {})
+        try:
+            if command in LISTS and not args and LISTS[command][2] in response:
+                self._write(self._store_list, generation, command, response)
+            elif command in MEMBERS and MEMBERS[command][5] in response:
+                owner = _int_arg(args, MEMBERS[command][0])
+                if owner is not None:
+                    self._write(self._store_members, generation, command, owner, response)
+            elif command in ITEMS and ITEMS[command][3] in response:
+                self._write(self._store_item, generation, command, response)
+        except (sqlite3.Error, TypeError, ValueError) as ex:
+            logger.error("Snapshot store of %s failed: %s", command, str(ex))
+
+    def _current(self, conn, generation):
+        """
+        Called in a write transaction, which keeps other processes from
+        changing the generation until the response has been written
+        """
+        if generation is None or generation != self._generation(conn):
+            return False
+        with self._lock:
+            self._stores += 1
+        return True
+
+    def _store_list(self, conn, generation, command, response):
+        if not self._current(conn, generation):
+            return
+        key, table, member = LISTS[command]
+        rows = [(int(item["id"]), i, json_codec.dumps(item)) for i, item in enumerate(response[member])]
+        conn.execute("DELETE FROM " + table)
+        conn.executemany("INSERT OR REPLACE INTO {0} (id, position, data) VALUES (?, ?, ?)".format(table), rows)
+        self._mark_loaded(conn, key, response, member, rows)
+
+    def _store_members(self, conn, generation, command, owner, response):
+        if not self._current(conn, generation):
+            return
+        _, prefix, table, owner_column, member_column, member = MEMBERS[command]
+        rows = [(owner, int(item["id"]), i, json_codec.dumps(item)) for i, item in enumerate(response[member])]
+        conn.execute("DELETE FROM {0} WHERE {1} = ?".format(table, owner_column), (owner,))
+        conn.executemany(
+            "INSERT OR REPLACE INTO {0} ({1}, {2}, position, data) VALUES (?, ?, ?, ?)".format(
+                table, owner_column, member_column), rows)
+        self._mark_loaded(conn, prefix + str(owner), response, member, rows)
+
+    def _store_item(self, conn, generation, command, response):
+        if not self._current(conn, generation):
+            return
+        _, _, table, member = ITEMS[command]
+        item = response[member]
+        data = json_codec.dumps(item)
+        # Only entities already in a loaded list are updated
+        if conn.execute("UPDATE {0} SET data = ? WHERE id = ? AND data != ?".format(table),
+                        (data, int(item["id"]), data)).rowcount:
+            self._new_versions(conn)
+
+    @staticmethod
+    def _mark_loaded(conn, key, response, member, rows):
+        """
+        The version of a stored list is a hash of its content, so
+        reloading an unchanged list keeps its version (and the ETags)
+        """
+        envelope = json.dumps({k: v for k, v in response.items() if k != member})
+        content = hashlib.blake2b(envelope.encode(), digest_size=12)
+        for row in rows:
+            content.update(row[-1].encode())
+        conn.execute("INSERT OR REPLACE INTO loaded (key, refreshed, version, envelope) VALUES (?, ?, ?, ?)",
+                     (key, time.time(), content.hexdigest(), envelope))
+
+    @staticmethod
+    def _new_versions(conn):
+        """
+        Called after a change to the rows. Answers may combine several
+        lists, so every list gets a new version.
+        """
+        conn.execute("UPDATE loaded SET version = ?", (uuid.uuid4().hex,))
+
+    @staticmethod
+    def affected_by(request):
+        """
+        True if a command can change what the mirror holds
+        :param request:
+        :return:
+        """
+        command = request["request"]
+        return not command.startswith("Query") and command not in NEUTRAL_COMMANDS
+
+    def command_completed(self, request, response):
+        """
+        Apply a completed command to the mirror
+        :param request:
+        :param response: The decoded response, None if the request failed
+        :return:
+        """
+        if not self.affected_by(request):
+            return
+        command = request["request"]
+        try:
+            if response is not None and response.get("result-code") == 0:
+                self._write(self._apply, command, request.get("args", {}))
+            elif response is None:
+                # The outcome is unknown
+                self._write(self._invalidate, STALE_KEYS.get(command, ("",)))
+            else:
+                return
+        except sqlite3.Error as ex:
+            logger.error("Snapshot update for %s failed: %s", command, str(ex))
+            try:
+                self._write(self._invalidate, ("",))
+            except sqlite3.Error as ex:
+                logger.error("Unable to reset the snapshot store: %s", str(ex))
+        self._refresh_wanted.set()
+
+    def _apply(self, conn, command, args):
+        self._changed(conn)
+        self._new_versions(conn)
+        device_id = _int_arg(args, "device-id")
+        program_id = _int_arg(args, "program-id")
+        group_id = _int_arg(args, "group-id")
+
+        if command == "DeleteDevice" and device_id is not None:
+            conn.execute("DELETE FROM devices WHERE id = ?", (device_id,))
+            conn.execute("DELETE FROM group_devices WHERE device_id = ?", (device_id,))
+            conn.execute("DELETE FROM device_programs WHERE device_id = ?", (device_id,))
+            conn.execute("DELETE FROM loaded WHERE key = ?", ("device-programs:" + str(device_id),))
+        elif command == "DeleteProgram" and program_id is not None:
+            conn.execute("DELETE FROM programs WHERE id = ?", (program_id,))
+            conn.execute("DELETE FROM device_programs WHERE program_id = ?", (program_id,))
+        elif command == "DeleteActionGroup" and group_id is not None:
+            conn.execute("DELETE FROM action_groups WHERE id = ?", (group_id,))
+            conn.execute("DELETE FROM group_devices WHERE group_id = ?", (group_id,))
+            conn.execute("DELETE FROM loaded WHERE key = ?", ("group-devices:" + str(group_id),))
+        elif command == "DeleteActionGroupDevice" and group_id is not None and device_id is not None:
+            conn.execute("DELETE FROM group_devices WHERE group_id = ? AND device_id = ?", (group_id, device_id))
+        elif command == "DeleteDeviceProgram" and device_id is not None and program_id is not None:
+            conn.execute("DELETE FROM device_programs WHERE device_id = ? AND program_id = ?",
+                         (device_id, program_id))
+        elif command == "AssignDevice" and group_id is not None:
+            # The member list holds the device as the server returns it, reload it
+            conn.execute("DELETE FROM loaded WHERE key = ?", ("group-devices:" + str(group_id),))
+        elif command == "AssignProgram" and device_id is not None:
+            conn.execute("DELETE FROM loaded WHERE key = ?", ("device-programs:" + str(device_id),))
+        else:
+            # Unknown commands could have changed anything
+            self._forget(conn, STALE_KEYS.get(command, ("",)))
+
+    @staticmethod
+    def _forget(conn, keys):
+        """
+        Mark lists as not loaded. A key ending in ':' stands for all lists
+        with that prefix, an empty key for every list.
+        """
+        for key in keys:
+            if key == "" or key.endswith(":"):
+                conn.execute("DELETE FROM loaded WHERE substr(key, 1, ?) = ?", (len(key), key))
+            else:
+                conn.execute("DELETE FROM loaded WHERE key = ?", (key,))
+
+    def _invalidate(self, conn, keys):
+        self._changed(conn)
+        self._forget(conn, keys)
+
+    def loaded_members(self):
+        """
+        The member lists in the mirror
+        :return: A list of (query, owner id) tuples
+        """
+        conn = self._connect()
+        try:
+            keys = [r[0] for r in conn.execute("SELECT key FROM loaded WHERE key LIKE '%:%'")]
+        finally:
+            self._release(conn)
+        members = []
+        for command, (_, prefix, _, _, _, _) in MEMBERS.items():
+            members.extend((command, int(k[len(prefix):])) for k in keys if k.startswith(prefix))
+        return members
+
+    def forget(self, key):
+        """
+        Mark a list as not loaded
+        :param key: Loaded key, see _forget
+        :return:
+        """
+        self._write(self._invalidate, (key,))
+
+    def start_refresher(self, refresh):
+        """
+        Start the background refresh thread
+        :param refresh: Function called with the store that queries the
+        server for every list in the mirror. Returns True if all queries
+        were answered.
+        :return:
+        """
+        if self._refresher is not None:
+            return
+        self._refresh_wanted.set()
+        self._refresher = threading.Thread(target=self._refresh_loop, args=(refresh,), name="snapshot-refresh",
+                                           daemon=True)
+        self._refresher.start()
+
+    def stop_refresher(self):
+        """
+        Stop the background refresh thread after its current refresh
+        :return:
+        """
+        self._stopped = True
+        self._refresh_wanted.set()
+
+    def _refresh_loop(self, refresh):
+        while True:
+            self._refresh_wanted.wait(self.refresh_interval)
+            self._refresh_wanted.clear()
+            if self._stopped:
+                return
+            try:
+                if refresh(self):
+                    with self._lock:
+                        self._refreshes += 1
+            except Exception as ex:
+                logger.error("Snapshot refresh failed: %s", str(ex))
+
+    def stats(self):
+        """
+        Returns a snapshot of the store statistics
+        :return:
+        """
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "stores": self._stores,
+                "refreshes": self._refreshes
+            }
+
+
+_store = None
+_store_lock = threading.Lock()
+# Stores inherited by a forked worker are kept but never used, see reset_after_fork
+_inherited = []
+
+
+def get_snapshot_store():
+    """
+    Returns the shared snapshot store or None if it is not configured
+    :return:
+    """
+    global _store
+    if not Configuration.SnapshotStore():
+        return None
+    with _store_lock:
+        if _store is None:
+            path = Configuration.get_database_file_path(Configuration.SnapshotFile())
+            server = "{0}:{1}".format(Configuration.Server(), Configuration.Port())
+            try:
+                _store = SnapshotStore(path, server, Configuration.SnapshotRefresh())
+            except (OSError, sqlite3.Error) as ex:
+                logger.error("Unable to open snapshot store %s: %s", path, str(ex))
+                return None
+            logger.info("Snapshot store %s", path)
+            _store.start_refresher(_refresh_lists)
+        return _store
+
+
+def _refresh_lists(store):
+    """
+    Query the server for every list in the mirror. The responses are
+    written to the mirror on the way back. A member list whose owner is
+    gone is dropped.
+    :param store:
+    :return: True if the server answered every query
+    """
+    from app.ahps.ahps_api import AHPSRequest
+
+    api_req = AHPSRequest(read_snapshot=False)
+    for command in LISTS:
+        if api_req.send_command(api_req.create_request(command)) is None:
+            return False
+    for command, owner in store.loaded_members():
+        owner_arg, prefix = MEMBERS[command][:2]
+        req = api_req.create_request(command)
+        req["args"][owner_arg] = owner
+        response = api_req.send_command(req)
+        if response is None:
+            return False
+        if response.get("result-code") != 0:
+            store.forget(prefix + str(owner))
+    return True
+
+
+def _configuration_changed(old, new):
+    """
+    The mirror belongs to one server. A new store is opened on demand.
+    """
+    global _store
+    if Configuration.changed(old, new, "Server", "Port", "SnapshotStore", "SnapshotFile", "SnapshotRefresh",
+                             "DatabasePath"):
+        with _store_lock:
+            if _store is not None:
+                _store.stop_refresher()
+                _inherited.append(_store)
+            _store = None
+
+
+Configuration.subscribe(_configuration_changed)
+
+
+def reset_after_fork():
+    """
+    Called in a forked worker process. SQLite connections must not be
+    used across a fork, so the worker opens its own store. The inherited
+    one is kept referenced so its connections are never closed here.
+    :return:
+    """
+    global _store, _store_lock
+    if _store is not None:
+        _inherited.append(_store)
+    _store = None
+    _store_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_after_fork)
+
+
+def snapshot_store_stats():
+    """
+    Returns the shared store stats or None if the store is not open
+    :return:
+    """
+    store = _store
+    return store.stats() if store is not None else None
@@ -0,0 +1,319 @@
+# coding: utf-8
+#
+# AHPS Web - web server for managing an AtHomePowerlineServer instance
+# Copyright © 2014, 2020  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Background jobs that turn all devices or all devices in a group on or off.
+# Instead of one AllDevicesOn/GroupOn command that blocks until the server
+# has finished every device, a job sends one On/Off command per device
+# and records the outcome of each. This is not quite the same as the
+# server's own command: the devices are those listed when the job starts
+# and each device is switched on its own, in no particular order.
+#
+# Jobs are keyed by their target (all devices or one group). A state
+# change for a target with a job in flight is merged into that job if it
+# sets the same state. Otherwise the older job is cancelled, so it sends
+# no further commands. Jobs run one at a time in the order they were
+# started, so the last state change requested always wins.
+#
+
+import os
+import threading
+import time
+import uuid
+import logging
+import contextvars
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from app.ahps.ahps_api import AHPSRequest
+
+logger = logging.getLogger("app")
+
+# Number of device commands a job sends at once
+JOB_FANOUT = 4
+# Seconds a finished job can still be queried
+JOB_RETENTION = 300
+# Maximum number of finished jobs kept
+MAX_FINISHED_JOBS = 100
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+class StateChangeJob:
+    """
+    Turn every device in a set on or off, one command per device
+    """
+    def __init__(self, target, state, group_id=None, after=None):
+        """
+        Job constructor
+        :param target: Identifies the devices the job acts on
+        :param state: on or off
+        :param group_id: None for all devices
+        :param after: The job that has to finish before this one starts
+        """
+        self.id = uuid.uuid4().hex
+        self.target = target
+        self.state = state
+        self.group_id = group_id
+        self.status = PENDING
+        self.message = None
+        # Number of requests merged into this job
+        self.merged = 0
+        self.created = datetime.now()
+        self.started = None
+        self.finished = None
+        self.finished_at = None
+        # device id -> {"id", "name", "status", "message"}
+        self._devices = {}
+        self._lock = threading.Lock()
+        self._after = after
+        self._cancelled = threading.Event()
+        self._finished = threading.Event()
+
+    @property
+    def in_flight(self):
+        return self.status in (PENDING, RUNNING)
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        """
+        Stop sending commands. Commands already sent are not undone.
+        :return:
+        """
+        self._cancelled.set()
+
+    def wait(self, timeout=None):
+        """
+        Wait for the job to finish
+        :param timeout: Seconds to wait, None for no limit
+        :return: True if the job finished
+        """
+        return self._finished.wait(timeout)
+
+    def run(self):
+        """
+        Run the job. Called on the job thread.
+        :return:
+        """
+        try:
+            if self._after is not None:
+                self._after.wait()
+                self._after = None
+            self.started = datetime.now()
+            if self.cancelled:
+                self.status = CANCELLED
+                self.message = "Replaced by a newer state change"
+                return
+            self.status = RUNNING
+            devices = self._query_devices()
+            if devices is None:
+                return
+            with self._lock:
+                for device in devices:
+                    self._devices[device["id"]] = {"id": device["id"], "name": device.get("name", ""),
+                                                   "status": PENDING, "message": None}
+            if devices:
+                with ThreadPoolExecutor(max_workers=min(JOB_FANOUT, len(devices))) as executor:
+                    for device in devices:
+                        # Keep the correlation id of the request that started the job
+                        executor.submit(contextvars.copy_context().run, self._change_device, device["id"])
+            failed = sum(1 for d in self._devices.values() if d["status"] == FAILED)
+            if self.cancelled:
+                self.status = CANCELLED
+                self.message = "Replaced by a newer state change"
+            else:
+                self.status = FAILED if failed else DONE
+                if failed:
+                    self.message = "{0} of {1} devices failed".format(failed, len(self._devices))
+        except Exception as ex:
+            logger.error("State change job %s failed: %s", self.id, str(ex))
+            self.status = FAILED
+            self.message = str(ex)
+        finally:
+            self.finished = datetime.now()
+            self.finished_at = time.monotonic()
+            self._finished.set()
+            logger.debug("State change job %s %s", self.id, self.status)
+
+    def _query_devices(self):
+        """
+        Returns the devices the job acts on or None if the query failed
+        """
+        api_req = AHPSRequest()
+        if self.group_id is None:
+            res = api_req.get_all_devices()
+        else:
+            res = api_req.get_action_group_devices(self.group_id)
+        if res is None or res["result-code"]:
+            self.status = FAILED
+            self.message = res["message"] if res else api_req.last_error["message"]
+            return None
+        return res["devices"]
+
+    def _change_device(self, device_id):
+        if self.cancelled:
+            with self._lock:
+                self._devices[device_id]["status"] = CANCELLED
+            return
+        api_req = AHPSRequest()
+        if self.state == "on":
+            res = api_req.device_on(device_id)
+        else:
+            res = api_req.device_off(device_id)
+
+        if res is None:
+            status, message = FAILED, api_req.last_error["message"]
+        elif res["result-code"]:
+            status, message = FAILED, res.get("message")
+        else:
+            status, message = DONE, None
+        with self._lock:
+            self._devices[device_id]["status"] = status
+            self._devices[device_id]["message"] = message
+
+    def to_dict(self):
+        """
+        Returns the job status
+        :return:
+        """
+        with self._lock:
+            devices = [dict(d) for d in self._devices.values()]
+        return {
+            "job-id": self.id,
+            "kind": "all-devices" if self.group_id is None else "group",
+            "group-id": self.group_id,
+            "state": self.state,
+            "status": self.status,
+            "message": self.message,
+            "merged": self.merged,
+            "created": self.created.isoformat(),
+            "started": self.started.isoformat() if self.started else None,
+            "finished": self.finished.isoformat() if self.finished else None,
+            "total": len(devices),
+            "completed": sum(1 for d in devices if d["status"] == DONE),
+            "failed": sum(1 for d in devices if d["status"] == FAILED),
+            "cancelled": sum(1 for d in devices if d["status"] == CANCELLED),
+            "devices": devices
+        }
+
+
+# All jobs keyed by id
+_jobs = {}
+# In flight jobs keyed by target
+_in_flight = {}
+# The most recently started job, every new job runs after it
+_last_job = None
+_jobs_lock = threading.Lock()
+
+
+def _start_job(target, state, group_id=None):
+    """
+    Start a job, merge into an identical one in flight or replace one
+    that sets the other state
+    :return: The job
+    """
+    global _last_job
+    with _jobs_lock:
+        _expire_jobs()
+        job = _in_flight.get(target)
+        if job is not None and job.in_flight and not job.cancelled:
+            if job.state == state:
+                job.merged += 1
+                logger.debug("State change merged into job %s", job.id)
+                return job
+            job.cancel()
+            logger.debug("State change job %s replaced", job.id)
+
+        job = StateChangeJob(target, state, group_id, after=_last_job)
+        _jobs[job.id] = job
+        _in_flight[target] = job
+        _last_job = job
+
+    def run():
+        job.run()
+        with _jobs_lock:
+            if _in_flight.get(target) is job:
+                del _in_flight[target]
+
+    threading.Thread(target=contextvars.copy_context().run, args=(run,), name="state-job-" + job.id[:8],
+                     daemon=True).start()
+    return job
+
+
+def _expire_jobs():
+    """
+    Drop old finished jobs. Called with the lock held.
+    """
+    now = time.monotonic()
+    finished = [j for j in _jobs.values() if j.finished_at is not None]
+    finished.sort(key=lambda j: j.finished_at)
+    excess = len(finished) - MAX_FINISHED_JOBS
+    for i, job in enumerate(finished):
+        if i < excess or now - job.finished_at > JOB_RETENTION:
+            del _jobs[job.id]
+
+
+def start_all_devices_job(state):
+    """
+    Turn all devices on or off in the background
+    :param state: on or off
+    :return: The job
+    """
+    return _start_job(("all-devices",), state)
+
+
+def start_group_job(group_id, state):
+    """
+    Turn all devices in an action group on or off in the background
+    :param group_id:
+    :param state: on or off
+    :return: The job
+    """
+    return _start_job(("group", str(group_id)), state, group_id=group_id)
+
+
+def get_job(job_id):
+    """
+    Returns a job or None if there is no such job
+    :param job_id:
+    :return:
+    """
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def reset_after_fork():
+    """
+    Called in a forked worker process. Job threads do not survive a fork.
+    :return:
+    """
+    global _jobs, _in_flight, _last_job, _jobs_lock
+    _jobs = {}
+    _in_flight = {}
+    _last_job = None
+    _jobs_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_after_fork)
@@ -16,9 +16,131 @@
 # along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
 #
 
-from astral import Astral
+import os
+import threading
+from datetime import datetime, timedelta
 from configuration import Configuration
 
+# Number of days computed ahead each time a day is missing
+DEFAULT_WINDOW_DAYS = 7
+# Maximum number of days kept
+MAX_CACHED_DAYS = 64
+
+
+class SunDataService:
+    """
+    Memoized sunrise/sunset calculations for the configured location.
+    The Astral location object is built once and results are kept per
+    (date, solar depression). When a day is missing, a rolling window
+    of days starting with it is computed, so the days that follow are
+    already there. Everything is rebuilt when a configuration reload
+    changes the city/latitude/longitude.
+    """
+    def __init__(self, window_days=DEFAULT_WINDOW_DAYS):
+        self._window_days = window_days
+        self._lock = threading.Lock()
+        self._location_key = None
+        self._city = None
+        # (date, depression) -> sun data dict
+        self._days = {}
+
+    def invalidate(self):
+        """
+        Forget the location and all computed days
+        :return:
+        """
+        with self._lock:
+            self._location_key = None
+            self._city = None
+            self._days = {}
+
+    def reset_after_fork(self):
+        """
+        Replace the lock in a forked worker process. The computed days
+        are still valid and are kept.
+        :return:
+        """
+        self._lock = threading.Lock()
+
+    def _check_location(self):
+        """
+        Build the location object if it does not exist.
+        Called with the lock held.
+        """
+        if self._city is not None:
+            return
+        config = Configuration.Snapshot
+        location_key = (config.City, config.Latitude, config.Longitude)
+
+        # Imported on first use, astral loads the pytz time zone database
+        from astral import Astral
+
+        a = Astral()
+        # We use a city just to get a city object. Then we override the lat/long.
+        # The city object can produce sunrise/sunset in local time.
+        if location_key[0] != "":
+            city = a[location_key[0]]
+        else:
+            # Default if no city is configured
+            city = a["New York"]
+        if location_key[1] != "":
+            city.latitude = float(location_key[1])
+        if location_key[2] != "":
+            city.longitude = float(location_key[2])
+
+        self._city = city
+        self._location_key = location_key
+        self._days = {}
+
+    def sun(self, for_datetime, depression="civil"):
+        """
+        Returns the sun data for the given date
+        :param for_datetime: A date or datetime
+        :param depression: Astral solar depression
+        :return: A dict containing the keys dawn, sunrise, noon, sunset and dusk.
+        The values are datetime objects in local time.
+        """
+        day = for_datetime.date() if isinstance(for_datetime, datetime) else for_datetime
+        with self._lock:
+            self._check_location()
+            data = self._days.get((day, depression))
+            if data is None:
+                data = self._fill_window(day, depression)
+            return dict(data)
+
+    def _fill_window(self, day, depression):
+        """
+        Compute the window of days starting with day. Called with the lock held.
+        :return: The sun data for day (trimming the cache may have dropped it)
+        """
+        self._city.solar_depression = depression
+        for i in range(self._window_days):
+            d = day + timedelta(days=i)
+            if (d, depression) not in self._days:
+                self._days[(d, depression)] = self._city.sun(date=d, local=True)
+        data = self._days[(day, depression)]
+
+        # Keep the most recent days
+        if len(self._days) > MAX_CACHED_DAYS:
+            for key in sorted(self._days.keys())[:len(self._days) - MAX_CACHED_DAYS]:
+                del self._days[key]
+        return data
+
+
+# The shared service
+sun_data_service = SunDataService()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=sun_data_service.reset_after_fork)
+
+
+def _configuration_changed(old, new):
+    if Configuration.changed(old, new, "City", "Latitude", "Longitude"):
+        sun_data_service.invalidate()
+
+
+Configuration.subscribe(_configuration_changed)
+
 
 def get_astral_data(for_datetime):
     '''
@@ -30,21 +152,7 @@ def get_astral_data(for_datetime):
     :return: Returns a dict containing the keys sunrise and sunset.
     The values are datetime objects.
     '''
-    a = Astral()
-    a.solar_depression = "civil"
-    # We use a city just to get a city object. Then we override the lat/long.
-    # The city object can produce sunrise/sunset in local time.
-    if Configuration.City() != "":
-        city = a[Configuration.City()]
-    else:
-        # Default if no city is configured
-        city = a["New York"]
-    if Configuration.Latitude() != "":
-        city.latitude = float(Configuration.Latitude())
-    if Configuration.Longitude() != "":
-        city.longitude = float(Configuration.Longitude())
-
-    return city.sun(date=for_datetime, local=True)
+    return sun_data_service.sun(for_datetime)
 
 
 def get_sun_data(for_datetime):
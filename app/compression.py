@@ -0,0 +1,103 @@
+# coding: utf-8
+#
+# AtHome Control
+# Copyright © 2020  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Compression of JSON responses.
+#
+# A JSON response at least CompressMinSize bytes long is compressed with
+# brotli (when the brotli package is installed and the client accepts it)
+# or gzip. Streamed JSON responses are gzipped chunk by chunk.
+# Static files are handled by app/static_assets.py.
+#
+
+import gzip
+import zlib
+from app import app
+from flask import request
+from configuration import Configuration
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Compression levels tuned for speed since every response is compressed on the fly
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+COMPRESSIBLE_TYPES = {"application/json"}
+
+
+def choose_encoding(accept_encoding):
+    """
+    Pick the best encoding the client accepts
+    :param accept_encoding: The request's Accept-Encoding (a werkzeug MIMEAccept)
+    :return: br, gzip or None
+    """
+    if brotli is not None and accept_encoding["br"]:
+        return "br"
+    if accept_encoding["gzip"]:
+        return "gzip"
+    return None
+
+
+def _gzip_stream(chunks):
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        # Sync flush so each chunk reaches the client as it is produced
+        data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+@app.after_request
+def compress_response(response):
+    """
+    Compress a JSON response when it is worth it
+    :param response:
+    :return:
+    """
+    if not Configuration.CompressResponses() or response.status_code != 200 or \
+            response.mimetype not in COMPRESSIBLE_TYPES or "Content-Encoding" in response.headers:
+        return response
+
+    response.vary.add("Accept-Encoding")
+    encoding = choose_encoding(request.accept_encodings)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        if not request.accept_encodings["gzip"]:
+            return response
+        response.response = _gzip_stream(response.response)
+        response.headers["Content-Encoding"] = "gzip"
+        return response
+
+    data = response.get_data()
+    if len(data) < Configuration.CompressMinSize():
+        return response
+    if encoding == "br":
+        data = brotli.compress(data, quality=BROTLI_QUALITY)
+    else:
+        data = gzip.compress(data, compresslevel=GZIP_LEVEL)
+    response.set_data(data)
+    response.headers["Content-Encoding"] = encoding
+    return response
@@ -0,0 +1,246 @@
+# coding: utf-8
+#
+# AtHome Control
+# Copyright © 2020  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# State change events pushed to browsers over Server-Sent Events (/events).
+#
+# Every successful command sent through the AHPS clients is turned into a
+# compact delta and published to the subscribers:
+#   device-state      {"device-id": 3, "on": true}
+#                     {"device-id": 3, "dim-amount": 20} (Dim and Bright)
+#   all-devices-state {"on": false}
+#   group-state       {"group-id": 2, "on": true}
+#   changed           {"command": "UpdateDevice", "families": ["devices"], ...}
+# Commands that change nothing a client shows (e.g. StatusRequest) are
+# not published.
+# A subscriber that falls too far behind gets a resync event and should
+# reload whatever it is showing.
+#
+# Every open stream holds a request thread for as long as it is open, so
+# the stream is off unless EventStreams is set, and under a production
+# server at most half of the request threads serve streams.
+#
+
+import os
+import queue
+import threading
+from collections import deque
+from app import json_codec
+from configuration import Configuration
+from app.ahps.command_listeners import add_command_listener
+from app.ahps.response_cache import MUTATION_FAMILIES, ALL_FAMILIES, NEUTRAL_COMMANDS
+
+# Number of recent events kept for clients that reconnect with Last-Event-ID
+HISTORY_SIZE = 256
+# Number of undelivered events a subscriber can have before it is resynced
+SUBSCRIBER_QUEUE_SIZE = 100
+
+RESYNC = "resync"
+
+# Commands that change device state and the state they set
+_STATE_COMMANDS = {
+    "On": True, "Off": False,
+    "AllDevicesOn": True, "AllDevicesOff": False,
+    "GroupOn": True, "GroupOff": False,
+}
+
+
+class Subscriber:
+    """
+    One open event stream
+    """
+    def __init__(self):
+        self._queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._overflowed = False
+
+    def put(self, event):
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            self._overflowed = True
+
+    def get(self, timeout):
+        """
+        Wait for the next event
+        :param timeout: Seconds to wait
+        :return: A tuple (id, type, data) or None if nothing arrived in time
+        """
+        if self._overflowed:
+            # Whatever is queued is incomplete, tell the client to start over
+            self._overflowed = False
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            return None, RESYNC, {}
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class EventBroker:
+    """
+    Thread safe publish/subscribe of state change events
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = []
+        self._last_id = 0
+        self._history = deque(maxlen=HISTORY_SIZE)
+
+    def subscribe(self, last_event_id=None):
+        """
+        Open a subscription
+        :param last_event_id: The Last-Event-ID sent by a reconnecting client.
+        The events it missed are replayed, or a resync event is queued if
+        they are no longer available.
+        :return: A Subscriber or None if there are too many subscribers
+        """
+        subscriber = Subscriber()
+        with self._lock:
+            if len(self._subscribers) >= max_subscribers():
+                return None
+            if last_event_id is not None:
+                try:
+                    last_event_id = int(last_event_id)
+                except ValueError:
+                    last_event_id = 0
+                oldest = self._history[0][0] if self._history else self._last_id + 1
+                if last_event_id > self._last_id or oldest > last_event_id + 1:
+                    # Missed events are gone or the server restarted
+                    subscriber.put((None, RESYNC, {}))
+                else:
+                    for event in self._history:
+                        if event[0] > last_event_id:
+                            subscriber.put(event)
+            self._subscribers.append(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            if subscriber in self._subscribers:
+                self._subscribers.remove(subscriber)
+
+    def publish(self, event_type, data):
+        """
+        Send an event to every subscriber
+        :param event_type:
+        :param data: JSON serializable event data
+        :return:
+        """
+        with self._lock:
+            self._last_id += 1
+            event = (self._last_id, event_type, data)
+            self._history.append(event)
+            for subscriber in self._subscribers:
+                subscriber.put(event)
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+
+def max_subscribers():
+    """
+    Number of event streams a worker process may have open
+    :return:
+    """
+    limit = Configuration.EventStreams()
+    if Configuration.ServerMode() != "development":
+        # Leave the other threads for ordinary requests
+        limit = min(limit, Configuration.ServerThreads() // 2)
+    return limit
+
+
+def format_event(event):
+    """
+    Format an event in the text/event-stream format
+    :param event: A tuple (id, type, data)
+    :return:
+    """
+    event_id, event_type, data = event
+    lines = []
+    if event_id is not None:
+        lines.append("id: {0}".format(event_id))
+    lines.append("event: {0}".format(event_type))
+    lines.append("data: {0}".format(json_codec.dumps(data)))
+    return "\n".join(lines) + "\n\n"
+
+
+def command_delta(request, response):
+    """
+    Build the event for a successful command
+    :param request: The request sent to the server
+    :param response: Its response
+    :return: A tuple (type, data) or None when there is nothing to publish
+    """
+    command = request["request"]
+    args = request.get("args", {})
+    if command in ("On", "Off"):
+        data = {"device-id": args.get("device-id"), "on": _STATE_COMMANDS[command]}
+        if "device-color" in args:
+            data["color"] = args["device-color"]
+        if "device-brightness" in args:
+            data["brightness"] = args["device-brightness"]
+        return "device-state", data
+    if command in ("AllDevicesOn", "AllDevicesOff"):
+        return "all-devices-state", {"on": _STATE_COMMANDS[command]}
+    if command in ("GroupOn", "GroupOff"):
+        return "group-state", {"group-id": args.get("group-id"), "on": _STATE_COMMANDS[command]}
+    if command in ("Dim", "Bright"):
+        # The response does not say whether the device is on
+        data = {"device-id": args.get("device-id")}
+        for k in ("dim-amount", "bright-amount"):
+            if k in args:
+                data[k] = args[k]
+        return "device-state", data
+    if command in NEUTRAL_COMMANDS:
+        return None
+
+    data = {"command": command, "families": list(MUTATION_FAMILIES.get(command, ALL_FAMILIES))}
+    # Only the ids are sent. A client that wants the rest fetches the one entity.
+    for k, v in args.items():
+        if k.endswith("-id") or k == "id":
+            data[k] = v
+    if "id" in response:
+        data["id"] = response["id"]
+    return "changed", data
+
+
+event_broker = EventBroker()
+
+
+def _on_command(request, response):
+    delta = command_delta(request, response)
+    if delta is not None:
+        event_broker.publish(*delta)
+
+
+add_command_listener(_on_command)
+
+
+def reset_after_fork():
+    """
+    Called in a forked worker process. Every worker has its own subscribers.
+    :return:
+    """
+    global event_broker
+    event_broker = EventBroker()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_after_fork)
@@ -0,0 +1,199 @@
+# coding: utf-8
+#
+# AtHome Control
+# Copyright © 2020  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# JSON codec used for the AHPS wire traffic and the Flask responses.
+#
+# An accelerated package (orjson, ujson or simdjson) is used when it is
+# installed. Otherwise the standard library json module is used.
+# The JSONCodec configuration variable can force a particular backend:
+# auto (the default), orjson, ujson, simdjson or stdlib.
+#
+# Requests sent to AHPS are encoded with wire_dumps/wire_dumps_bytes,
+# which escape non-ASCII characters like the standard library does.
+# AtHomePowerlineServer has always received ASCII-only JSON. The Flask
+# responses are UTF-8 and may contain non-ASCII characters as is.
+#
+# Always call through the module (json_codec.dumps) because
+# set_backend rebinds the functions.
+#
+
+import json
+import logging
+from configuration import Configuration
+
+logger = logging.getLogger("app")
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+try:
+    import simdjson
+except ImportError:
+    simdjson = None
+
+# Preferred order for auto selection
+BACKENDS = ["orjson", "ujson", "simdjson", "stdlib"]
+
+# Name of the active backend
+backend = None
+
+
+def available_backends():
+    """
+    Returns the names of the backends that can be used
+    :return:
+    """
+    installed = {"orjson": orjson, "ujson": ujson, "simdjson": simdjson, "stdlib": json}
+    return [name for name in BACKENDS if installed[name] is not None]
+
+
+def _stdlib_dumps(obj):
+    return json.dumps(obj)
+
+
+def _stdlib_dumps_bytes(obj):
+    return json.dumps(obj).encode()
+
+
+def _orjson_dumps(obj):
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+
+def _orjson_dumps_bytes(obj):
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+
+def _orjson_wire_dumps_bytes(obj):
+    # orjson has no option to escape non-ASCII characters. They are rare
+    # in requests, so those few are encoded by the standard library.
+    data = orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    if data.isascii():
+        return data
+    return json.dumps(obj).encode()
+
+
+def _orjson_wire_dumps(obj):
+    return _orjson_wire_dumps_bytes(obj).decode()
+
+
+def _ujson_dumps(obj):
+    return ujson.dumps(obj, escape_forward_slashes=False)
+
+
+def _ujson_dumps_bytes(obj):
+    return ujson.dumps(obj, escape_forward_slashes=False).encode()
+
+
+def _ujson_wire_dumps(obj):
+    return ujson.dumps(obj, ensure_ascii=True, escape_forward_slashes=False)
+
+
+def _ujson_wire_dumps_bytes(obj):
+    return _ujson_wire_dumps(obj).encode()
+
+
+def _simdjson_loads(data):
+    # simdjson only decodes
+    return simdjson.loads(data)
+
+
+def set_backend(name="auto"):
+    """
+    Select the backend used by dumps, dumps_bytes, wire_dumps,
+    wire_dumps_bytes and loads
+    :param name: auto or one of BACKENDS
+    :return: The name of the selected backend
+    """
+    global backend, dumps, dumps_bytes, wire_dumps, wire_dumps_bytes, loads
+
+    name = name.lower()
+    if name == "auto":
+        name = available_backends()[0]
+    elif name not in available_backends():
+        logger.error("JSON codec %s is not available, using stdlib", name)
+        name = "stdlib"
+
+    # The standard library escapes non-ASCII characters by default
+    wire_dumps, wire_dumps_bytes = _stdlib_dumps, _stdlib_dumps_bytes
+    if name == "orjson":
+        dumps, dumps_bytes, loads = _orjson_dumps, _orjson_dumps_bytes, orjson.loads
+        wire_dumps, wire_dumps_bytes = _orjson_wire_dumps, _orjson_wire_dumps_bytes
+    elif name == "ujson":
+        dumps, dumps_bytes, loads = _ujson_dumps, _ujson_dumps_bytes, ujson.loads
+        wire_dumps, wire_dumps_bytes = _ujson_wire_dumps, _ujson_wire_dumps_bytes
+    elif name == "simdjson":
+        dumps, dumps_bytes, loads = _stdlib_dumps, _stdlib_dumps_bytes, _simdjson_loads
+    else:
+        dumps, dumps_bytes, loads = _stdlib_dumps, _stdlib_dumps_bytes, json.loads
+    backend = name
+    return backend
+
+
+# Functions bound by set_backend
+dumps = _stdlib_dumps
+dumps_bytes = _stdlib_dumps_bytes
+wire_dumps = _stdlib_dumps
+wire_dumps_bytes = _stdlib_dumps_bytes
+loads = json.loads
+
+set_backend(Configuration.JSONCodec())
+
+
+def jsonify(obj):
+    """
+    Codec based replacement for flask.jsonify
+    :param obj: The response data
+    :return: A Flask response
+    """
+    from flask import current_app
+    return current_app.response_class(dumps_bytes(obj) + b"\n", mimetype="application/json")
+
+
+try:
+    from flask.json.provider import DefaultJSONProvider
+
+    class CodecJSONProvider(DefaultJSONProvider):
+        """
+        Flask (2.2 and later) JSON provider that serializes through the codec
+        """
+        def dumps(self, obj, **kwargs):
+            if kwargs:
+                return super().dumps(obj, **kwargs)
+            return dumps(obj)
+
+        def loads(self, s, **kwargs):
+            if kwargs:
+                return super().loads(s, **kwargs)
+            return loads(s)
+
+        def response(self, *args, **kwargs):
+            obj = self._prepare_response_obj(args, kwargs)
+            return self._app.response_class(dumps_bytes(obj) + b"\n", mimetype=self.mimetype)
+
+except ImportError:
+    # Older versions of Flask have no provider hook. The views call
+    # json_codec.jsonify directly instead.
+    CodecJSONProvider = None
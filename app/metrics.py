@@ -0,0 +1,267 @@
+# coding: utf-8
+#
+# AtHome Control
+# Copyright © 2020  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# In process metrics rendered in the Prometheus text format by /metrics.
+#
+# Recording a value is a dict lookup and a few additions under one lock,
+# cheap enough to leave on all the time. Every worker process keeps its
+# own metrics.
+#
+
+import os
+import threading
+from bisect import bisect_left
+
+# Latency buckets in seconds
+ROUTE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+AHPS_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 10.0)
+
+# Maximum number of label combinations per metric. Beyond that new
+# combinations are folded into one with every label set to "other".
+MAX_SERIES = 500
+
+_lock = threading.Lock()
+_metrics = []
+# Functions that return extra lines for /metrics
+_collectors = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = ['{0}="{1}"'.format(n, _escape(v)) for n, v in zip(names, values)]
+    if extra is not None:
+        pairs.append('{0}="{1}"'.format(*extra))
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    Base for the metric types
+    """
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        _metrics.append(self)
+
+    def _key(self, labels):
+        """
+        Called with the lock held
+        """
+        if labels in self._series or len(self._series) < MAX_SERIES:
+            return labels
+        return ("other",) * len(self.labelnames)
+
+    def render(self):
+        lines = ["# HELP {0} {1}".format(self.name, self.documentation),
+                 "# TYPE {0} {1}".format(self.name, self.kind)]
+        with _lock:
+            series = [(labels, self._snapshot(value)) for labels, value in self._series.items()]
+        for labels, value in sorted(series):
+            lines.extend(self._render_series(labels, value))
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, labels=(), amount=1):
+        with _lock:
+            key = self._key(labels)
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def _snapshot(self, value):
+        return value
+
+    def _render_series(self, labels, value):
+        return ["{0}{1} {2}".format(self.name, _format_labels(self.labelnames, labels), _format_value(value))]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=ROUTE_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, labels, value):
+        """
+        Record one observation
+        :param labels: Tuple of label values
+        :param value: Seconds
+        :return:
+        """
+        i = bisect_left(self.buckets, value)
+        with _lock:
+            key = self._key(labels)
+            series = self._series.get(key)
+            if series is None:
+                # Per bucket counts (the last is +Inf), sum
+                series = [[0] * (len(self.buckets) + 1), 0.0]
+                self._series[key] = series
+            series[0][i] += 1
+            series[1] += value
+
+    def _snapshot(self, value):
+        return list(value[0]), value[1]
+
+    def _render_series(self, labels, value):
+        counts, total = value
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            lines.append("{0}_bucket{1} {2}".format(
+                self.name, _format_labels(self.labelnames, labels, ("le", _format_value(float(bound)))),
+                cumulative))
+        label_text = _format_labels(self.labelnames, labels)
+        lines.append("{0}_sum{1} {2}".format(self.name, label_text, repr(total)))
+        lines.append("{0}_count{1} {2}".format(self.name, label_text, cumulative))
+        return lines
+
+
+def add_collector(collector):
+    """
+    Register a function that returns extra exposition lines (a list of str)
+    :param collector:
+    :return:
+    """
+    _collectors.append(collector)
+
+
+def render():
+    """
+    All metrics in the Prometheus text format
+    :return:
+    """
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    for collector in _collectors:
+        lines.extend(collector())
+    return "\n".join(lines) + "\n"
+
+
+def gauge_lines(name, documentation, values, labelname=None):
+    """
+    Exposition lines for a gauge
+    :param name:
+    :param documentation:
+    :param values: A number, or a dict of label value -> number when labelname is given
+    :param labelname:
+    :return:
+    """
+    return _sample_lines("gauge", name, documentation, values, labelname)
+
+
+def counter_lines(name, documentation, values, labelname=None):
+    """
+    Exposition lines for a counter kept elsewhere (e.g. a stats dict)
+    :param name: Should end in _total
+    :param documentation:
+    :param values: A number, or a dict of label value -> number when labelname is given
+    :param labelname:
+    :return:
+    """
+    return _sample_lines("counter", name, documentation, values, labelname)
+
+
+def _sample_lines(kind, name, documentation, values, labelname):
+    lines = ["# HELP {0} {1}".format(name, documentation), "# TYPE {0} {1}".format(name, kind)]
+    if labelname is None:
+        lines.append("{0} {1}".format(name, _format_value(values)))
+    else:
+        for label, value in sorted(values.items()):
+            lines.append("{0}{1} {2}".format(name, _format_labels((labelname,), (label,)), _format_value(value)))
+    return lines
+
+
+# HTTP routes
+http_request_seconds = Histogram(
+    "athome_http_request_seconds", "Time to handle a request until the response is returned",
+    ("method", "route", "status"), ROUTE_BUCKETS)
+
+# AHPS client
+ahps_command_seconds = Histogram(
+    "athome_ahps_command_seconds", "Total time of an AHPS command", ("command",), AHPS_BUCKETS)
+ahps_phase_seconds = Histogram(
+    "athome_ahps_phase_seconds",
+    "Time of each phase of an AHPS command (connect, send, first_byte, read, decode)",
+    ("command", "phase"), AHPS_BUCKETS)
+ahps_errors = Counter(
+    "athome_ahps_errors_total", "AHPS commands that failed in the client", ("command", "error"))
+ahps_failures = Counter(
+    "athome_ahps_failures_total", "AHPS commands the server answered with a non-zero result code",
+    ("command", "result_code"))
+
+
+def transfer_phases(timings, start, connected, sent, first_byte, end):
+    """
+    Fill in the network phases of an AHPS command from perf_counter() stamps
+    :param timings: dict of phase -> seconds to fill in
+    :param start: Before the connection was opened or taken from the pool
+    :param connected: Before the request was sent
+    :param sent: After the request was sent
+    :param first_byte: When the first byte of the response arrived (None if it was already buffered)
+    :param end: When the complete response had arrived
+    :return:
+    """
+    if first_byte is None:
+        first_byte = sent
+    timings["connect"] = connected - start
+    timings["send"] = sent - connected
+    timings["first_byte"] = first_byte - sent
+    timings["read"] = end - first_byte
+
+
+def observe_phases(command, timings):
+    """
+    Record the phase timings of one AHPS command
+    :param command: The request name
+    :param timings: dict of phase -> seconds
+    :return:
+    """
+    for phase, seconds in timings.items():
+        ahps_phase_seconds.observe((command, phase), seconds)
+
+
+def reset_after_fork():
+    """
+    Called in a forked worker process. The lock may have been held at the
+    time of the fork.
+    :return:
+    """
+    global _lock
+    _lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_after_fork)
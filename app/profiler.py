@@ -0,0 +1,199 @@
+# coding: utf-8
+#
+# AtHome Control
+# Copyright © 2020  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Sampling profiler for single requests.
+#
+# While a request is profiled a background thread samples the stack of the
+# thread handling it. The samples are written in the collapsed stack format
+# ("outer;inner;leaf count" per line) that flamegraph.pl, speedscope and
+# inferno read. The profiles are kept in a directory that holds at most
+# ProfileKeep files, the oldest are removed first.
+#
+
+import os
+import re
+import sys
+import time
+import threading
+from collections import Counter
+from datetime import datetime
+
+# Profile file names: <timestamp>_<method>_<path>_<milliseconds>ms_<samples>s.collapsed
+PROFILE_SUFFIX = ".collapsed"
+PROFILE_NAME_RE = re.compile(r"^(\d{8}T\d{6}\.\d{6})_([A-Z]+)_(.*)_(\d+)ms_(\d+)s\.collapsed$")
+_UNSAFE_CHARS = re.compile(r"[^A-Za-z0-9.-]+")
+
+# The sampler thread only runs when it gets the GIL, so the switch interval
+# is shortened while any request is being profiled.
+_active_samplers = 0
+_saved_switch_interval = None
+_switch_lock = threading.Lock()
+
+
+def _sampler_started(interval):
+    global _active_samplers, _saved_switch_interval
+    with _switch_lock:
+        if _active_samplers == 0:
+            _saved_switch_interval = sys.getswitchinterval()
+            sys.setswitchinterval(min(_saved_switch_interval, interval / 2))
+        _active_samplers += 1
+
+
+def _sampler_stopped():
+    global _active_samplers
+    with _switch_lock:
+        _active_samplers -= 1
+        if _active_samplers == 0:
+            sys.setswitchinterval(_saved_switch_interval)
+
+
+class RequestSampler:
+    """
+    Samples the stack of one thread until stopped
+    """
+    def __init__(self, thread_id, interval):
+        """
+        Sampler constructor
+        :param thread_id: threading.get_ident() of the thread to sample
+        :param interval: Seconds between samples
+        """
+        self._thread_id = thread_id
+        self._interval = interval
+        self._stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+        self.started = None
+        self.elapsed = None
+
+    def start(self):
+        _sampler_started(self._interval)
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop sampling
+        :return: Counter of collapsed stack -> number of samples
+        """
+        self._stop.set()
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self.started
+        _sampler_stopped()
+        return self._stacks
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            frame = sys._current_frames().get(self._thread_id)
+            if frame is None:
+                break
+            self._stacks[self._collapse(frame)] += 1
+
+    @staticmethod
+    def _collapse(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append("{0} ({1}:{2})".format(code.co_name, _short_path(code.co_filename),
+                                                code.co_firstlineno))
+            frame = frame.f_back
+        names.reverse()
+        return ";".join(names)
+
+
+def _short_path(path):
+    """
+    The last two components of a source file path
+    """
+    head, tail = os.path.split(path)
+    return os.path.join(os.path.basename(head), tail)
+
+
+class ProfileStore:
+    """
+    Bounded directory of profiles
+    """
+    # Shared by every store so concurrent saves do not race the cleanup
+    _lock = threading.Lock()
+
+    def __init__(self, directory, keep):
+        self.directory = directory
+        self.keep = keep
+
+    def save(self, method, path, elapsed, stacks):
+        """
+        Write a profile and drop the oldest ones beyond the limit
+        :param method: HTTP method
+        :param path: Request path
+        :param elapsed: Seconds the request was profiled
+        :param stacks: Counter of collapsed stack -> samples
+        :return: The profile file name
+        """
+        slug = _UNSAFE_CHARS.sub("-", path.strip("/")) or "root"
+        name = "{0}_{1}_{2}_{3}ms_{4}s{5}".format(datetime.now().strftime("%Y%m%dT%H%M%S.%f"), method,
+                                                  slug[:80], int(elapsed * 1000), sum(stacks.values()),
+                                                  PROFILE_SUFFIX)
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, name), "w") as f:
+                for stack, count in stacks.most_common():
+                    f.write("{0} {1}\n".format(stack, count))
+            names = self._names()
+            for old in names[:max(0, len(names) - self.keep)]:
+                try:
+                    os.remove(os.path.join(self.directory, old))
+                except OSError:
+                    pass
+        return name
+
+    def _names(self):
+        """
+        Profile file names, oldest first
+        """
+        try:
+            return sorted(n for n in os.listdir(self.directory) if PROFILE_NAME_RE.match(n))
+        except OSError:
+            return []
+
+    def list(self):
+        """
+        Describe the stored profiles, newest first
+        :return: A list of dicts
+        """
+        profiles = []
+        for name in reversed(self._names()):
+            m = PROFILE_NAME_RE.match(name)
+            try:
+                size = os.path.getsize(os.path.join(self.directory, name))
+            except OSError:
+                continue
+            profiles.append({
+                "name": name,
+                "created": datetime.strptime(m.group(1), "%Y%m%dT%H%M%S.%f").isoformat(),
+                "method": m.group(2),
+                "path": m.group(3),
+                "elapsed-ms": int(m.group(4)),
+                "samples": int(m.group(5)),
+                "size": size
+            })
+        return profiles
+
+    def is_profile(self, name):
+        return PROFILE_NAME_RE.match(name) is not None
@@ -0,0 +1,78 @@
+# coding: utf-8
+#
+# AtHome Control
+# Copyright © 2020  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Request correlation ids.
+#
+# Every request gets an id, taken from a well formed X-Request-ID header
+# or generated. It is stamped on every log record written while the
+# request is handled, including the AHPS commands the request sends, and
+# echoed in the X-Request-ID response header. When the request completes
+# one record with its route, status and duration is logged.
+#
+
+import re
+import time
+import uuid
+import logging
+from app import app
+from flask import request, g
+import Logging
+
+logger = logging.getLogger("app")
+
+REQUEST_ID_HEADER = "X-Request-ID"
+# Ids accepted from the client
+VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._:-]{1,64}$")
+
+
+@app.before_request
+def assign_request_id():
+    request_id = request.headers.get(REQUEST_ID_HEADER, "")
+    if not VALID_REQUEST_ID.match(request_id):
+        request_id = uuid.uuid4().hex
+    g.request_id = request_id
+    g.request_id_token = Logging.SetRequestId(request_id)
+    g.request_log_start = time.perf_counter()
+
+
+@app.after_request
+def log_request(response):
+    """
+    Echo the correlation id and log the request duration. For a streamed
+    response this is the time until the response starts.
+    :param response:
+    :return:
+    """
+    request_id = g.get("request_id")
+    if request_id is None:
+        return response
+    response.headers[REQUEST_ID_HEADER] = request_id
+    duration_ms = round((time.perf_counter() - g.request_log_start) * 1000, 2)
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    logger.info("%s %s %d %.1fms", request.method, request.path, response.status_code, duration_ms,
+                extra={"method": request.method, "path": request.path, "route": route,
+                       "status": response.status_code, "duration_ms": duration_ms})
+    return response
+
+
+@app.teardown_request
+def clear_request_id(exc):
+    token = g.pop("request_id_token", None)
+    if token is not None:
+        Logging.ResetRequestId(token)
@@ -30,6 +30,7 @@ export class DevicesTable extends BaseTable {
         super(props);
 
         this.statusTimer = null;
+        this.eventSource = null;
 
         this.statusUpdate = this.statusUpdate.bind(this);
         this.unload = this.unload.bind(this);
@@ -43,6 +44,10 @@ export class DevicesTable extends BaseTable {
         this.onDiscoverDevicesClick = this.onDiscoverDevicesClick.bind(this);
         this.onDiscoverDevicesSuccess = this.onDiscoverDevicesSuccess.bind(this);
         this.onDiscoverDevicesError = this.onDiscoverDevicesError.bind(this);
+        this.onDeviceStateEvent = this.onDeviceStateEvent.bind(this);
+        this.onAllDevicesStateEvent = this.onAllDevicesStateEvent.bind(this);
+        this.onChangedEvent = this.onChangedEvent.bind(this);
+        this.onResyncEvent = this.onResyncEvent.bind(this);
     }
 
     // Set up status update timer
@@ -51,6 +56,7 @@ export class DevicesTable extends BaseTable {
       this.statusTimer = setInterval(this.statusUpdate, this.props.updatetime * 1000);
       console.log("Status interval timer started");
       window.addEventListener("beforeunload", this.unload);
+      this.openEventSource();
       super.componentDidMount();
     }
 
@@ -59,6 +65,7 @@ export class DevicesTable extends BaseTable {
       this.statusTimer = null;
       console.log("Status interval timer cleared");
       window.removeEventListener("beforeunload", this.unload);
+      this.closeEventSource();
       super.componentWillUnmount();
     }
 
@@ -68,6 +75,69 @@ export class DevicesTable extends BaseTable {
         clearInterval(this.statusTimer);
         // console.log("Status interval timer unloaded");
       }
+      this.closeEventSource();
+    }
+
+    // Subscribe to state change events so a change made anywhere
+    // patches the affected rows instead of reloading the table
+    // The stream is only opened when the server turned it on (EventStreams)
+    openEventSource() {
+      if (typeof EventSource === "undefined" || document.querySelector('meta[name="athome-events"]') === null) {
+        return;
+      }
+      this.eventSource = new EventSource("/events");
+      // Refused (e.g. too many streams), the browser does not reconnect
+      this.eventSource.onerror = () => {
+        if (this.eventSource !== null && this.eventSource.readyState === EventSource.CLOSED) {
+          this.eventSource = null;
+        }
+      };
+      this.eventSource.addEventListener("device-state", this.onDeviceStateEvent);
+      this.eventSource.addEventListener("all-devices-state", this.onAllDevicesStateEvent);
+      this.eventSource.addEventListener("changed", this.onChangedEvent);
+      this.eventSource.addEventListener("resync", this.onResyncEvent);
+    }
+
+    closeEventSource() {
+      if (this.eventSource !== null) {
+        this.eventSource.close();
+        this.eventSource = null;
+      }
+    }
+
+    onDeviceStateEvent(event) {
+      const data = JSON.parse(event.data);
+      const rows = this.state.rows;
+      rows.forEach(function(row) {
+        // Dim and Bright events do not carry the on state
+        if (String(row.id) === String(data["device-id"]) && "on" in data) {
+          row["on"] = data["on"];
+        }
+      });
+      this.setState({rows: rows});
+    }
+
+    onAllDevicesStateEvent(event) {
+      const data = JSON.parse(event.data);
+      const rows = this.state.rows;
+      rows.forEach(function(row) {
+        row["on"] = data["on"];
+      });
+      this.setState({rows: rows});
+    }
+
+    onChangedEvent(event) {
+      const data = JSON.parse(event.data);
+      if (data.command === "DeleteDevice") {
+        const rows = this.state.rows.filter(row => String(row.id) !== String(data["device-id"]));
+        this.setState({rows: rows});
+      } else if (data.families.includes("devices")) {
+        this.loadTable(this.props.url);
+      }
+    }
+
+    onResyncEvent() {
+      this.loadTable(this.props.url);
     }
 
     // On/Off status update
@@ -185,7 +255,8 @@ export class DevicesTable extends BaseTable {
         dataType: "json",
         success: function(data, status, xhr) {
           $this.showMessage(`Device ${rows[row_index]["name"]} removed`);
-          // Remove device from list
+          // Remove device from list. The changed event only reaches the streams
+          // of the worker process that ran the command, so always reload.
           $this.loadTable($this.props.url);
         },
         error: function(xhr, status, msg) {
@@ -0,0 +1,117 @@
+# coding: utf-8
+#
+# AtHome Control
+# Copyright © 2020  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Static file serving.
+#
+# The webpack builds write dist/assets-manifest.json, which maps each
+# bundle to the file name it was built under. The production build puts a
+# content hash in the name and writes .gz and .br copies next to each
+# bundle. The static route sends the precompressed copy the client
+# accepts and marks hashed files as immutable so browsers never
+# revalidate them.
+#
+
+import os
+import re
+import json
+import mimetypes
+import threading
+from app import app
+from flask import request, send_from_directory
+
+# Maps bundle names to the built file names
+MANIFEST_FILE = "dist/assets-manifest.json"
+# A content hash in a file name, e.g. bundler.3f9a1c2e.js
+HASHED_NAME_RE = re.compile(r"\.[0-9a-f]{8,}\.")
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Precompressed file suffix for each encoding, best first
+PRECOMPRESSED = [("br", ".br"), ("gzip", ".gz")]
+
+_manifest = {}
+_manifest_mtime = None
+_manifest_lock = threading.Lock()
+
+
+def _load_manifest():
+    """
+    Returns the asset manifest, reloading it when the build rewrites it
+    :return:
+    """
+    global _manifest, _manifest_mtime
+    path = os.path.join(app.static_folder, MANIFEST_FILE)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return {}
+    with _manifest_lock:
+        if mtime != _manifest_mtime:
+            try:
+                with open(path, "r") as f:
+                    _manifest = json.load(f)
+            except (OSError, ValueError):
+                _manifest = {}
+            _manifest_mtime = mtime
+        return _manifest
+
+
+@app.template_global()
+def asset_path(name, default):
+    """
+    Static path of a bundle built by webpack
+    :param name: The bundle name in the manifest (e.g. main.js)
+    :param default: Path used when there is no manifest entry
+    :return: A path relative to the static folder
+    """
+    built = _load_manifest().get(name)
+    if built is None:
+        return default
+    return os.path.dirname(MANIFEST_FILE) + "/" + built.lstrip("/")
+
+
+def send_static(filename):
+    """
+    Replacement for the Flask static view
+    :param filename:
+    :return:
+    """
+    cache_timeout = None
+    if HASHED_NAME_RE.search(os.path.basename(filename)):
+        cache_timeout = 31536000
+
+    mimetype = mimetypes.guess_type(filename)[0]
+    for encoding, suffix in PRECOMPRESSED:
+        if not request.accept_encodings[encoding]:
+            continue
+        compressed = os.path.join(app.static_folder, filename + suffix)
+        if os.path.isfile(compressed):
+            response = send_from_directory(app.static_folder, filename + suffix,
+                                           mimetype=mimetype, cache_timeout=cache_timeout)
+            # send_file guesses an encoding from the suffix, replace it
+            response.headers["Content-Encoding"] = encoding
+            break
+    else:
+        response = send_from_directory(app.static_folder, filename, cache_timeout=cache_timeout)
+
+    response.vary.add("Accept-Encoding")
+    if cache_timeout is not None:
+        response.headers["Cache-Control"] = IMMUTABLE_CACHE_CONTROL
+    return response
+
+
+app.view_functions["static"] = send_static
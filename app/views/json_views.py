@@ -34,14 +34,24 @@ How to send JSON from Javascript jQuery
     }
   });
 """
+import re
 import time
-from datetime import timedelta, datetime
-import json
+import hashlib
+import itertools
+import threading
+from collections import OrderedDict
+from datetime import timedelta, datetime, date
+from functools import lru_cache
+from Logging import LazyJSON
 from http import HTTPStatus
 from app import app
-from flask import jsonify, request, make_response
+from flask import request, make_response, Response
+from app import json_codec
+from app import events
+from app.json_codec import jsonify
 from app.ahps.ahps_api import AHPSRequest
 from app.ahps.sun_data import get_astral_data
+from app.ahps.state_jobs import start_all_devices_job, start_group_job, get_job
 from configuration import Configuration
 from Version import get_version
 import logging
@@ -49,6 +59,9 @@ import logging
 
 logger = logging.getLogger("app")
 
+# Seconds between keep alive comments on an idle event stream
+EVENT_HEARTBEAT = 15
+
 
 @app.route("/version", methods=['GET'])
 def get_app_version():
@@ -60,9 +73,11 @@ def get_app_version():
 @app.route("/devices", methods=['GET'])
 def get_devices():
     api_req = AHPSRequest()
+    if Configuration.StreamListResponses():
+        return stream_list_response(api_req, api_req.iter_devices())
     res = api_req.get_all_devices()
     if res and "devices" in res.keys():
-        return jsonify({"data": res["devices"]})
+        return conditional_response(api_req, lambda: list_response(res["devices"]))
     response = jsonify(api_req.last_error)
     response.status_code = HTTPStatus.BAD_REQUEST
     return response
@@ -108,7 +123,7 @@ def get_device(id):
     api_req = AHPSRequest()
     res = api_req.get_device(id)
     if res:
-        return jsonify({"data": res["device"]})
+        return conditional_response(api_req, lambda: jsonify({"data": res["device"]}))
     response = jsonify(api_req.last_error)
     response.status_code = HTTPStatus.BAD_REQUEST
     return response
@@ -145,14 +160,18 @@ def get_all_programs():
     :return:
     """
     api_req = AHPSRequest()
+    if Configuration.StreamListResponses():
+        # The summaries depend on today's sunrise/sunset
+        return stream_list_response(api_req, iter_program_summaries(api_req.iter_programs()), date.today())
     res = api_req.get_all_programs()
 
     # Build response with program summary
     if res:
-        for p in res["programs"]:
-            p["summary"] = build_program_summary(p)
-
-        return jsonify({"data": res["programs"]})
+        def build():
+            build_program_summaries(res["programs"])
+            return list_response(res["programs"])
+        # The summaries depend on today's sunrise/sunset
+        return conditional_response(api_req, build, date.today())
     response = jsonify(api_req.last_error)
     response.status_code = HTTPStatus.BAD_REQUEST
     return response
@@ -190,10 +209,11 @@ def get_device_programs(id):
 
     # Build response with program summary
     if res:
-        for p in res["programs"]:
-            p["summary"] = build_program_summary(p)
-
-        return jsonify({"data": res["programs"]})
+        def build():
+            build_program_summaries(res["programs"])
+            return jsonify({"data": res["programs"]})
+        # The summaries depend on today's sunrise/sunset
+        return conditional_response(api_req, build, date.today())
     response = jsonify(api_req.last_error)
     response.status_code = HTTPStatus.BAD_REQUEST
     return response
@@ -211,10 +231,11 @@ def get_available_device_programs(id):
 
     # Build response with program summary
     if res:
-        for p in res["programs"]:
-            p["summary"] = build_program_summary(p)
-
-        return jsonify({"data": res["programs"]})
+        def build():
+            build_program_summaries(res["programs"])
+            return jsonify({"data": res["programs"]})
+        # The summaries depend on today's sunrise/sunset
+        return conditional_response(api_req, build, date.today())
     response = jsonify(api_req.last_error)
     response.status_code = HTTPStatus.BAD_REQUEST
     return response
@@ -276,7 +297,7 @@ def get_device_program(id):
     res = api_req.get_program_by_id(id)
 
     if res:
-        return jsonify({"data": res["program"]})
+        return conditional_response(api_req, lambda: jsonify({"data": res["program"]}))
     response = jsonify(api_req.last_error)
     response.status_code = HTTPStatus.BAD_REQUEST
     return response
@@ -305,7 +326,7 @@ def save_device_program(id):
 
     r = api_req.update_device_program(program)
     if r:
-        logger.debug("Update device program: %s", json.dumps(program, indent=4))
+        logger.debug("Update device program: %s", LazyJSON(program))
 
         # We are obligated to send a json response
         return jsonify(r)
@@ -327,6 +348,9 @@ def set_all_devices_state():
     # request.form property provided by Flask. So,
     # data: { 'state': new_state } --> request.form['state']
     arg = request.form['state']
+    if arg in ["on", "off"] and is_async_request():
+        return job_response(start_all_devices_job(arg))
+
     api_req = AHPSRequest()
     if arg == "on":
         res = api_req.all_devices_on()
@@ -469,6 +493,10 @@ def save_device(id):
     return response
 
 
+# The device fields sent with UpdateDevice
+DEVICE_FIELDS = ["name", "location", "mfg", "address", "channel", "color", "brightness"]
+
+
 @app.route('/devices', methods=['PUT'])
 def save_all_devices():
     """
@@ -478,23 +506,48 @@ def save_all_devices():
     devices = request.get_json()
     api_req = AHPSRequest()
 
-    for device in devices:
-        r = api_req.update_device(device["id"],
+    # Older clients send the manufacturer as type
+    devices = [dict(device, mfg=device["type"]) if "mfg" not in device and "type" in device else device
+               for device in devices]
+
+    # UpdateDevice replaces every field, so a field the client left out
+    # keeps the value the server already has
+    if any(field not in device for device in devices for field in DEVICE_FIELDS):
+        res = api_req.get_all_devices()
+        if not res:
+            response = jsonify(api_req.last_error)
+            response.status_code = HTTPStatus.BAD_REQUEST
+            return response
+        stored = {str(device["id"]): device for device in res["devices"]}
+        for i, device in enumerate(devices):
+            if str(device["id"]) not in stored:
+                response = jsonify({"message": "Device {0} not found".format(device["id"])})
+                response.status_code = HTTPStatus.BAD_REQUEST
+                return response
+            devices[i] = dict(stored[str(device["id"])], **device)
+
+    # All of the updates go to the server as one batch
+    with api_req.batch() as batch:
+        for device in devices:
+            api_req.update_device(device["id"],
                                   device["name"],
                                   device["location"],
-                                  device["type"],
-                                  device["address"])
+                                  device["mfg"],
+                                  device["address"],
+                                  device["channel"],
+                                  device["color"],
+                                  device["brightness"])
+
+    for r, error in zip(batch.responses, batch.errors):
         if not r:
-            response = jsonify(api_req.last_error)
+            response = jsonify(error)
             response.status_code = HTTPStatus.BAD_REQUEST
             return response
 
     # We are obligated to send a json response
-    if r:
-        return jsonify(r)
-    response = jsonify(api_req.last_error)
-    response.status_code = HTTPStatus.BAD_REQUEST
-    return response
+    if batch.responses:
+        return jsonify(batch.responses[-1])
+    return jsonify({})
 
 
 @app.route('/devices', methods=['POST'])
@@ -552,9 +605,11 @@ def delete_device(id):
 @app.route("/actiongroups", methods=['GET'])
 def get_action_groups():
     api_req = AHPSRequest()
+    if Configuration.StreamListResponses():
+        return stream_list_response(api_req, api_req.iter_action_groups())
     res = api_req.get_all_action_groups()
     if res and "groups" in res.keys():
-        return jsonify({"data": res["groups"]})
+        return conditional_response(api_req, lambda: list_response(res["groups"]))
     response = jsonify(api_req.last_error)
     response.status_code = HTTPStatus.BAD_REQUEST
     return response
@@ -601,7 +656,7 @@ def get_action_group(group_id):
     api_req = AHPSRequest()
     res = api_req.get_action_group(group_id)
     if res and "group" in res.keys():
-        return jsonify({"data": res["group"]})
+        return conditional_response(api_req, lambda: jsonify({"data": res["group"]}))
     response = jsonify(api_req.last_error)
     response.status_code = HTTPStatus.BAD_REQUEST
     return response
@@ -623,7 +678,7 @@ def save_action_group(id):
 
     r = api_req.update_action_group(group)
     if r:
-        logger.debug("Update action group: %s", json.dumps(group, indent=4))
+        logger.debug("Update action group: %s", LazyJSON(group))
 
         # We are obligated to send a json response
         return jsonify(r)
@@ -637,7 +692,7 @@ def get_action_group_devices(group_id):
     api_req = AHPSRequest()
     res = api_req.get_action_group_devices(group_id)
     if res and "devices" in res.keys():
-        return jsonify({"data": res["devices"]})
+        return conditional_response(api_req, lambda: jsonify({"data": res["devices"]}))
     response = jsonify(api_req.last_error)
     response.status_code = HTTPStatus.BAD_REQUEST
     return response
@@ -655,7 +710,7 @@ def get_available_group_devices(id):
 
     # Build response with program summary
     if res and "devices" in res.keys():
-        return jsonify({"data": res["devices"]})
+        return conditional_response(api_req, lambda: jsonify({"data": res["devices"]}))
     response = jsonify(api_req.last_error)
     response.status_code = HTTPStatus.BAD_REQUEST
     return response
@@ -687,6 +742,9 @@ def set_groups_state(group_id):
     # request.form property provided by Flask. So,
     # data: { 'state': new_state } --> request.form['state']
     arg = request.form['state']
+    if arg in ["on", "off"] and is_async_request():
+        return job_response(start_group_job(group_id, arg))
+
     api_req = AHPSRequest()
     if arg == "on":
         res = api_req.group_on(group_id)
@@ -730,6 +788,59 @@ def delete_action_group_device(group_id, device_id):
     return response
 
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """
+    Report the progress of a background state change job
+    :param job_id:
+    :return:
+    """
+    job = get_job(job_id)
+    if job is None:
+        response = jsonify({"message": "Job {0} not found".format(job_id)})
+        response.status_code = HTTPStatus.NOT_FOUND
+        return response
+    return jsonify(job.to_dict())
+
+
+@app.route('/events', methods=['GET'])
+def get_events():
+    """
+    Server-Sent Events stream of device and group state changes
+    (see app/events.py for the event types)
+    :return:
+    """
+    if Configuration.EventStreams() <= 0:
+        response = jsonify({"message": "Event streams are turned off"})
+        response.status_code = HTTPStatus.NOT_FOUND
+        return response
+    broker = events.event_broker
+    subscriber = broker.subscribe(request.headers.get("Last-Event-ID"))
+    if subscriber is None:
+        response = jsonify({"message": "Too many event streams"})
+        response.status_code = HTTPStatus.SERVICE_UNAVAILABLE
+        return response
+
+    def generate():
+        try:
+            # Client reconnect delay in milliseconds
+            yield "retry: 5000\n\n"
+            while True:
+                event = subscriber.get(EVENT_HEARTBEAT)
+                if event is None:
+                    yield ": keep-alive\n\n"
+                else:
+                    yield events.format_event(event)
+        finally:
+            broker.unsubscribe(subscriber)
+
+    response = Response(generate(), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    # Tell nginx not to buffer the stream
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
+
+
 @app.route('/location', methods=['GET'])
 def get_location():
     """
@@ -740,42 +851,251 @@ def get_location():
         "latitude": Configuration.Latitude(),
         "longitude": Configuration.Longitude()
     }
-    return jsonify(resp)
+    return conditional_response(None, lambda: jsonify(resp), resp["latitude"], resp["longitude"])
 
 
-def build_program_summary(program):
+# Maximum number of resources whose Last-Modified time is remembered
+MAX_VALIDATORS = 512
+# (path, etag) -> time the representation was first served
+_first_served = OrderedDict()
+_first_served_lock = threading.Lock()
+
+
+def conditional_response(api_req, build, *salt):
     """
-    Build a summary line (human readable) for a device timer program
-    :param program:
+    Conditional GET support for a read route. The ETag is derived from
+    the raw AHPS response frame (plus anything else the representation
+    depends on) so the body is only built when the client's copy is stale.
+    :param api_req: The AHPSRequest that fetched the data (None if the route
+    does not depend on the server)
+    :param build: Function that builds the full response
+    :param salt: Other values the representation depends on
+    :return: A 304 response or the response from build
+    """
+    digest = api_req.last_frame_digest if api_req is not None else ""
+    if digest is None:
+        return build()
+    if salt:
+        digest += hashlib.blake2b(repr(salt).encode(), digest_size=4).hexdigest()
+
+    # Last-Modified is when this server first served the representation
+    key = (request.path, digest)
+    with _first_served_lock:
+        last_modified = _first_served.get(key)
+        if last_modified is None:
+            last_modified = datetime.utcnow().replace(microsecond=0)
+            _first_served[key] = last_modified
+            if len(_first_served) > MAX_VALIDATORS:
+                _first_served.popitem(last=False)
+        else:
+            _first_served.move_to_end(key)
+
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains_weak(digest)
+    else:
+        not_modified = request.if_modified_since is not None and \
+                       last_modified <= request.if_modified_since.replace(tzinfo=None)
+
+    response = Response(status=HTTPStatus.NOT_MODIFIED) if not_modified else build()
+    # Weak because the body may be compressed on the way out
+    response.set_etag(digest, weak=True)
+    response.last_modified = last_modified
+    # Always revalidate
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+# Target size of each chunk of a streamed list response
+STREAM_CHUNK_SIZE = 16 * 1024
+
+
+def is_async_request():
+    """
+    True when the client asked for a state change to run as a background job
+    (async=true as a form field or query parameter)
     :return:
     """
-    sun_data = get_astral_data(datetime.now())
-    sunset = sun_data["sunset"]
-    sunrise = sun_data["sunrise"]
+    return normalize_boolean(request.values.get("async", "false"))
+
 
-    effective_start_time = "No Time"
+def job_response(job):
+    """
+    The 202 response for a background job
+    :param job:
+    :return:
+    """
+    response = jsonify({"job-id": job.id, "status": job.status, "merged": job.merged,
+                        "status-url": "/jobs/{0}".format(job.id)})
+    response.status_code = HTTPStatus.ACCEPTED
+    response.headers["Location"] = "/jobs/{0}".format(job.id)
+    return response
+
+
+def list_response(items):
+    """
+    Build the {"data": [...]} response for a list route.
+    When StreamListResponses is configured the body is generated item
+    by item instead of being serialized as one big string.
+    :param items: A list or any iterable of JSON serializable items
+    :return:
+    """
+    if not Configuration.StreamListResponses():
+        return jsonify({"data": list(items)})
+    return Response(generate_list_json(items), mimetype="application/json")
+
+
+def stream_list_response(api_req, items, *salt):
+    """
+    Build a streamed list response from an AHPSRequest.iter_* generator.
+    The first item is pulled before the response starts so a failed
+    query still gets an error response. A list answered from the response
+    cache or the snapshot store has a digest by then and gets the same
+    conditional GET handling as an unstreamed list. A list streamed off
+    the socket has no ETag, its digest is not known until the end.
+    :param api_req: The AHPSRequest that created items
+    :param items: The generator
+    :param salt: Other values the representation depends on
+    :return:
+    """
+    first = next(items, None)
+    if first is None:
+        if api_req.last_error:
+            response = jsonify(api_req.last_error)
+            response.status_code = HTTPStatus.BAD_REQUEST
+            return response
+        return conditional_response(api_req, lambda: list_response([]), *salt)
+    return conditional_response(api_req, lambda: list_response(itertools.chain([first], items)), *salt)
+
+
+def generate_list_json(items):
+    """
+    Generate the JSON text of {"data": [...]} in chunks
+    :param items:
+    :return:
+    """
+    encode = json_codec.dumps
+    chunk = ['{"data": [']
+    size = 0
+    separator = ""
+    for item in items:
+        text = encode(item)
+        chunk.append(separator)
+        chunk.append(text)
+        separator = ", "
+        size += len(text)
+        if size >= STREAM_CHUNK_SIZE:
+            yield "".join(chunk)
+            chunk = []
+            size = 0
+    chunk.append("]}")
+    yield "".join(chunk)
+
+
+# Clock time programs have times like 2020-01-01 18:30:00
+CLOCK_TIME_RE = re.compile(r"\d{4}-\d{2}-\d{2} (\d{2}):(\d{2}):\d{2}$")
+PROGRAM_SUMMARY_TEMPLATE = "{0} Method={1} Offset={2} {3} EffectiveTime={4} Action={5}"
+MINUTES_PER_DAY = 24 * 60
+
+# Formatted time of day (%I:%M%p) by minute of the day, filled in as needed
+_effective_times = [None] * MINUTES_PER_DAY
+
+
+def effective_time(minutes):
+    """
+    Returns the formatted time of day for a number of minutes after midnight
+    :param minutes: May be negative or more than a day
+    :return:
+    """
+    minutes %= MINUTES_PER_DAY
+    t = _effective_times[minutes]
+    if t is None:
+        t = (datetime(2000, 1, 1) + timedelta(minutes=minutes)).strftime("%I:%M%p")
+        _effective_times[minutes] = t
+    return t
+
+
+@lru_cache(maxsize=1024)
+def clock_time_minutes(time_str):
+    """
+    Convert a program clock time to minutes after midnight
+    :param time_str: Time in %Y-%m-%d %H:%M:%S format
+    :return:
+    """
+    m = CLOCK_TIME_RE.match(time_str)
+    if m is None:
+        # Let strptime sort out anything unexpected
+        t = datetime.strptime(time_str, "%Y-%m-%d %H:%M:%S")
+        return t.hour * 60 + t.minute
+    return int(m.group(1)) * 60 + int(m.group(2))
+
+
+def summarize_program(program, sunrise_minutes, sunset_minutes):
+    """
+    Build the summary line for one program
+    :param program:
+    :param sunrise_minutes: Sunrise in minutes after midnight
+    :param sunset_minutes: Sunset in minutes after midnight
+    :return:
+    """
     randomize = ""
-    offset = timedelta(minutes=int(program["offset"]))
-    if program["triggermethod"] == "sunset":
-        effective_start_time = (sunset + offset).strftime("%I:%M%p")
-    elif program["triggermethod"] == "sunrise":
-        effective_start_time = (sunrise + offset).strftime("%I:%M%p")
-    elif program["triggermethod"] == "clock-time":
-        st = program["time"]
-        start_time = datetime.strptime(program["time"], "%Y-%m-%d %H:%M:%S")
-        effective_start_time = (start_time + offset).strftime("%I:%M%p")
+    offset = int(program["offset"])
+    trigger_method = program["triggermethod"]
+    if trigger_method == "sunset":
+        effective_start_time = effective_time(sunset_minutes + offset)
+    elif trigger_method == "sunrise":
+        effective_start_time = effective_time(sunrise_minutes + offset)
+    elif trigger_method == "clock-time":
+        effective_start_time = effective_time(clock_time_minutes(program["time"]) + offset)
         if program["randomize"]:
             randomize = "Randomize={0}".format(program["randomizeamount"])
     else:
         effective_start_time = "No Time"
 
-    start = "{0} Method={1} Offset={2} {3} EffectiveTime={4} Action={5}".format(
+    return PROGRAM_SUMMARY_TEMPLATE.format(
         program["daymask"],
-        program["triggermethod"],
+        trigger_method,
         program["offset"],
         randomize,
         effective_start_time, program["command"])
-    return start
+
+
+def iter_program_summaries(programs):
+    """
+    Add a summary line (human readable) to each program of an iterable
+    as it is consumed. The sun data is looked up once for all of them.
+    :param programs: Iterable of program dicts
+    :return: A generator of the programs
+    """
+    sun_data = get_astral_data(datetime.now())
+    sunrise = sun_data["sunrise"]
+    sunset = sun_data["sunset"]
+    sunrise_minutes = sunrise.hour * 60 + sunrise.minute
+    sunset_minutes = sunset.hour * 60 + sunset.minute
+
+    for program in programs:
+        program["summary"] = summarize_program(program, sunrise_minutes, sunset_minutes)
+        yield program
+
+
+def build_program_summaries(programs):
+    """
+    Add a summary line (human readable) to every program in a list.
+    The sun data is looked up once for the whole list.
+    :param programs: List of program dicts
+    :return: The programs
+    """
+    for _ in iter_program_summaries(programs):
+        pass
+    return programs
+
+
+def build_program_summary(program):
+    """
+    Build a summary line (human readable) for a device timer program
+    :param program:
+    :return:
+    """
+    return build_program_summaries([dict(program)])[0]["summary"]
 
 
 def normalize_boolean(str_value):
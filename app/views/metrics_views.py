@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+#
+# AtHome Control
+# Copyright © 2020  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+import time
+from app import app
+from app import metrics
+from app import events
+from flask import request, g, Response
+from app.ahps.connection_pool import connection_pool_stats
+from app.ahps.response_cache import response_cache_stats
+from app.ahps.single_flight import single_flight_stats
+from app.ahps.snapshot_store import snapshot_store_stats
+
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+
+@app.after_request
+def observe_request_time(response):
+    """
+    Record the route latency. For a streamed response this is the
+    time until the response starts.
+    """
+    start = g.get("request_start")
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        metrics.http_request_seconds.observe((request.method, route, str(response.status_code)),
+                                             time.perf_counter() - start)
+    return response
+
+
+@app.route("/metrics", methods=['GET'])
+def get_metrics():
+    """
+    All metrics in the Prometheus text format
+    :return:
+    """
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+def _ahps_stats():
+    """
+    Connection pool, response cache, snapshot store and single flight stats.
+    Current levels are gauges, running totals are counters.
+    """
+    lines = []
+    pools = connection_pool_stats()
+    if pools:
+        for key in ["open", "idle"]:
+            values = {server: stats[key] for server, stats in pools.items()}
+            lines.extend(metrics.gauge_lines("athome_ahps_pool_" + key, "Connection pool " + key,
+                                             values, "server"))
+        for key in ["hits", "misses", "reconnects", "evictions", "waits"]:
+            values = {server: stats[key] for server, stats in pools.items()}
+            lines.extend(metrics.counter_lines("athome_ahps_pool_{0}_total".format(key), "Connection pool " + key,
+                                               values, "server"))
+        values = {server: stats["wait-time"] for server, stats in pools.items()}
+        lines.extend(metrics.counter_lines("athome_ahps_pool_wait_seconds_total",
+                                           "Time spent waiting for a pooled connection", values, "server"))
+
+    stats = response_cache_stats()
+    if stats is not None:
+        lines.extend(metrics.gauge_lines("athome_ahps_cache_entries", "Response cache entries", stats["entries"]))
+        for key in ["hits", "misses", "stores", "evictions", "expirations", "invalidations"]:
+            lines.extend(metrics.counter_lines("athome_ahps_cache_{0}_total".format(key), "Response cache " + key,
+                                               stats[key]))
+
+    stats = snapshot_store_stats()
+    if stats is not None:
+        for key in ["hits", "misses", "stores", "refreshes"]:
+            lines.extend(metrics.counter_lines("athome_ahps_snapshot_{0}_total".format(key), "Snapshot store " + key,
+                                               stats[key]))
+
+    stats = single_flight_stats()
+    lines.extend(metrics.gauge_lines("athome_ahps_single_flight_in_flight", "Single flight in-flight",
+                                     stats["in-flight"]))
+    for key in ["leaders", "collapsed", "errors"]:
+        lines.extend(metrics.counter_lines("athome_ahps_single_flight_{0}_total".format(key), "Single flight " + key,
+                                           stats[key]))
+
+    lines.extend(metrics.gauge_lines("athome_event_subscribers", "Open /events streams",
+                                     events.event_broker.subscriber_count))
+    return lines
+
+
+metrics.add_collector(_ahps_stats)
@@ -18,12 +18,21 @@
 
 from app import app
 from flask import render_template
+from configuration import Configuration
 # from Version import GetVersion
 
 #
 # This may not look very pretty but it is simple and it works
 #
 
+@app.template_global()
+def event_streams_enabled():
+    """
+    True when pages may open the /events stream
+    """
+    return Configuration.EventStreams() > 0
+
+
 @app.route("/", methods=['GET'])
 @app.route("/programs", methods=['GET'])
 @app.route("/groups", methods=['GET'])
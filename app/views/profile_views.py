@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+#
+# AtHome Control
+# Copyright © 2020  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the LICENSE file for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program (the LICENSE file).  If not, see <http://www.gnu.org/licenses/>.
+#
+
+#
+# Request profiling (see app/profiler.py)
+#
+# The Profiling configuration variable controls which requests are profiled:
+#   off  - none (the default)
+#   flag - requests with an X-Profile: 1 header or a profile=1 query parameter
+#   all  - every request
+#
+# Profiling writes files and slows down the whole process, so it is only
+# turned on while investigating. The /admin/profiles routes are not found
+# while it is off.
+#
+
+import os
+import threading
+import logging
+from http import HTTPStatus
+from app import app
+from app.json_codec import jsonify
+from app.profiler import RequestSampler, ProfileStore
+from flask import request, g, send_from_directory
+from configuration import Configuration
+
+logger = logging.getLogger("app")
+
+# Requests that are never profiled
+UNPROFILED_PATHS = ("/admin/profiles", "/metrics", "/events", "/static/")
+
+
+def get_profile_store():
+    return ProfileStore(Configuration.ProfileDirectory(), Configuration.ProfileKeep())
+
+
+def should_profile():
+    mode = Configuration.Profiling()
+    if mode not in ("flag", "all") or request.path.startswith(UNPROFILED_PATHS):
+        return False
+    if mode == "all":
+        return True
+    return request.headers.get("X-Profile") == "1" or request.args.get("profile") == "1"
+
+
+def profiles_not_found():
+    """
+    The response of the /admin/profiles routes while profiling is off
+    """
+    response = jsonify({"message": "Profiling is off"})
+    response.status_code = HTTPStatus.NOT_FOUND
+    return response
+
+
+@app.before_request
+def start_profiler():
+    if should_profile():
+        g.profiler = RequestSampler(threading.get_ident(), Configuration.ProfileInterval() / 1000.0).start()
+
+
+@app.teardown_request
+def stop_profiler(exc):
+    """
+    Stop profiling once the response has been built (including the after_request hooks)
+    """
+    sampler = g.pop("profiler", None)
+    if sampler is None:
+        return
+    stacks = sampler.stop()
+    try:
+        name = get_profile_store().save(request.method, request.path, sampler.elapsed, stacks)
+        logger.info("Profile written: %s", name)
+    except OSError as ex:
+        logger.error("Unable to write profile: %s", str(ex))
+
+
+@app.route("/admin/profiles", methods=['GET'])
+def get_profiles():
+    """
+    List the recent profiles, newest first
+    :return:
+    """
+    if Configuration.Profiling() not in ("flag", "all"):
+        return profiles_not_found()
+    return jsonify({"data": get_profile_store().list()})
+
+
+@app.route("/admin/profiles/<name>", methods=['GET'])
+def get_profile(name):
+    """
+    Download one profile in the collapsed stack format
+    :param name:
+    :return:
+    """
+    if Configuration.Profiling() not in ("flag", "all"):
+        return profiles_not_found()
+    store = get_profile_store()
+    if not store.is_profile(name):
+        response = jsonify({"message": "Profile {0} not found".format(name)})
+        response.status_code = HTTPStatus.NOT_FOUND
+        return response
+    return send_from_directory(os.path.abspath(store.directory), name, mimetype="text/plain",
+                               as_attachment=True)
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# AtHome Control
+# Copyright © 2020  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# See the LICENSE file for more details.
+#
+# Offline analysis of a JSON lines log (LogFormat "json"). Reports the
+# slowest routes and AHPS commands by percentile and the slowest single
+# requests with the AHPS commands they sent. AHPS commands are logged at
+# DEBUG, so LogLevel must be DEBUG for the upstream part of the report.
+#   python benchmarks/analyze_log.py athomefrb.log
+#   python benchmarks/analyze_log.py athomefrb.log --request-id 3f2a...
+#
+# Lines that are not JSON (e.g. text format lines) are skipped.
+#
+
+import sys
+import json
+import argparse
+from collections import defaultdict
+
+
+def read_records(paths):
+    """
+    Yield the JSON records of the log files
+    """
+    for path in paths:
+        with open(path, "r") as f:
+            for line in f:
+                if not line.startswith("{"):
+                    continue
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+
+def percentile(values, pct):
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def summarize(durations):
+    """
+    :param durations: dict of name -> list of milliseconds
+    :return: List of (name, count, p50, p95, max, total) slowest p95 first
+    """
+    rows = []
+    for name, values in durations.items():
+        values.sort()
+        rows.append((name, len(values), percentile(values, 50), percentile(values, 95), values[-1], sum(values)))
+    rows.sort(key=lambda row: row[3], reverse=True)
+    return rows
+
+
+def print_table(title, rows, top):
+    print(title)
+    print("  {0:>7} {1:>9} {2:>9} {3:>9} {4:>10}  {5}".format("count", "p50 ms", "p95 ms", "max ms",
+                                                              "total ms", "name"))
+    for name, count, p50, p95, high, total in rows[:top]:
+        print("  {0:>7} {1:>9.1f} {2:>9.1f} {3:>9.1f} {4:>10.1f}  {5}".format(count, p50, p95, high, total, name))
+    print()
+
+
+def analyze(records, top):
+    routes = defaultdict(list)
+    commands = defaultdict(list)
+    requests = []
+    upstream = defaultdict(list)
+
+    for record in records:
+        duration = record.get("duration_ms")
+        if duration is None:
+            continue
+        if "route" in record:
+            routes["{0} {1}".format(record.get("method", ""), record["route"])].append(duration)
+            requests.append(record)
+        elif "command" in record:
+            commands[record["command"]].append(duration)
+            if record.get("request_id", "-") != "-":
+                upstream[record["request_id"]].append(record)
+
+    if not requests and not commands:
+        print("No request or AHPS command records found. Is LogFormat set to json?")
+        return
+
+    print_table("Routes", summarize(routes), top)
+    print_table("AHPS commands", summarize(commands), top)
+
+    print("Slowest requests")
+    requests.sort(key=lambda r: r["duration_ms"], reverse=True)
+    for record in requests[:top]:
+        sent = upstream.get(record.get("request_id"), [])
+        upstream_ms = sum(c["duration_ms"] for c in sent)
+        print("  {0:>9.1f} ms  {1} {2} {3}  id={4}  ahps={5} commands {6:.1f} ms".format(
+            record["duration_ms"], record.get("method", ""), record.get("path", ""), record.get("status", ""),
+            record.get("request_id", "-"), len(sent), upstream_ms))
+
+
+def show_request(records, request_id):
+    for record in records:
+        if record.get("request_id") == request_id:
+            print(json.dumps(record))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report slow routes and AHPS commands from a JSON lines log")
+    parser.add_argument("logs", nargs="+", help="Log files")
+    parser.add_argument("--top", type=int, default=10, help="Rows per report")
+    parser.add_argument("--request-id", help="Print every record of one request")
+    args = parser.parse_args()
+
+    records = read_records(args.logs)
+    if args.request_id:
+        show_request(records, args.request_id)
+    else:
+        analyze(records, args.top)
+
+
+if __name__ == "__main__":
+    main()
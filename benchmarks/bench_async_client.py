@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# AtHome Control
+# Copyright © 2020  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# See the LICENSE file for more details.
+#
+# Exercises AsyncAHPSRequest against the stub AHPS server:
+#   - every command method returns a usable response
+#   - thousands of concurrent commands from one event loop
+#   - per-call timeouts and cancellation
+#
+# Run from the root directory:
+#   python benchmarks/bench_async_client.py --commands 5000
+#
+
+import os
+import sys
+import argparse
+import asyncio
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.ahps.ahps_async import AsyncAHPSRequest
+from stub_ahps_server import StubAHPSServer
+
+
+async def check_commands(port):
+    """
+    Call a representative set of command methods once each
+    """
+    api_req = AsyncAHPSRequest("127.0.0.1", port)
+    calls = [
+        api_req.device_on(1),
+        api_req.device_off(1),
+        api_req.group_on(1),
+        api_req.group_off(1),
+        api_req.all_devices_on(),
+        api_req.get_all_devices(),
+        api_req.get_device(1),
+        api_req.get_all_programs(),
+        api_req.get_all_action_groups(),
+        api_req.get_action_group_devices(1),
+    ]
+    for call in calls:
+        res = await call
+        assert res is not None and res["result-code"] == 0, api_req.last_error
+    print("Command methods: OK")
+
+
+async def concurrency(port, count, max_concurrency):
+    """
+    Send count device_on commands concurrently
+    """
+    limiter = AsyncAHPSRequest.create_limiter(max_concurrency)
+    start = time.perf_counter()
+    results = await asyncio.gather(*[
+        AsyncAHPSRequest("127.0.0.1", port, limiter=limiter).device_on(i) for i in range(count)])
+    elapsed = time.perf_counter() - start
+    failed = sum(1 for r in results if r is None)
+    print("Concurrent commands: {0} in {1:.2f}s ({2:.0f}/s), {3} failed".format(
+        count, elapsed, count / elapsed, failed))
+
+
+async def timeouts(slow_port):
+    """
+    Instance timeout, asyncio.wait_for timeout and cancellation
+    against a server that takes one second to answer
+    """
+    api_req = AsyncAHPSRequest("127.0.0.1", slow_port, timeout=0.1)
+    res = await api_req.discover_devices()
+    assert res is None and "timed out" in api_req.last_error["message"]
+    print("Instance timeout: OK")
+
+    api_req = AsyncAHPSRequest("127.0.0.1", slow_port)
+    try:
+        await asyncio.wait_for(api_req.discover_devices(), 0.1)
+        raise AssertionError("wait_for did not time out")
+    except asyncio.TimeoutError:
+        print("wait_for timeout: OK")
+
+    task = asyncio.ensure_future(api_req.discover_devices())
+    await asyncio.sleep(0.1)
+    task.cancel()
+    try:
+        await task
+        raise AssertionError("Task was not cancelled")
+    except asyncio.CancelledError:
+        print("Cancellation: OK")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AsyncAHPSRequest harness")
+    parser.add_argument("--commands", type=int, default=2000)
+    parser.add_argument("--max-concurrency", type=int, default=200)
+    args = parser.parse_args()
+
+    server = StubAHPSServer().start()
+    slow_server = StubAHPSServer(latency=1.0).start()
+    try:
+        asyncio.run(check_commands(server.port))
+        asyncio.run(concurrency(server.port, args.commands, args.max_concurrency))
+        asyncio.run(timeouts(slow_server.port))
+    finally:
+        server.stop()
+        slow_server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# AtHome Control
+# Copyright © 2020  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# See the LICENSE file for more details.
+#
+# Encode and decode throughput of each installed JSON codec backend
+# on device and program list responses.
+#
+# Run from the root directory:
+#   python benchmarks/bench_json_codec.py --items 1000
+#
+
+import os
+import sys
+import argparse
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app import json_codec
+from stub_ahps_server import StubAHPSServer
+
+
+def best_of(func, arg, rounds):
+    """
+    Fastest of rounds calls in seconds
+    """
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        func(arg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON codec benchmark")
+    parser.add_argument("--items", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    payloads = {
+        "devices": {"request": "QueryDevices", "result-code": 0,
+                    "devices": [StubAHPSServer.make_device(i) for i in range(args.items)]},
+        "programs": {"request": "QueryPrograms", "result-code": 0,
+                     "programs": [StubAHPSServer.make_program(i) for i in range(args.items)]},
+    }
+
+    configured = json_codec.backend
+    print("Items per response: {0}".format(args.items))
+    print("{0:10s} {1:10s} {2:>10s} {3:>12s} {4:>12s}".format("backend", "payload", "KB", "encode MB/s",
+                                                              "decode MB/s"))
+    for name in json_codec.available_backends():
+        json_codec.set_backend(name)
+        for label, payload in payloads.items():
+            frame = json_codec.dumps_bytes(payload)
+            mb = len(frame) / (1024 * 1024)
+            encode = best_of(json_codec.dumps_bytes, payload, args.rounds)
+            decode = best_of(json_codec.loads, frame, args.rounds)
+            print("{0:10s} {1:10s} {2:10.1f} {3:12.1f} {4:12.1f}".format(name, label, len(frame) / 1024,
+                                                                        mb / encode, mb / decode))
+    json_codec.set_backend(configured)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# AtHome Control
+# Copyright © 2020  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# See the LICENSE file for more details.
+#
+# Compares the original per program summary builder with the batch
+# build_program_summaries at 10, 1k and 100k programs.
+#
+# Run from the root directory:
+#   python benchmarks/bench_program_summary.py
+#
+
+import os
+import sys
+import argparse
+import time
+from datetime import timedelta, datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from configuration import Configuration
+from app.ahps.sun_data import get_astral_data
+from app.views.json_views import build_program_summaries
+from stub_ahps_server import StubAHPSServer
+
+
+def original_program_summary(program):
+    """
+    The original build_program_summary implementation
+    """
+    sun_data = get_astral_data(datetime.now())
+    sunset = sun_data["sunset"]
+    sunrise = sun_data["sunrise"]
+
+    effective_start_time = "No Time"
+    randomize = ""
+    offset = timedelta(minutes=int(program["offset"]))
+    if program["triggermethod"] == "sunset":
+        effective_start_time = (sunset + offset).strftime("%I:%M%p")
+    elif program["triggermethod"] == "sunrise":
+        effective_start_time = (sunrise + offset).strftime("%I:%M%p")
+    elif program["triggermethod"] == "clock-time":
+        start_time = datetime.strptime(program["time"], "%Y-%m-%d %H:%M:%S")
+        effective_start_time = (start_time + offset).strftime("%I:%M%p")
+        if program["randomize"]:
+            randomize = "Randomize={0}".format(program["randomizeamount"])
+    else:
+        effective_start_time = "No Time"
+
+    start = "{0} Method={1} Offset={2} {3} EffectiveTime={4} Action={5}".format(
+        program["daymask"],
+        program["triggermethod"],
+        program["offset"],
+        randomize,
+        effective_start_time, program["command"])
+    return start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Program summary benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 100000])
+    args = parser.parse_args()
+
+    # The location comes from the configuration, which importing the app no longer loads
+    Configuration.load_configuration(os.getcwd())
+
+    # Both builders share the memoized sun data
+    get_astral_data(datetime.now())
+
+    print("{0:>8} {1:>14} {2:>14} {3:>12} {4:>9}".format(
+        "programs", "original (ms)", "batch (ms)", "batch us/pgm", "speedup"))
+    for size in args.sizes:
+        programs = [StubAHPSServer.make_program(i) for i in range(size)]
+
+        start = time.perf_counter()
+        expected = [original_program_summary(p) for p in programs]
+        original = time.perf_counter() - start
+
+        start = time.perf_counter()
+        build_program_summaries(programs)
+        batch = time.perf_counter() - start
+
+        assert expected == [p["summary"] for p in programs]
+        print("{0:>8} {1:>14.2f} {2:>14.2f} {3:>12.2f} {4:>8.1f}x".format(
+            size, original * 1000, batch * 1000, batch * 1e6 / size, original / batch))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# AtHome Control
+# Copyright © 2020  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# See the LICENSE file for more details.
+#
+# Micro-benchmark comparing the original byte-at-a-time read_json with
+# the buffered JSONFrameReader on synthetic AHPS responses.
+#
+# Run from the root directory:
+#   python benchmarks/bench_read_json.py
+#
+
+import os
+import sys
+import json
+import socket
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.ahps.json_reader import JSONFrameReader
+
+
+# Response sizes in bytes
+SIZES = [1024, 16 * 1024, 128 * 1024, 1024 * 1024]
+
+
+def legacy_read_json(sock):
+    """
+    The original AHPSRequest.read_json implementation
+    """
+    depth = 0
+    json_data = ""
+
+    while (True):
+        c = sock.recv(1).decode()
+        json_data += c
+
+        if (c == "{"):
+            depth += 1
+        if (c == "}"):
+            depth -= 1
+            if (depth == 0):
+                return json_data
+
+
+def buffered_read_json(sock):
+    return JSONFrameReader().read_frame(sock).decode()
+
+
+def make_response(size):
+    """
+    Build a QueryDevices style response of roughly size bytes
+    """
+    devices = []
+    response = {"request": "QueryDevices", "result-code": 0, "devices": devices}
+    length = len(json.dumps(response))
+    i = 0
+    while length < size:
+        device = {
+            "id": i,
+            "name": "Device {0}".format(i),
+            "location": "Living room",
+            "mfg": "tplink",
+            "address": "192.168.1.{0}".format(i % 255),
+            "channel": 0,
+            "color": "#ffffff",
+            "brightness": 100
+        }
+        devices.append(device)
+        length += len(json.dumps(device)) + 2
+        i += 1
+    return json.JSONEncoder().encode(response).encode()
+
+
+def time_reader(reader, payload, reps):
+    """
+    Time reps reads of payload through a socket pair
+    :return: Average seconds per read
+    """
+    elapsed = 0.0
+    for _ in range(reps):
+        server, client = socket.socketpair()
+        sender = threading.Thread(target=server.sendall, args=(payload,))
+        start = time.perf_counter()
+        sender.start()
+        data = reader(client)
+        elapsed += time.perf_counter() - start
+        sender.join()
+        server.close()
+        client.close()
+        assert len(data) == len(payload)
+    return elapsed / reps
+
+
+def main():
+    print("{0:>10} {1:>14} {2:>14} {3:>9}".format("size", "legacy (ms)", "buffered (ms)", "speedup"))
+    for size in SIZES:
+        payload = make_response(size)
+        reps = max(3, int(2 * 1024 * 1024 / len(payload)))
+        legacy = time_reader(legacy_read_json, payload, min(reps, 5))
+        buffered = time_reader(buffered_read_json, payload, reps)
+        print("{0:>10} {1:>14.3f} {2:>14.3f} {3:>8.1f}x".format(
+            len(payload), legacy * 1000, buffered * 1000, legacy / buffered))
+
+
+if __name__ == "__main__":
+    main()
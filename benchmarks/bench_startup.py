@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# AtHome Control
+# Copyright © 2020  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# See the LICENSE file for more details.
+#
+# Cold start cost of the app. Each run starts a fresh interpreter that
+# calls create_app() and serves one request through the test client.
+# Reports the time from process start to the first response, the
+# resident memory after it and, from -X importtime, the slowest imports.
+# Exits with status 1 when the median time to first request is over
+# the budget.
+#
+# Run from the root directory with a configuration file in place:
+#   python benchmarks/bench_startup.py --runs 5 --budget-ms 1500
+#
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# Runs in the child interpreter. The result is the last line of stdout.
+CHILD = """
+import sys, time, json
+sys.path.insert(0, {root!r})
+start = time.time()
+from app import create_app
+app = create_app()
+created = time.time()
+response = app.test_client().get({path!r})
+first = time.time()
+rss_kb = None
+try:
+    with open("/proc/self/statm") as f:
+        rss_kb = int(f.read().split()[1]) * (__import__("os").sysconf("SC_PAGE_SIZE") // 1024)
+except OSError:
+    import resource
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+import Logging
+Logging.StopQueuedLogging()
+print(json.dumps({{"start": start, "created": created, "first": first, "status": response.status_code,
+                  "rss_kb": rss_kb, "astral": "astral" in sys.modules, "pytz": "pytz" in sys.modules}}))
+"""
+
+
+def run_once(path):
+    """
+    One cold start
+    :return: dict with the timings (seconds) and rss
+    """
+    code = CHILD.format(root=ROOT, path=path)
+    launched = time.time()
+    out = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, check=True,
+                         universal_newlines=True).stdout
+    result = json.loads(out.strip().splitlines()[-1])
+    result["interpreter"] = result["start"] - launched
+    result["create_app"] = result["created"] - result["start"]
+    result["first_request"] = result["first"] - result["created"]
+    result["total"] = result["first"] - launched
+    return result
+
+
+def import_times(top):
+    """
+    Run create_app() under -X importtime
+    :return: A tuple (total microseconds of the top level imports, list of (microseconds, module))
+    """
+    code = "import sys; sys.path.insert(0, {0!r}); from app import create_app; create_app(); " \
+           "import Logging; Logging.StopQueuedLogging()".format(ROOT)
+    err = subprocess.run([sys.executable, "-X", "importtime", "-c", code], stdout=subprocess.DEVNULL,
+                         stderr=subprocess.PIPE, check=True, universal_newlines=True).stderr
+    modules = []
+    total = 0
+    for line in err.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        cumulative = int(cumulative)
+        modules.append((cumulative, name.strip()))
+        # Top level imports are not indented
+        if not name[1:].startswith(" "):
+            total += cumulative
+    modules.sort(reverse=True)
+    return total, modules[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="App cold start benchmark")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--path", default="/location", help="Path of the first request")
+    parser.add_argument("--budget-ms", type=float, default=1500.0,
+                        help="Maximum median time to first request, 0 for no check")
+    parser.add_argument("--top", type=int, default=15, help="Number of slowest imports shown")
+    args = parser.parse_args()
+
+    runs = [run_once(args.path) for _ in range(args.runs)]
+    print("{0:>5} {1:>12} {2:>12} {3:>14} {4:>10} {5:>9}".format(
+        "run", "interpreter", "create_app", "first request", "total", "RSS MB"))
+    for i, r in enumerate(runs):
+        print("{0:>5} {1:>10.1f}ms {2:>10.1f}ms {3:>12.1f}ms {4:>8.1f}ms {5:>9.1f}".format(
+            i + 1, r["interpreter"] * 1000, r["create_app"] * 1000, r["first_request"] * 1000,
+            r["total"] * 1000, r["rss_kb"] / 1024))
+
+    median = statistics.median(r["total"] for r in runs) * 1000
+    print()
+    print("Time to first request (median): {0:.1f}ms".format(median))
+    print("Baseline RSS (median): {0:.1f}MB".format(statistics.median(r["rss_kb"] for r in runs) / 1024))
+    print("First response status: {0}".format(runs[-1]["status"]))
+    print("astral imported at startup: {0}, pytz: {1}".format(runs[-1]["astral"], runs[-1]["pytz"]))
+
+    total, modules = import_times(args.top)
+    print()
+    print("Imports: {0:.1f}ms total, slowest (cumulative):".format(total / 1000))
+    for cumulative, name in modules:
+        print("  {0:>8.1f}ms  {1}".format(cumulative / 1000, name))
+
+    if args.budget_ms > 0 and median > args.budget_ms:
+        print()
+        print("Over budget: {0:.1f}ms > {1:.1f}ms".format(median, args.budget_ms))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# AtHome Control
+# Copyright © 2020  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# See the LICENSE file for more details.
+#
+# Per request cost of the sunrise/sunset data used by the program
+# summaries, before and after memoization. A /programs/all request
+# asks for the sun data once per program.
+#
+# Run from the root directory:
+#   python benchmarks/bench_sun_data.py --programs 300
+#
+
+import os
+import sys
+import argparse
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from astral import Astral
+from configuration import Configuration
+from app.ahps.sun_data import SunDataService
+
+
+def uncached_astral_data(for_datetime):
+    """
+    The original get_astral_data implementation
+    """
+    a = Astral()
+    a.solar_depression = "civil"
+    if Configuration.City() != "":
+        city = a[Configuration.City()]
+    else:
+        city = a["New York"]
+    if Configuration.Latitude() != "":
+        city.latitude = float(Configuration.Latitude())
+    if Configuration.Longitude() != "":
+        city.longitude = float(Configuration.Longitude())
+
+    return city.sun(date=for_datetime, local=True)
+
+
+def time_request(get_data, programs, requests):
+    """
+    Average seconds for one request that needs sun data programs times
+    """
+    start = time.perf_counter()
+    for _ in range(requests):
+        for _ in range(programs):
+            get_data(datetime.now())
+    return (time.perf_counter() - start) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sun data benchmark")
+    parser.add_argument("--programs", type=int, default=300)
+    parser.add_argument("--requests", type=int, default=5)
+    args = parser.parse_args()
+
+    # The location comes from the configuration, which importing the app no longer loads
+    Configuration.load_configuration(os.getcwd())
+
+    service = SunDataService()
+    start = time.perf_counter()
+    service.sun(datetime.now())
+    first = time.perf_counter() - start
+
+    before = time_request(uncached_astral_data, args.programs, args.requests)
+    after = time_request(service.sun, args.programs, args.requests)
+    print("Programs per request: {0}".format(args.programs))
+    print("Before:  {0:10.3f} ms/request".format(before * 1000))
+    print("After:   {0:10.3f} ms/request".format(after * 1000))
+    print("First call (builds location and window): {0:.3f} ms".format(first * 1000))
+    print("Speedup: {0:.0f}x".format(before / after))
+
+
+if __name__ == "__main__":
+    main()
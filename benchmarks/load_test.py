@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# AtHome Control
+# Copyright © 2020  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# See the LICENSE file for more details.
+#
+# HTTP load test for a running server. Each client thread holds a
+# keep-alive connection and sends requests back to back for the
+# given duration. Reports requests/sec and latency percentiles.
+#
+# With --stub, a stub AHPS server is started on the configured
+# Server/Port so no powerline hardware is needed:
+#   python benchmarks/load_test.py --stub --serve      # terminal 1
+#   python server.py                                   # terminal 2
+#   python benchmarks/load_test.py --clients 32        # terminal 3
+#
+# Run from the root directory.
+#
+
+import os
+import sys
+import argparse
+import http.client
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from stub_ahps_server import StubAHPSServer, add_fault_arguments, fault_options
+
+
+def client(host, port, paths, deadline, latencies, errors):
+    """
+    Send requests until the deadline
+    """
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    i = 0
+    while time.monotonic() < deadline:
+        path = paths[i % len(paths)]
+        i += 1
+        start = time.perf_counter()
+        try:
+            conn.request("GET", path)
+            response = conn.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+            latencies.append(time.perf_counter() - start)
+        except (OSError, http.client.HTTPException) as ex:
+            errors.append(str(ex))
+            conn.close()
+            conn = http.client.HTTPConnection(host, port, timeout=30)
+    conn.close()
+
+
+def percentile(values, pct):
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run_load(host, port, paths, clients, duration):
+    """
+    Run the load test
+    :return: A tuple (sorted latencies, errors, elapsed seconds)
+    """
+    latencies = []
+    errors = []
+    deadline = time.monotonic() + duration
+    threads = [threading.Thread(target=client, args=(host, port, paths, deadline, latencies, errors))
+               for _ in range(clients)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sorted(latencies), errors, time.perf_counter() - start
+
+
+def start_stub(args):
+    from configuration import Configuration
+    Configuration.load_configuration(os.getcwd())
+    server = StubAHPSServer(Configuration.Server(), Configuration.Port(), devices=args.devices,
+                            programs=args.programs, **fault_options(args)).start()
+    print("Stub AHPS server listening on {0}:{1}".format(server.host, server.port))
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP load test")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5001)
+    parser.add_argument("--path", action="append", help="may be repeated (default /devices)")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--stub", action="store_true", help="start a stub AHPS server")
+    parser.add_argument("--serve", action="store_true", help="only run the stub AHPS server")
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--programs", type=int, default=100)
+    # Stub latency and fault injection
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    stub = start_stub(args) if args.stub or args.serve else None
+    if args.serve:
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            stub.stop()
+        return
+
+    paths = args.path or ["/devices"]
+    latencies, errors, elapsed = run_load(args.host, args.port, paths, args.clients, args.duration)
+    if stub is not None:
+        stub.stop()
+
+    print("Clients: {0}  Paths: {1}".format(args.clients, " ".join(paths)))
+    print("Requests: {0}  Errors: {1}".format(len(latencies), len(errors)))
+    print("Requests/sec: {0:.1f}".format(len(latencies) / elapsed))
+    if latencies:
+        print("Latency ms  p50 {0:.1f}  p95 {1:.1f}  p99 {2:.1f}  max {3:.1f}".format(
+            percentile(latencies, 50) * 1000, percentile(latencies, 95) * 1000,
+            percentile(latencies, 99) * 1000, latencies[-1] * 1000))
+    if errors:
+        print("First error: {0}".format(errors[0]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,583 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# AtHome Control
+# Copyright © 2020  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# See the LICENSE file for more details.
+#
+# Stub AtHomePowerlineServer for exercising the AHPS clients without
+# powerline hardware. It speaks the same JSON over TCP protocol and keeps
+# state: devices, programs and action groups can be defined, updated,
+# assigned and deleted, and On/Off commands change the device states.
+# Requests for ids that do not exist get a non-zero result code.
+#
+# For reproducible measurements the synthetic data and every random
+# choice come from one seeded generator. Faults can be injected:
+#   latency        seconds before each response, a number or a
+#                  distribution (see LatencyModel), per command if wanted
+#   drop_rate      probability a connection is closed without a response
+#   partial_rate   probability only half of a response is written
+#   trickle        (bytes, seconds) write responses in small delayed chunks
+#   read_delay     seconds before each (small) read, a slow reader
+#
+# Run stand alone:
+#   python benchmarks/stub_ahps_server.py --port 9999
+#   python benchmarks/stub_ahps_server.py --port 9999 --devices 200 --seed 7 \
+#       --latency lognormal:0.005,0.6 --command-latency GroupOn=uniform:0.2,0.8 --drop-rate 0.01
+#
+# Or start it in process:
+#   server = StubAHPSServer(devices=100).start()
+#   ... server.port ...
+#   server.stop()
+#
+
+import argparse
+import asyncio
+import codecs
+import json
+import math
+import random
+import threading
+from collections import Counter
+
+# Read size when read_delay is set
+SLOW_READ_SIZE = 256
+
+PROGRAM_ARG_NAMES = {"day-mask": "daymask", "trigger-method": "triggermethod",
+                     "randomize-amount": "randomizeamount"}
+DEVICE_ARG_NAMES = {"device-name": "name", "device-location": "location", "device-mfg": "mfg",
+                    "device-address": "address", "device-channel": "channel", "device-color": "color",
+                    "device-brightness": "brightness"}
+
+
+class StubError(Exception):
+    """
+    A request the stub answers with a non-zero result code
+    """
+    pass
+
+
+class LatencyModel:
+    """
+    Response delay distribution. A spec is a number of seconds or
+    kind:parameters with one of
+      fixed:seconds
+      uniform:low,high
+      normal:mean,stddev        (negative samples are 0)
+      lognormal:median,sigma    (a long tail, like real devices)
+      exp:mean
+    """
+    KINDS = {"fixed": 1, "uniform": 2, "normal": 2, "lognormal": 2, "exp": 1}
+
+    def __init__(self, spec):
+        if isinstance(spec, (int, float)):
+            self.kind, self.params = "fixed", (float(spec),)
+        else:
+            kind, _, params = str(spec).partition(":")
+            if not params:
+                kind, params = "fixed", kind
+            self.kind = kind
+            self.params = tuple(float(p) for p in params.split(","))
+            if self.KINDS.get(kind) != len(self.params):
+                raise ValueError("Invalid latency spec {0}".format(spec))
+
+    def sample(self, rng):
+        """
+        Seconds for one response
+        :param rng: random.Random
+        :return:
+        """
+        p = self.params
+        if self.kind == "fixed":
+            return p[0]
+        if self.kind == "uniform":
+            return rng.uniform(p[0], p[1])
+        if self.kind == "normal":
+            return max(0.0, rng.gauss(p[0], p[1]))
+        if self.kind == "lognormal":
+            return p[0] * math.exp(rng.gauss(0.0, p[1]))
+        return rng.expovariate(1.0 / p[0]) if p[0] > 0 else 0.0
+
+
+class StubAHPSServer:
+    """
+    asyncio based stub server run on a background thread
+    """
+    def __init__(self, host="127.0.0.1", port=0, devices=10, programs=10, groups=3,
+                 keep_alive=False, latency=0.0, command_latency=None, seed=0,
+                 drop_rate=0.0, partial_rate=0.0, trickle=None, read_delay=0.0):
+        """
+        Stub server constructor
+        :param host:
+        :param port: 0 picks a free port
+        :param devices: Number of synthetic devices
+        :param programs: Number of synthetic programs
+        :param groups: Number of synthetic action groups
+        :param keep_alive: Serve more than one request per connection
+        :param latency: Delay before each response, seconds or a LatencyModel spec
+        :param command_latency: dict of command -> latency for particular commands
+        :param seed: Seed of the random generator
+        :param drop_rate: Probability a connection is closed instead of answered
+        :param partial_rate: Probability a response is cut off half way
+        :param trickle: (bytes, seconds) to write responses in delayed chunks
+        :param read_delay: Seconds to wait before each read of a request
+        """
+        self.host = host
+        self.port = port
+        self.keep_alive = keep_alive
+        self.latency = LatencyModel(latency)
+        self.command_latency = {c: LatencyModel(spec) for c, spec in (command_latency or {}).items()}
+        self.drop_rate = drop_rate
+        self.partial_rate = partial_rate
+        self.trickle = trickle
+        self.read_delay = read_delay
+        self.requests = 0
+        self.commands = Counter()
+        self.faults = Counter()
+        self._rng = random.Random(seed)
+
+        self._devices = {i: self.make_device(i) for i in range(devices)}
+        self._programs = {i: self.make_program(i) for i in range(programs)}
+        self._groups = {i: {"id": i, "name": "Group {0}".format(i)} for i in range(groups)}
+        # device id -> on/off
+        self.device_states = {i: "off" for i in self._devices}
+        # device id -> set of program ids
+        self._device_programs = {i: set() for i in self._devices}
+        for i in self._programs:
+            if devices:
+                self._device_programs[i % devices].add(i)
+        # group id -> list of device ids
+        self._group_devices = {g: [i for i in self._devices if i % groups == g] for g in self._groups}
+        self._next_id = max(devices, programs, groups)
+        # Encoded query responses, dropped on every change
+        self._encoded = {}
+        self._lock = threading.Lock()
+
+        self._loop = None
+        self._server = None
+        self._thread = None
+
+    @staticmethod
+    def make_device(i):
+        return {
+            "id": i,
+            "name": "Device {0}".format(i),
+            "location": "Room {0}".format(i % 10),
+            "mfg": "tplink",
+            "address": "192.168.1.{0}".format(i % 255),
+            "channel": 0,
+            "color": "#ffffff",
+            "brightness": 100
+        }
+
+    @staticmethod
+    def make_program(i):
+        methods = ["clock-time", "sunset", "sunrise"]
+        return {
+            "id": i,
+            "name": "Program {0}".format(i),
+            "daymask": "MTWTFSS",
+            "triggermethod": methods[i % len(methods)],
+            "time": "2020-01-01 {0:02d}:{1:02d}:00".format(i % 24, i % 60),
+            "offset": (i % 61) - 30,
+            "randomize": i % 2 == 0,
+            "randomizeamount": 10,
+            "command": "on" if i % 2 else "off",
+            "color": "#ffffff",
+            "brightness": 100
+        }
+
+    def _new_id(self):
+        self._next_id += 1
+        return self._next_id
+
+    @staticmethod
+    def _lookup(table, args, key, what):
+        """
+        The entry for an id argument
+        """
+        try:
+            return table[int(args[key])]
+        except (KeyError, TypeError, ValueError):
+            raise StubError("{0} {1} does not exist".format(what, args.get(key)))
+
+    @staticmethod
+    def _convert(args, names, skip=()):
+        return {names.get(k, k): v for k, v in args.items() if k not in skip}
+
+    def _set_states(self, device_ids, state):
+        for device_id in device_ids:
+            self.device_states[device_id] = state
+
+    def respond(self, request):
+        """
+        Build the response for a request, applying any change it makes
+        :param request:
+        :return:
+        """
+        command = request.get("request", "")
+        args = request.get("args", {})
+        response = {"request": command, "result-code": 0}
+        with self._lock:
+            try:
+                if self._respond(command, args, response):
+                    self._encoded = {}
+            except StubError as ex:
+                response["result-code"] = 1
+                response["message"] = str(ex)
+        return response
+
+    def _respond(self, command, args, response):
+        """
+        Fill in the response
+        :return: True if the request changed the state
+        """
+        devices, programs, groups = self._devices, self._programs, self._groups
+
+        # Device commands
+        if command in ["On", "Off", "Dim", "Bright"]:
+            if "device-id" in args:
+                device = self._lookup(devices, args, "device-id", "Device")
+                if command in ["On", "Off"]:
+                    self._set_states([device["id"]], command.lower())
+            return command in ["On", "Off"]
+        if command in ["AllDevicesOn", "AllDevicesOff"]:
+            self._set_states(devices, command[len("AllDevices"):].lower())
+            return True
+        if command in ["GroupOn", "GroupOff"]:
+            group = self._lookup(groups, args, "group-id", "Group")
+            self._set_states(self._group_devices[group["id"]], command[len("Group"):].lower())
+            return True
+        if command == "StatusRequest":
+            response["message"] = "Stub AHPS server, {0} devices".format(len(devices))
+            return False
+        if command == "DiscoverDevices":
+            response["devices"] = []
+            return False
+
+        # Devices
+        if command == "QueryDevices":
+            if "device-id" in args:
+                response["device"] = self._lookup(devices, args, "device-id", "Device")
+            else:
+                response["devices"] = list(devices.values())
+            return False
+        if command == "QueryAvailableDevices":
+            response["devices"] = list(devices.values())
+            return False
+        if command == "DefineDevice":
+            device = self._convert(args, DEVICE_ARG_NAMES)
+            device["id"] = self._new_id()
+            devices[device["id"]] = device
+            self.device_states[device["id"]] = "off"
+            self._device_programs[device["id"]] = set()
+            response["id"] = device["id"]
+            return True
+        if command == "UpdateDevice":
+            device = self._lookup(devices, args, "device-id", "Device")
+            device.update(self._convert(args, DEVICE_ARG_NAMES, ("device-id",)))
+            return True
+        if command == "DeleteDevice":
+            device = self._lookup(devices, args, "device-id", "Device")
+            del devices[device["id"]]
+            self.device_states.pop(device["id"], None)
+            self._device_programs.pop(device["id"], None)
+            for members in self._group_devices.values():
+                if device["id"] in members:
+                    members.remove(device["id"])
+            return True
+
+        # Programs
+        if command == "QueryPrograms":
+            response["programs"] = list(programs.values())
+            return False
+        if command in ["QueryDevicePrograms", "QueryAvailablePrograms"]:
+            device = self._lookup(devices, args, "device-id", "Device")
+            assigned = self._device_programs[device["id"]]
+            response["programs"] = [p for i, p in programs.items()
+                                    if (i in assigned) == (command == "QueryDevicePrograms")]
+            return False
+        if command == "QueryDeviceProgram":
+            response["program"] = self._lookup(programs, args, "program-id", "Program")
+            return False
+        if command == "DefineProgram":
+            program = self._convert(args, PROGRAM_ARG_NAMES, ("id",))
+            program["id"] = self._new_id()
+            programs[program["id"]] = program
+            response["id"] = program["id"]
+            return True
+        if command == "UpdateProgram":
+            program = self._lookup(programs, args, "id", "Program")
+            program.update(self._convert(args, PROGRAM_ARG_NAMES, ("id",)))
+            return True
+        if command == "DeleteProgram":
+            program = self._lookup(programs, args, "program-id", "Program")
+            del programs[program["id"]]
+            for assigned in self._device_programs.values():
+                assigned.discard(program["id"])
+            return True
+        if command == "AssignProgram":
+            device = self._lookup(devices, args, "device-id", "Device")
+            program = self._lookup(programs, args, "program-id", "Program")
+            self._device_programs[device["id"]].add(program["id"])
+            return True
+        if command == "AssignProgramToGroup":
+            group = self._lookup(groups, args, "group-id", "Group")
+            program = self._lookup(programs, args, "program-id", "Program")
+            for device_id in self._group_devices[group["id"]]:
+                self._device_programs[device_id].add(program["id"])
+            return True
+        if command == "DeleteDeviceProgram":
+            device = self._lookup(devices, args, "device-id", "Device")
+            program = self._lookup(programs, args, "program-id", "Program")
+            self._device_programs[device["id"]].discard(program["id"])
+            return True
+
+        # Action groups
+        if command == "QueryActionGroups":
+            response["groups"] = list(groups.values())
+            return False
+        if command == "QueryActionGroup":
+            response["group"] = self._lookup(groups, args, "group-id", "Group")
+            return False
+        if command in ["QueryActionGroupDevices", "QueryAvailableGroupDevices"]:
+            group = self._lookup(groups, args, "group-id", "Group")
+            members = set(self._group_devices[group["id"]])
+            response["devices"] = [d for i, d in devices.items()
+                                   if (i in members) == (command == "QueryActionGroupDevices")]
+            return False
+        if command == "DefineActionGroup":
+            group = {"id": self._new_id(), "name": args.get("group-name", "")}
+            groups[group["id"]] = group
+            self._group_devices[group["id"]] = []
+            response["id"] = group["id"]
+            return True
+        if command == "UpdateActionGroup":
+            group = self._lookup(groups, args, "group-id", "Group")
+            group["name"] = args.get("group-name", group["name"])
+            return True
+        if command == "DeleteActionGroup":
+            group = self._lookup(groups, args, "group-id", "Group")
+            del groups[group["id"]]
+            del self._group_devices[group["id"]]
+            return True
+        if command == "AssignDevice":
+            group = self._lookup(groups, args, "group-id", "Group")
+            device = self._lookup(devices, args, "device-id", "Device")
+            if device["id"] not in self._group_devices[group["id"]]:
+                self._group_devices[group["id"]].append(device["id"])
+            return True
+        if command == "DeleteActionGroupDevice":
+            group = self._lookup(groups, args, "group-id", "Group")
+            device = self._lookup(devices, args, "device-id", "Device")
+            if device["id"] in self._group_devices[group["id"]]:
+                self._group_devices[group["id"]].remove(device["id"])
+            return True
+
+        raise StubError("Unrecognized command {0}".format(command))
+
+    def respond_bytes(self, request):
+        """
+        The encoded response. Query responses are encoded once until the state changes.
+        :param request:
+        :return:
+        """
+        command = request.get("request", "")
+        if not command.startswith("Query"):
+            return json.dumps(self.respond(request)).encode()
+        key = json.dumps(request, sort_keys=True)
+        encoded = self._encoded.get(key)
+        if encoded is None:
+            encoded = json.dumps(self.respond(request)).encode()
+            self._encoded[key] = encoded
+        return encoded
+
+    def stats(self):
+        """
+        Requests served per command and the faults injected
+        """
+        return {"requests": self.requests, "commands": dict(self.commands), "faults": dict(self.faults)}
+
+    async def _write(self, writer, payload):
+        """
+        Write a response, cutting it off or trickling it out as configured
+        :return: False if the connection must be closed
+        """
+        if self.partial_rate and self._rng.random() < self.partial_rate:
+            self.faults["partial"] += 1
+            writer.write(payload[:len(payload) // 2])
+            await writer.drain()
+            return False
+        if self.trickle:
+            size, delay = self.trickle
+            for i in range(0, len(payload), size):
+                writer.write(payload[i:i + size])
+                await writer.drain()
+                await asyncio.sleep(delay)
+        else:
+            writer.write(payload)
+            await writer.drain()
+        return True
+
+    async def _serve_buffered(self, writer, decoder, buffer):
+        """
+        Answer every complete request in the buffer. Pipelined requests
+        can arrive in one read.
+        :return: A tuple (keep the connection open, the incomplete rest of the buffer)
+        """
+        while True:
+            buffer = buffer.lstrip()
+            try:
+                request, end = decoder.raw_decode(buffer)
+            except ValueError:
+                # Incomplete request
+                return True, buffer
+            buffer = buffer[end:]
+            self.requests += 1
+            command = request.get("request", "")
+            self.commands[command] += 1
+
+            delay = self.command_latency.get(command, self.latency).sample(self._rng)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self.drop_rate and self._rng.random() < self.drop_rate:
+                self.faults["dropped"] += 1
+                return False, buffer
+            if not await self._write(writer, self.respond_bytes(request)):
+                return False, buffer
+            if not self.keep_alive:
+                return False, buffer
+
+    async def _handle(self, reader, writer):
+        decoder = json.JSONDecoder()
+        text_decoder = codecs.getincrementaldecoder("utf-8")()
+        buffer = ""
+        read_size = SLOW_READ_SIZE if self.read_delay else 64 * 1024
+        try:
+            while True:
+                if self.read_delay:
+                    await asyncio.sleep(self.read_delay)
+                data = await reader.read(read_size)
+                if not data:
+                    break
+                buffer += text_decoder.decode(data)
+                keep_open, buffer = await self._serve_buffered(writer, decoder, buffer)
+                if not keep_open:
+                    break
+        except (ConnectionError, asyncio.CancelledError):
+            # Client went away or the server is stopping
+            pass
+        finally:
+            writer.close()
+
+    def start(self):
+        """
+        Start the server on a background thread
+        :return: self
+        """
+        ready = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._server = self._loop.run_until_complete(
+                asyncio.start_server(self._handle, self.host, self.port))
+            self.port = self._server.sockets[0].getsockname()[1]
+            ready.set()
+            self._loop.run_forever()
+            self._server.close()
+            # Drop any connections still being served
+            tasks = asyncio.all_tasks(self._loop)
+            for task in tasks:
+                task.cancel()
+            self._loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        ready.wait()
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+
+
+def parse_command_latency(values):
+    """
+    --command-latency values (COMMAND=SPEC) as a dict
+    """
+    command_latency = {}
+    for value in values or []:
+        command, _, spec = value.partition("=")
+        command_latency[command] = spec
+    return command_latency
+
+
+def parse_trickle(value):
+    """
+    --trickle value (BYTES,SECONDS) as a tuple
+    """
+    if not value:
+        return None
+    size, delay = value.split(",")
+    return int(size), float(delay)
+
+
+def add_fault_arguments(parser):
+    """
+    Add the latency and fault injection options to an argument parser
+    """
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--latency", default="0", help="seconds per response or a distribution, "
+                                                       "e.g. lognormal:0.005,0.5")
+    parser.add_argument("--command-latency", action="append", metavar="COMMAND=SPEC",
+                        help="latency of one command, may be repeated")
+    parser.add_argument("--drop-rate", type=float, default=0.0,
+                        help="probability of closing without a response")
+    parser.add_argument("--partial-rate", type=float, default=0.0, help="probability of a cut off response")
+    parser.add_argument("--trickle", metavar="BYTES,SECONDS", help="write responses in delayed chunks")
+    parser.add_argument("--read-delay", type=float, default=0.0,
+                        help="seconds before each read (slow reader)")
+
+
+def fault_options(args):
+    """
+    StubAHPSServer keyword arguments from the parsed fault options
+    """
+    return {"seed": args.seed, "latency": args.latency,
+            "command_latency": parse_command_latency(args.command_latency),
+            "drop_rate": args.drop_rate, "partial_rate": args.partial_rate,
+            "trickle": parse_trickle(args.trickle), "read_delay": args.read_delay}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub AtHomePowerlineServer")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9999)
+    parser.add_argument("--devices", type=int, default=10)
+    parser.add_argument("--programs", type=int, default=10)
+    parser.add_argument("--groups", type=int, default=3)
+    parser.add_argument("--keep-alive", action="store_true")
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    server = StubAHPSServer(args.host, args.port, args.devices, args.programs, args.groups,
+                            keep_alive=args.keep_alive, **fault_options(args)).start()
+    print("Stub AHPS server listening on {0}:{1}".format(server.host, server.port))
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
+        print(json.dumps(server.stats()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# AtHome Control
+# Copyright © 2020  Dave Hocker (email: AtHomeX10@gmail.com)
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# See the LICENSE file for more details.
+#
+# Benchmark suite with stored baselines.
+#
+# run measures every case at each data scale (number of devices, programs
+# and groups) against an in process stub AHPS server and writes the
+# results as JSON. compare reports the change of each case against a
+# baseline and exits with status 1 when any case is slower by more than
+# the threshold.
+#
+# Run from the root directory with a configuration file in place:
+#   python benchmarks/suite.py run --save-baseline            # on the reference build
+#   python benchmarks/suite.py run --output current.json      # after a change
+#   python benchmarks/suite.py compare benchmarks/baseline.json current.json --threshold 10
+#
+# Baselines are only comparable on the same machine.
+#
+
+import os
+import sys
+import json
+import time
+import socket
+import logging
+import argparse
+import platform
+import statistics
+import threading
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from stub_ahps_server import StubAHPSServer
+
+DEFAULT_SCALES = [10, 1000, 50000]
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+# GET routes that return JSON. The ids exist at every scale.
+JSON_ROUTES = [
+    "/version",
+    "/location",
+    "/devices",
+    "/devices/1",
+    "/availabledevices/tplink",
+    "/discoverdevices",
+    "/programs/all",
+    "/programs/1",
+    "/devices/1/programs",
+    "/availableprograms/device/1",
+    "/actiongroups",
+    "/actiongroups/0",
+    "/actiongroups/0/devices",
+    "/availabledevices/group/0",
+]
+
+# A program edit form as posted by the UI
+PROGRAM_FORM = {"name": "Porch light", "daymask": "MTWTF..", "triggermethod": "sunset", "time": "",
+                "offset": "-15", "randomize": "true", "randomizeamount": "10", "command": "on",
+                "color": "#ffffff", "brightness": "100"}
+
+
+def measure(func, min_time, min_batches=3):
+    """
+    Time a function. Calls are grouped into batches of at least a
+    millisecond so the timer does not dominate fast functions.
+    :return: dict with the median and p95 seconds per call and the number of calls
+    """
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        if elapsed >= 0.001 or number >= 1000000:
+            break
+        number *= 10
+
+    samples = [elapsed / number]
+    total = elapsed
+    while len(samples) < min_batches or total < min_time:
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        elapsed = time.perf_counter() - start
+        samples.append(elapsed / number)
+        total += elapsed
+    samples.sort()
+    return {"median": statistics.median(samples),
+            "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+            "calls": len(samples) * number}
+
+
+def device_list_frame(scale):
+    return json.dumps({"request": "QueryDevices", "result-code": 0,
+                       "devices": [StubAHPSServer.make_device(i) for i in range(scale)]}).encode()
+
+
+def read_json_case(scale):
+    """
+    AHPSRequest.read_json on a local socket pair
+    """
+    from app.ahps.ahps_api import AHPSRequest
+
+    frame = device_list_frame(scale)
+
+    def run():
+        reader, writer = socket.socketpair()
+        sender = threading.Thread(target=writer.sendall, args=(frame,))
+        sender.start()
+        AHPSRequest.read_json(reader)
+        sender.join()
+        reader.close()
+        writer.close()
+    return run
+
+
+def send_command_case(stub):
+    """
+    A QueryDevices round trip to the stub server
+    """
+    from app.ahps.ahps_api import AHPSRequest
+
+    def run():
+        if AHPSRequest("127.0.0.1", stub.port).get_all_devices() is None:
+            raise RuntimeError("QueryDevices failed")
+    return run
+
+
+def route_case(client, path):
+    def run():
+        response = client.get(path)
+        if response.status_code != 200:
+            raise RuntimeError("{0} returned {1}".format(path, response.status_code))
+        response.get_data()
+    return run
+
+
+def run_suite(args):
+    from app import create_app
+    from configuration import Configuration
+    from app.ahps.sun_data import get_astral_data
+    from app.views.json_views import build_program_summaries, normalize_boolean
+    import Logging
+
+    app = create_app()
+    # Request logging would dominate the fast cases
+    Logging.SetLogLevel(logging.WARNING)
+    client = app.test_client()
+
+    results = {}
+
+    def record(name, func):
+        if args.filter and args.filter not in name:
+            return
+        try:
+            results[name] = measure(func, args.min_time)
+        except Exception as ex:
+            print("{0:50s} failed: {1}".format(name, str(ex)))
+            return
+        r = results[name]
+        print("{0:50s} {1:>12.3f} ms {2:>12.3f} ms {3:>9d}".format(name, r["median"] * 1000, r["p95"] * 1000,
+                                                                   r["calls"]))
+
+    print("{0:50s} {1:>15s} {2:>15s} {3:>9s}".format("case", "median", "p95", "calls"))
+
+    # Scale independent cases
+    today = datetime.now()
+    record("get_astral_data/today", lambda: get_astral_data(today))
+    days = [today + timedelta(days=i) for i in range(366)]
+    record("get_astral_data/year", lambda: [get_astral_data(d) for d in days])
+    record("form_parse/program", lambda: program_form_parse(app, normalize_boolean))
+
+    for scale in args.scales:
+        stub = StubAHPSServer(devices=scale, programs=scale, groups=max(1, min(scale // 10, 100)),
+                              seed=args.seed).start()
+        # Point the app at the stub
+        Configuration.Snapshot = Configuration.Snapshot._replace(Server="127.0.0.1", Port=stub.port)
+        try:
+            programs = [StubAHPSServer.make_program(i) for i in range(scale)]
+            booleans = ["true", "False", 1, 0, True, "no"] * (scale // 6 + 1)
+
+            record("read_json/{0}".format(scale), read_json_case(scale))
+            record("send_command/{0}".format(scale), send_command_case(stub))
+            record("build_program_summaries/{0}".format(scale),
+                   lambda: build_program_summaries([dict(p) for p in programs]))
+            record("normalize_boolean/{0}".format(scale), lambda: [normalize_boolean(b) for b in booleans])
+            for path in JSON_ROUTES:
+                record("route{0}/{1}".format(path, scale), route_case(client, path))
+        finally:
+            stub.stop()
+
+    Logging.StopQueuedLogging()
+    return {
+        "meta": {
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.node(),
+            "scales": args.scales,
+            "configuration": {k: getattr(Configuration.Snapshot, k) for k in
+                              ["ConnectionPoolSize", "ResponseCacheTTL", "SingleFlight", "StreamListResponses",
+                               "CompressResponses", "JSONCodec"]},
+        },
+        "results": results
+    }
+
+
+def program_form_parse(app, normalize_boolean):
+    """
+    Parse a program edit form the way save_device_program does
+    """
+    from flask import request
+
+    with app.test_request_context("/programs/1", method="PUT", data=PROGRAM_FORM):
+        form = request.form
+        return {"id": "1", "name": form["name"], "day-mask": form["daymask"],
+                "trigger-method": form["triggermethod"], "time": form["time"], "offset": form["offset"],
+                "randomize": normalize_boolean(form["randomize"]), "randomize-amount": form["randomizeamount"],
+                "command": form["command"], "color": form["color"], "brightness": form["brightness"]}
+
+
+def compare(baseline, current, threshold):
+    """
+    Print the change of each case
+    :return: Number of regressions
+    """
+    base = baseline["results"]
+    cur = current["results"]
+    if baseline["meta"].get("machine") != current["meta"].get("machine"):
+        print("Warning: the baseline was measured on {0}, not {1}".format(
+            baseline["meta"].get("machine"), current["meta"].get("machine")))
+
+    regressions = 0
+    print("{0:50s} {1:>12s} {2:>12s} {3:>8s}".format("case", "baseline ms", "current ms", "change"))
+    for name in sorted(set(base) | set(cur)):
+        if name not in cur:
+            print("{0:50s} {1:>12.3f} {2:>12s}".format(name, base[name]["median"] * 1000, "missing"))
+            continue
+        if name not in base:
+            print("{0:50s} {1:>12s} {2:>12.3f}".format(name, "new", cur[name]["median"] * 1000))
+            continue
+        change = (cur[name]["median"] / base[name]["median"] - 1) * 100
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions += 1
+        elif change < -threshold:
+            flag = "  faster"
+        print("{0:50s} {1:>12.3f} {2:>12.3f} {3:>+7.1f}%{4}".format(
+            name, base[name]["median"] * 1000, cur[name]["median"] * 1000, change, flag))
+    print()
+    print("{0} regression(s) beyond {1}%".format(regressions, threshold))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark suite")
+    commands = parser.add_subparsers(dest="command")
+
+    run = commands.add_parser("run", help="run the suite")
+    run.add_argument("--scales", type=int, nargs="+", default=DEFAULT_SCALES)
+    run.add_argument("--min-time", type=float, default=0.5, help="seconds spent on each case")
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--filter", help="only cases whose name contains this text")
+    run.add_argument("--output", default="benchmark-results.json")
+    run.add_argument("--save-baseline", action="store_true", help="also write " + DEFAULT_BASELINE)
+
+    cmp = commands.add_parser("compare", help="compare results with a baseline")
+    cmp.add_argument("baseline", nargs="?", default=DEFAULT_BASELINE)
+    cmp.add_argument("current", nargs="?", default="benchmark-results.json")
+    cmp.add_argument("--threshold", type=float, default=10.0, help="percent slower that is a regression")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        results = run_suite(args)
+        outputs = [args.output] + ([DEFAULT_BASELINE] if args.save_baseline else [])
+        for path in outputs:
+            with open(path, "w") as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+            print("Results written to {0}".format(path))
+    elif args.command == "compare":
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+        if compare(baseline, current, args.threshold):
+            sys.exit(1)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -39,14 +39,137 @@
 
 import os
 import json
+import time
 import logging
+import threading
+from collections import namedtuple
 
 logger = logging.getLogger("app")
 
+
+########################################################################
+# Configuration values are parsed and validated once, when the file is
+# loaded, into an immutable ConfigSnapshot. The accessors read attributes
+# of the current snapshot. A reload builds a complete new snapshot and
+# swaps it in with one assignment, so a reader sees either the old or the
+# new configuration, never a mix.
+
+def _parse_str(value):
+    if not isinstance(value, str):
+        raise ValueError("expected a string")
+    return value
+
+
+def _parse_lower(value):
+    return _parse_str(value).lower()
+
+
+def _parse_int(value):
+    return int(value)
+
+
+def _parse_float(value):
+    return float(value)
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    text = _parse_str(value).lower()
+    if text not in ("true", "false"):
+        raise ValueError("expected True or False")
+    return text == "true"
+
+
+def _parse_coordinate(value):
+    """
+    Latitude/longitude are kept as text (callers test for ""), but must be numbers when given
+    """
+    text = _parse_str(value).strip()
+    if text != "":
+        float(text)
+    return text
+
+
+# Configuration variable -> (parser, default). A default of None marks a
+# required variable.
+SETTINGS = {
+    "Server": (_parse_str, None),
+    "Port": (_parse_int, None),
+    "Debug": (_parse_bool, None),
+    "LogConsole": (_parse_bool, None),
+    "LogFile": (_parse_str, None),
+    "LogLevel": (_parse_str, None),
+    "LogFormat": (_parse_lower, "text"),
+    "LogQueueSize": (_parse_int, "1000"),
+    "LogBatchSize": (_parse_int, "64"),
+    "DatabasePath": (_parse_str, ""),
+    "SecretKey": (_parse_str, None),
+    "City": (_parse_str, None),
+    "Latitude": (_parse_coordinate, None),
+    "Longitude": (_parse_coordinate, None),
+    "ConfigWatchInterval": (_parse_float, "2"),
+    "JSONCodec": (_parse_lower, "auto"),
+    "ConnectionPoolSize": (_parse_int, "0"),
+    "ResponseCacheTTL": (_parse_float, "0"),
+    "ResponseCacheSize": (_parse_int, "128"),
+    "StreamListResponses": (_parse_bool, "False"),
+    "SingleFlight": (_parse_bool, "True"),
+    "SnapshotStore": (_parse_bool, "False"),
+    "SnapshotFile": (_parse_str, "athomefrb-snapshot.sqlite"),
+    "SnapshotRefresh": (_parse_float, "60"),
+    "EventStreams": (_parse_int, "0"),
+    "CompressResponses": (_parse_bool, "True"),
+    "CompressMinSize": (_parse_int, "1024"),
+    "Profiling": (_parse_lower, "off"),
+    "ProfileDirectory": (_parse_str, "profiles"),
+    "ProfileKeep": (_parse_int, "50"),
+    "ProfileInterval": (_parse_float, "1"),
+    "ServerMode": (_parse_lower, "development"),
+    "ServerWorkers": (_parse_int, "2"),
+    "ServerThreads": (_parse_int, "4"),
+    "ServerKeepAlive": (_parse_int, "5"),
+    "ServerGracefulTimeout": (_parse_int, "30"),
+    "ServerMaxRequests": (_parse_int, "0"),
+}
+
+ConfigSnapshot = namedtuple("ConfigSnapshot", SETTINGS.keys())
+
+
+def build_snapshot(raw):
+    """
+    Parse and validate the Configuration section of the conf file
+    :param raw: dict of configuration variables as read from the file
+    :return: A tuple (ConfigSnapshot, list of error messages). A variable
+    that is missing or invalid gets its default (None if it is required).
+    """
+    values = {}
+    errors = []
+    for name, (parse, default) in SETTINGS.items():
+        if name in raw:
+            try:
+                values[name] = parse(raw[name])
+                continue
+            except (TypeError, ValueError) as ex:
+                errors.append("Invalid value {0!r} for configuration variable {1}: {2}".format(
+                    raw[name], name, str(ex)))
+        elif default is None:
+            errors.append("Unable to find configuration variable {0}".format(name))
+        values[name] = parse(default) if default is not None else None
+    return ConfigSnapshot(**values), errors
+
+
 ########################################################################
 class Configuration():
     ActiveConfig = None
     AppPath = ""
+    # The current ConfigSnapshot
+    Snapshot = build_snapshot({})[0]
+    # Functions called with (old snapshot, new snapshot) after a reload
+    _subscribers = []
+    _watcher = None
+    _reload_lock = threading.Lock()
+    _loaded_mtime = None
 
     ######################################################################
     def __init__(self):
@@ -62,33 +185,145 @@ class Configuration():
         else:
             Configuration.AppPath = app_path
 
+        cfg_path = Configuration.get_configuration_file_path()
+        logger.info("Opening configuration file {0}".format(cfg_path))
+        raw, mtime = cls._read_configuration_file(cfg_path)
+        if raw is None:
+            return
+
+        snapshot, errors = build_snapshot(raw)
+        for error in errors:
+            logger.error(error)
+        cls.ActiveConfig = raw
+        cls.Snapshot = snapshot
+        cls._loaded_mtime = mtime
+        return
+
+    ######################################################################
+    @classmethod
+    def _read_configuration_file(cls, cfg_path):
+        """
+        Read the Configuration section of the conf file
+        :return: A tuple (dict or None if the file cannot be used, mtime)
+        """
         # Try to open the conf file. If there isn't one, we give up.
         try:
-            cfg_path = Configuration.get_configuration_file_path()
-            logger.info("Opening configuration file {0}".format(cfg_path))
-            cfg = open(cfg_path, 'r')
+            mtime = os.path.getmtime(cfg_path)
+            with open(cfg_path, 'r') as cfg:
+                # Read the entire contents of the conf file
+                cfg_json = cfg.read()
         except Exception as ex:
             logger.error("Unable to open {0}".format(cfg_path))
             logger.error(str(ex))
-            return
-
-        # Read the entire contents of the conf file
-        cfg_json = cfg.read()
-        cfg.close()
-        #print cfg_json
+            return None, None
 
         # Try to parse the conf file into a Python structure
         try:
             config = json.loads(cfg_json)
             # The interesting part of the configuration is in the "Configuration" section.
-            cls.ActiveConfig = config["Configuration"]
+            return dict(config["Configuration"]), mtime
         except Exception as ex:
             logger.error("Unable to parse configuration file as JSON")
             logger.error(str(ex))
+            return None, mtime
+
+    ######################################################################
+    @classmethod
+    def reload_configuration(cls):
+        """
+        Reload the conf file if it changed since it was loaded. A file that
+        does not parse or validate is rejected and the current configuration
+        is kept. Subscribers are called when the snapshot changed.
+        :return: True if a new configuration was swapped in
+        """
+        with cls._reload_lock:
+            cfg_path = cls.get_configuration_file_path()
+            try:
+                mtime = os.path.getmtime(cfg_path)
+            except OSError:
+                return False
+            if mtime == cls._loaded_mtime:
+                return False
+
+            raw, mtime = cls._read_configuration_file(cfg_path)
+            # Do not try this version of the file again
+            cls._loaded_mtime = mtime
+            if raw is None:
+                logger.error("Configuration file {0} not reloaded".format(cfg_path))
+                return False
+            snapshot, errors = build_snapshot(raw)
+            if errors:
+                for error in errors:
+                    logger.error(error)
+                logger.error("Configuration file {0} not reloaded".format(cfg_path))
+                return False
+
+            old = cls.Snapshot
+            cls.ActiveConfig = raw
+            cls.Snapshot = snapshot
+            if snapshot == old:
+                return False
+            changed = [name for name in SETTINGS if getattr(old, name) != getattr(snapshot, name)]
+            logger.info("Configuration reloaded, changed: {0}".format(", ".join(changed)))
+
+        for subscriber in list(cls._subscribers):
+            try:
+                subscriber(old, snapshot)
+            except Exception as ex:
+                logger.error("Configuration subscriber {0} failed: {1}".format(
+                    getattr(subscriber, "__name__", subscriber), str(ex)))
+        return True
+
+    ######################################################################
+    @classmethod
+    def subscribe(cls, subscriber):
+        """
+        Register a function called with (old snapshot, new snapshot) after
+        the configuration is reloaded
+        """
+        cls._subscribers.append(subscriber)
+
+    ######################################################################
+    @staticmethod
+    def changed(old, new, *names):
+        """
+        True if any of the named configuration variables differ between two snapshots
+        """
+        return any(getattr(old, name) != getattr(new, name) for name in names)
+
+    ######################################################################
+    @classmethod
+    def start_watcher(cls):
+        """
+        Start a thread that reloads the conf file when its mtime changes.
+        ConfigWatchInterval seconds between checks, zero disables the watcher.
+        """
+        interval = cls.Snapshot.ConfigWatchInterval
+        if interval <= 0 or cls._watcher is not None:
             return
+        cls._watcher = threading.Thread(target=cls._watch, args=(interval,), name="config-watcher", daemon=True)
+        cls._watcher.start()
 
-        #print str(Configuration.ActiveConfig)
-        return
+    ######################################################################
+    @classmethod
+    def _watch(cls, interval):
+        while True:
+            time.sleep(interval)
+            try:
+                cls.reload_configuration()
+            except Exception as ex:
+                logger.error("Configuration reload failed: {0}".format(str(ex)))
+
+    ######################################################################
+    @classmethod
+    def restart_watcher_after_fork(cls):
+        """
+        A forked worker process does not inherit the watcher thread
+        """
+        cls._reload_lock = threading.Lock()
+        if cls._watcher is not None:
+            cls._watcher = None
+            cls.start_watcher()
 
 ######################################################################
     @classmethod
@@ -116,60 +351,289 @@ class Configuration():
             logger.error(str(ex))
         return None
 
+    ######################################################################
+    @classmethod
+    def get_optional_config_var(cls, var_name, default):
+        """
+        Returns the value of an optional configuration variable.
+        The default is returned if the variable is not defined.
+        """
+        if cls.ActiveConfig is None:
+            return default
+        return cls.ActiveConfig.get(var_name, default)
+
     ######################################################################
     @classmethod
     def Server(cls):
-        return cls.get_config_var("Server")
+        return cls.Snapshot.Server
 
     ######################################################################
     @classmethod
     def Port(cls):
-        return int(cls.get_config_var("Port"))
+        return cls.Snapshot.Port
 
     ######################################################################
     @classmethod
     def Debug(cls):
-        return cls.get_config_var("Debug").lower() == "true"
+        return cls.Snapshot.Debug
 
     ######################################################################
     @classmethod
     def Logconsole(cls):
-        return cls.get_config_var("LogConsole").lower() == "true"
+        return cls.Snapshot.LogConsole
 
     ######################################################################
     @classmethod
     def Logfile(cls):
-        return cls.get_config_var("LogFile")
+        return cls.Snapshot.LogFile
 
     ######################################################################
     @classmethod
     def LogLevel(cls):
-        return cls.get_config_var("LogLevel")
+        return cls.Snapshot.LogLevel
+
+    ######################################################################
+    @classmethod
+    def LogFormat(cls):
+        """
+        Log line format: text (the default) or json (one JSON object per line)
+        """
+        return cls.Snapshot.LogFormat
+
+    ######################################################################
+    @classmethod
+    def LogQueueSize(cls):
+        """
+        Maximum number of log records waiting to be written
+        """
+        return cls.Snapshot.LogQueueSize
+
+    ######################################################################
+    @classmethod
+    def LogBatchSize(cls):
+        """
+        Maximum number of log records written between flushes
+        """
+        return cls.Snapshot.LogBatchSize
+
+    ######################################################################
+    @classmethod
+    def ConfigWatchInterval(cls):
+        """
+        Seconds between checks for a changed configuration file.
+        Zero disables hot reload.
+        """
+        return cls.Snapshot.ConfigWatchInterval
+
+    ######################################################################
+    @classmethod
+    def JSONCodec(cls):
+        """
+        JSON backend: auto (the default), orjson, ujson, simdjson or stdlib
+        """
+        return cls.Snapshot.JSONCodec
 
     ######################################################################
     @classmethod
     def DatabasePath(cls):
-        return cls.get_config_var("DatabasePath")
+        return cls.Snapshot.DatabasePath
 
     ######################################################################
     @classmethod
     def SecretKey(cls):
-        return cls.get_config_var("SecretKey")
+        return cls.Snapshot.SecretKey
 
     ######################################################################
     @classmethod
     def City(cls):
-        return cls.get_config_var("City")
+        return cls.Snapshot.City
 
     ######################################################################
     @classmethod
     def Latitude(cls):
-        return cls.get_config_var("Latitude")
+        return cls.Snapshot.Latitude
 
     ######################################################################
     @classmethod
     def Longitude(cls):
-        return cls.get_config_var("Longitude")
+        return cls.Snapshot.Longitude
+
+    ######################################################################
+    @classmethod
+    def ConnectionPoolSize(cls):
+        """
+        Number of persistent connections kept to the AtHomePowerlineServer.
+        Zero (the default) opens a new connection for every request.
+        """
+        return cls.Snapshot.ConnectionPoolSize
+
+    ######################################################################
+    @classmethod
+    def ResponseCacheTTL(cls):
+        """
+        Seconds a cached AHPS query response stays valid.
+        Zero (the default) disables the response cache.
+        """
+        return cls.Snapshot.ResponseCacheTTL
+
+    ######################################################################
+    @classmethod
+    def ResponseCacheSize(cls):
+        """
+        Maximum number of cached AHPS query responses
+        """
+        return cls.Snapshot.ResponseCacheSize
+
+    ######################################################################
+    @classmethod
+    def StreamListResponses(cls):
+        """
+        True to stream the large list responses (devices, programs, groups)
+        """
+        return cls.Snapshot.StreamListResponses
+
+    ######################################################################
+    @classmethod
+    def SingleFlight(cls):
+        """
+        True (the default) to collapse concurrent identical AHPS queries
+        into one request to the server
+        """
+        return cls.Snapshot.SingleFlight
+
+    ######################################################################
+    @classmethod
+    def EventStreams(cls):
+        """
+        Maximum number of open /events streams per worker process.
+        Each one holds a request thread. Zero (the default) turns the
+        event stream off.
+        """
+        return cls.Snapshot.EventStreams
+
+    ######################################################################
+    @classmethod
+    def SnapshotStore(cls):
+        """
+        True to keep a local SQLite mirror of the devices, programs and
+        action groups and answer queries from it
+        """
+        return cls.Snapshot.SnapshotStore
+
+    ######################################################################
+    @classmethod
+    def SnapshotFile(cls):
+        """
+        File name of the snapshot store in the DatabasePath directory
+        """
+        return cls.Snapshot.SnapshotFile
+
+    ######################################################################
+    @classmethod
+    def SnapshotRefresh(cls):
+        """
+        Seconds between background refreshes of the snapshot store
+        """
+        return cls.Snapshot.SnapshotRefresh
+
+    ######################################################################
+    @classmethod
+    def CompressResponses(cls):
+        """
+        True (the default) to gzip/brotli compress JSON responses
+        """
+        return cls.Snapshot.CompressResponses
+
+    ######################################################################
+    @classmethod
+    def CompressMinSize(cls):
+        """
+        Smallest JSON response (in bytes) that is compressed
+        """
+        return cls.Snapshot.CompressMinSize
+
+    ######################################################################
+    @classmethod
+    def Profiling(cls):
+        """
+        Which requests are profiled: off (the default), flag (requests with
+        an X-Profile: 1 header or profile=1 query parameter) or all
+        """
+        return cls.Snapshot.Profiling
+
+    ######################################################################
+    @classmethod
+    def ProfileDirectory(cls):
+        """
+        Directory where request profiles are written
+        """
+        return cls.Snapshot.ProfileDirectory
+
+    ######################################################################
+    @classmethod
+    def ProfileKeep(cls):
+        """
+        Maximum number of request profiles kept
+        """
+        return cls.Snapshot.ProfileKeep
+
+    ######################################################################
+    @classmethod
+    def ProfileInterval(cls):
+        """
+        Milliseconds between profiler samples
+        """
+        return cls.Snapshot.ProfileInterval
+
+    ######################################################################
+    @classmethod
+    def ServerMode(cls):
+        """
+        How server.py serves the app: development (the Werkzeug server),
+        gunicorn or waitress
+        """
+        return cls.Snapshot.ServerMode
+
+    ######################################################################
+    @classmethod
+    def ServerWorkers(cls):
+        """
+        Number of worker processes (gunicorn only)
+        """
+        return cls.Snapshot.ServerWorkers
+
+    ######################################################################
+    @classmethod
+    def ServerThreads(cls):
+        """
+        Number of request threads per worker process
+        """
+        return cls.Snapshot.ServerThreads
+
+    ######################################################################
+    @classmethod
+    def ServerKeepAlive(cls):
+        """
+        Seconds an idle HTTP keep-alive connection is held open
+        """
+        return cls.Snapshot.ServerKeepAlive
+
+    ######################################################################
+    @classmethod
+    def ServerGracefulTimeout(cls):
+        """
+        Seconds a worker is given to finish its requests on reload or shutdown
+        """
+        return cls.Snapshot.ServerGracefulTimeout
+
+    ######################################################################
+    @classmethod
+    def ServerMaxRequests(cls):
+        """
+        Requests a worker serves before it is gracefully replaced.
+        Zero (the default) never replaces workers (gunicorn only).
+        """
+        return cls.Snapshot.ServerMaxRequests
 
     ######################################################################
     @classmethod
@@ -211,3 +675,7 @@ class Configuration():
             return "{0}\\ahps_web\\{1}".format(os.environ["LOCALAPPDATA"], file_name)
 
         return file_name
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=Configuration.restart_watcher_after_fork)
@@ -1,6 +1,9 @@
 var webpack = require('webpack');
 var path = require("path");
 var SplitChunksPlugin = require("webpack/lib/optimize/SplitChunksPlugin");
+var CompressionPlugin = require("compression-webpack-plugin");
+var { WebpackManifestPlugin } = require("webpack-manifest-plugin");
+var zlib = require("zlib");
 
 console.log("");
 console.log("Webpack Production Build");
@@ -16,9 +19,9 @@ console.log("");
 */
 
 module.exports = {
-    entry: [
-        './app/static/js/main.jsx'
-    ],
+    entry: {
+        main: './app/static/js/index.js'
+    },
     module: {
         rules: [
             {
@@ -81,7 +84,8 @@ module.exports = {
         ]
     },
     output: {
-        filename: "index_bundler.js",
+        // The content hash lets the server mark the bundle immutable
+        filename: "bundler.[contenthash:8].js",
         path: __dirname + '/app/static/dist',
         libraryTarget: 'var',
         library: 'EntryPoint'
@@ -97,6 +101,26 @@ module.exports = {
                 'NODE_ENV': JSON.stringify('production')
             }
         }),
+        // Tells index.html which file holds each bundle
+        new WebpackManifestPlugin({
+            fileName: 'assets-manifest.json',
+            publicPath: ''
+        }),
+        // Precompressed copies served by app/static_assets.py
+        new CompressionPlugin({
+            filename: '[path][base].gz',
+            algorithm: 'gzip',
+            test: /\.(js|css|map|svg)$/,
+            threshold: 1024,
+            compressionOptions: { level: 9 }
+        }),
+        new CompressionPlugin({
+            filename: '[path][base].br',
+            algorithm: 'brotliCompress',
+            test: /\.(js|css|map|svg)$/,
+            threshold: 1024,
+            compressionOptions: { params: { [zlib.constants.BROTLI_PARAM_QUALITY]: 11 } }
+        }),
 /*
         new webpack.optimize.UglifyJsPlugin({
             compress:{
@@ -23,28 +23,117 @@
 # To start the web server:
 #   workon flask-env            # Establish working virtual environment with Flask
 #   python runserver.py
+#
+# The ServerMode configuration variable selects the server:
+#   development - the Werkzeug development server (the default)
+#   gunicorn    - ServerWorkers processes with ServerThreads threads each (pip install gunicorn)
+#   waitress    - one process with ServerThreads threads (pip install waitress)
 
-from app import app
+from app import create_app
 import configuration
 import Logging
 import logging
 import sys
 
+HOST = "0.0.0.0"
+PORT = 5001
+
+logger = logging.getLogger("app")
+
+app = create_app()
+
+
+def run_development():
+    # app.run('0.0.0.0', port=5001, debug=configuration.Configuration.Debug())
+    # Reference: https://blog.miguelgrinberg.com/post/setting-up-a-flask-application-in-pycharm
+    # Getting debugging to work with Flask. The use_reloader option is problematic.
+    # If you set it to True, Pycharm debugging does not work.
+    app.run(HOST, port=PORT,
+            debug=configuration.Configuration.Debug(),
+            use_debugger=False,
+            use_reloader=False,
+            passthrough_errors=True)
+
+
+def run_gunicorn():
+    """
+    Run the app under gunicorn. The app is loaded once in the master process
+    and the workers are forked from it. The AHPS connection pools and the
+    response cache are reset in each worker (see os.register_at_fork in
+    app/ahps). Send SIGHUP to the master for a graceful reload of the workers.
+    """
+    from gunicorn.app.base import BaseApplication
+
+    cfg = configuration.Configuration
+
+    def post_fork(server, worker):
+        logger.info("Worker %d started", worker.pid)
+
+    class GunicornServer(BaseApplication):
+        def __init__(self, application, options):
+            self.application = application
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for key, value in self.options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return self.application
+
+    max_requests = cfg.ServerMaxRequests()
+    options = {
+        "bind": "{0}:{1}".format(HOST, PORT),
+        "workers": cfg.ServerWorkers(),
+        "threads": cfg.ServerThreads(),
+        "worker_class": "gthread",
+        "keepalive": cfg.ServerKeepAlive(),
+        "graceful_timeout": cfg.ServerGracefulTimeout(),
+        "max_requests": max_requests,
+        # Spread out the worker restarts
+        "max_requests_jitter": max_requests // 10,
+        "preload_app": True,
+        "post_fork": post_fork,
+    }
+    logger.info("Starting gunicorn with %d workers and %d threads per worker",
+                options["workers"], options["threads"])
+    GunicornServer(app, options).run()
+
+
+def run_waitress():
+    """
+    Run the app under waitress, a multi-threaded single process server
+    """
+    import waitress
+
+    cfg = configuration.Configuration
+    logger.info("Starting waitress with %d threads", cfg.ServerThreads())
+    waitress.serve(app, host=HOST, port=PORT,
+                   threads=cfg.ServerThreads(),
+                   # Only applies to idle connections
+                   channel_timeout=cfg.ServerKeepAlive())
+
+
+SERVER_MODES = {
+    "development": run_development,
+    "gunicorn": run_gunicorn,
+    "waitress": run_waitress,
+}
+
 
 if __name__ == "__main__":
-    logger = logging.getLogger("app")
     logger.info(sys.version)
 
+    mode = configuration.Configuration.ServerMode()
     try:
-        # app.run('0.0.0.0', port=5001, debug=configuration.Configuration.Debug())
-        # Reference: https://blog.miguelgrinberg.com/post/setting-up-a-flask-application-in-pycharm
-        # Getting debugging to work with Flask. The use_reloader option is problematic.
-        # If you set it to True, Pycharm debugging does not work.
-        app.run('0.0.0.0', port=5001,
-                debug=configuration.Configuration.Debug(),
-                use_debugger=False,
-                use_reloader=False,
-                passthrough_errors=True)
+        run_server = SERVER_MODES.get(mode)
+        if run_server is None:
+            logger.error("Unknown ServerMode %s, using development", mode)
+            run_server = run_development
+        run_server()
+    except ImportError as ex:
+        logger.error("ServerMode %s is not installed: %s", mode, str(ex))
     except Exception as ex:
         print(ex)
 
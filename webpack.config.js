@@ -1,6 +1,7 @@
 var webpack = require('webpack');
 var path = require("path");
 // var SplitChunksPlugin = require("webpack/lib/optimize/SplitChunksPlugin");
+var { WebpackManifestPlugin } = require("webpack-manifest-plugin");
 
 console.log("");
 console.log("Webpack Development Build");
@@ -104,6 +105,11 @@ module.exports = {
 	},
 	devtool: process.env.WEBPACK_DEVTOOL || 'source-map',
 	plugins: [
-		new webpack.NoEmitOnErrorsPlugin()
+		new webpack.NoEmitOnErrorsPlugin(),
+		// Tells index.html which file holds each bundle
+		new WebpackManifestPlugin({
+			fileName: 'assets-manifest.json',
+			publicPath: ''
+		})
 	]
 };